@@ -0,0 +1,188 @@
+"""
+=============================================================================
+FORECAST READ BENCHMARK
+=============================================================================
+Compares the read latency of weather.GetWeatherForecast before and after the
+hot-table MERGE mode:
+
+- legacy: ROW_NUMBER() over every appended forecast (weather.WeatherForecast)
+- current: clustered range seek on weather.WeatherForecastCurrent
+
+Both shapes are rebuilt in session temp tables (same columns and indexes as
+the deployed tables) with synthetic data for each retention window, so the
+benchmark never touches production rows.
+
+Usage:
+    connstr="Driver=...;Server=...;" python benchmarks/forecast_read_benchmark.py \
+        --days 5 30 --cities 22 --runs-per-day 2 --iterations 200
+
+Output:
+    JSON with p50/p95/mean latency (ms) per retention window and query shape
+=============================================================================
+"""
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import time
+
+import pyodbc
+
+HOURS_PER_RUN = 24
+
+LEGACY_TABLE_QUERY = '''
+    CREATE TABLE #WeatherForecast (
+        CityCode CHAR(3) NOT NULL,
+        ForecastDate DATETIMEOFFSET,
+        EffectiveDate DATETIMEOFFSET,
+        IconPhrase NVARCHAR(100),
+        Phrase NVARCHAR(100),
+        Temperature FLOAT,
+        RealFeelTemperature FLOAT,
+        HasPrecipitation BIT,
+        PrecipitationType NVARCHAR(20),
+        PrecipitationIntensity NVARCHAR(20),
+        PrecipitationProbability INT,
+        TotalLiquid FLOAT,
+        Rain FLOAT
+    );
+    CREATE INDEX IX_CityCode_ForecastDate ON #WeatherForecast (CityCode, ForecastDate);
+    CREATE INDEX IX_CityCode_EffectiveDate ON #WeatherForecast (CityCode, EffectiveDate)
+        INCLUDE (Temperature, RealFeelTemperature, PrecipitationProbability);
+'''
+
+CURRENT_TABLE_QUERY = '''
+    SELECT TOP (0) * INTO #WeatherForecastCurrent FROM #WeatherForecast;
+    ALTER TABLE #WeatherForecastCurrent ALTER COLUMN EffectiveDate DATETIMEOFFSET NOT NULL;
+    ALTER TABLE #WeatherForecastCurrent ADD PRIMARY KEY CLUSTERED (CityCode, EffectiveDate);
+'''
+
+INSERT_COLUMNS = (
+    "CityCode, ForecastDate, EffectiveDate, IconPhrase, Phrase, Temperature, RealFeelTemperature, "
+    "HasPrecipitation, PrecipitationType, PrecipitationIntensity, PrecipitationProbability, TotalLiquid, Rain"
+)
+
+LEGACY_READ_QUERY = '''
+    WITH RankedForecasts AS (
+        SELECT *,
+               ROW_NUMBER() OVER (PARTITION BY CityCode, EffectiveDate ORDER BY ForecastDate DESC) AS rn
+        FROM #WeatherForecast
+        WHERE CityCode = ? AND EffectiveDate >= ?
+    )
+    SELECT TOP (12) CityCode, ForecastDate, EffectiveDate, Temperature, PrecipitationProbability
+    FROM RankedForecasts
+    WHERE rn = 1
+    ORDER BY EffectiveDate ASC;
+'''
+
+CURRENT_READ_QUERY = '''
+    SELECT TOP (12) CityCode, ForecastDate, EffectiveDate, Temperature, PrecipitationProbability
+    FROM #WeatherForecastCurrent
+    WHERE CityCode = ? AND EffectiveDate >= ?
+    ORDER BY EffectiveDate ASC;
+'''
+
+
+def city_codes(count: int) -> list:
+    return [f"C{index:02d}" for index in range(count)]
+
+
+def synthetic_forecasts(cities: list, days: int, runs_per_day: int, now: datetime.datetime) -> list:
+    """Rows as get_hourly_forecast appends them: every run forecasts the next 24 hours."""
+    rows = []
+    run_interval = datetime.timedelta(hours=24 / runs_per_day)
+    first_run = now - datetime.timedelta(days=days)
+    run_count = days * runs_per_day
+    for run in range(run_count + 1):
+        forecast_date = first_run + run * run_interval
+        base_hour = forecast_date.replace(minute=0, second=0, microsecond=0)
+        for city in cities:
+            for hour in range(1, HOURS_PER_RUN + 1):
+                effective = base_hour + datetime.timedelta(hours=hour)
+                rows.append((
+                    city, forecast_date, effective, "Nublado", "Nublado",
+                    18.0 + hour % 7, 17.5 + hour % 5, hour % 3 == 0, "Rain", "Light",
+                    (hour * 7) % 100, 0.2, 0.1,
+                ))
+    return rows
+
+
+def latest_per_key(rows: list) -> list:
+    latest = {}
+    for row in rows:
+        key = (row[0], row[2])
+        if key not in latest or latest[key][1] <= row[1]:
+            latest[key] = row
+    return list(latest.values())
+
+
+def time_query(cursor, query: str, cities: list, now: datetime.datetime, iterations: int) -> dict:
+    samples = []
+    for index in range(iterations):
+        start = time.perf_counter()
+        cursor.execute(query, cities[index % len(cities)], now)
+        cursor.fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+def run_window(conn, days: int, cities: list, runs_per_day: int, iterations: int) -> dict:
+    cursor = conn.cursor()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cursor.execute("IF OBJECT_ID('tempdb..#WeatherForecastCurrent') IS NOT NULL DROP TABLE #WeatherForecastCurrent;")
+    cursor.execute("IF OBJECT_ID('tempdb..#WeatherForecast') IS NOT NULL DROP TABLE #WeatherForecast;")
+    cursor.execute(LEGACY_TABLE_QUERY)
+    cursor.execute(CURRENT_TABLE_QUERY)
+
+    rows = synthetic_forecasts(cities, days, runs_per_day, now)
+    current_rows = latest_per_key(rows)
+    placeholders = ", ".join("?" for _ in range(13))
+    cursor.fast_executemany = True
+    cursor.executemany(f"INSERT INTO #WeatherForecast ({INSERT_COLUMNS}) VALUES ({placeholders})", rows)
+    cursor.executemany(f"INSERT INTO #WeatherForecastCurrent ({INSERT_COLUMNS}) VALUES ({placeholders})", current_rows)
+    cursor.fast_executemany = False
+    conn.commit()
+
+    # Warm the plan cache and buffer pool before measuring
+    time_query(cursor, LEGACY_READ_QUERY, cities, now, len(cities))
+    time_query(cursor, CURRENT_READ_QUERY, cities, now, len(cities))
+
+    return {
+        "retention_days": days,
+        "legacy_rows": len(rows),
+        "current_rows": len(current_rows),
+        "legacy": time_query(cursor, LEGACY_READ_QUERY, cities, now, iterations),
+        "current": time_query(cursor, CURRENT_READ_QUERY, cities, now, iterations),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark forecast read latency (append vs MERGE hot table)")
+    parser.add_argument("--days", type=int, nargs="+", default=[5, 30], help="Retention windows to compare")
+    parser.add_argument("--cities", type=int, default=22, help="Number of synthetic cities")
+    parser.add_argument("--runs-per-day", type=int, default=2, help="Forecast runs per day")
+    parser.add_argument("--iterations", type=int, default=200, help="Timed reads per query shape")
+    args = parser.parse_args()
+
+    connection_string = os.environ.get("connstr")
+    if not connection_string:
+        raise SystemExit("Set the connstr environment variable to a SQL Server connection string")
+
+    conn = pyodbc.connect(connection_string)
+    try:
+        cities = city_codes(args.cities)
+        results = [run_window(conn, days, cities, args.runs_per_day, args.iterations) for days in args.days]
+    finally:
+        conn.close()
+    print(json.dumps({"benchmark": "forecast_read", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
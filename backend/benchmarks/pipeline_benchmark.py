@@ -0,0 +1,616 @@
+"""
+=============================================================================
+PIPELINE BENCHMARK
+=============================================================================
+Runs the run_city_batch and get_hourly_forecast entry points offline against
+local stand-ins and reports their performance for growing city counts.
+
+Stand-ins:
+- Replay HTTP server serving the recorded responses in benchmarks/fixtures
+  (OpenWeatherMap weather / air pollution, Azure Maps hourly forecast, NASA
+  get-abi page and image, Data API city list, marker icon) with configurable
+  latency. Observation timestamps are advanced per request so the
+  de-duplication and response caches see fresh data, as in production.
+- In-memory blob store with the subset of the azure-storage-blob API the
+  functions use.
+- Fake pyodbc module whose cursor accepts every statement and counts the
+  rows written per table. No real database or storage account is touched.
+
+Every city count runs in its own subprocess so peak RSS, caches and pooled
+connections start from a cold worker each time.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py --cities 20 200 2000 --latency-ms 40
+    python benchmarks/pipeline_benchmark.py --cities 20 --compare results/previous.json
+
+Output:
+    JSON (stdout and --output) with, per city count and entry point: wall
+    time, throughput in cities/sec, per-stage and per-provider latency
+    percentiles, rows written, blob objects, peak RSS and (with --tracemalloc)
+    allocation peaks
+=============================================================================
+"""
+
+import argparse
+import datetime
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARK_DIR)
+FIXTURE_DIR = os.path.join(BENCHMARK_DIR, "fixtures")
+MARKER_ICON_PATH = os.path.join(BACKEND_DIR, "assets", "marker.png")
+
+# Bounding box used to spread synthetic cities over Guatemala
+LATITUDE_RANGE = (13.8, 17.8)
+LONGITUDE_RANGE = (-92.2, -88.3)
+
+# Synthetic OpenWeatherMap city ids: OWM_CITY_ID_BASE + city index
+OWM_CITY_ID_BASE = 3590000
+
+
+# =============================================================================
+# REPLAY HTTP SERVER
+# =============================================================================
+
+def _load_fixture(name: str):
+    with open(os.path.join(FIXTURE_DIR, name), "rb") as fixture:
+        data = fixture.read()
+    return json.loads(data) if name.endswith(".json") else data
+
+
+def synthetic_cities(count: int, seed: int = 7) -> list:
+    """City records shaped like the Data API response, with unique 3-character codes."""
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    rng = random.Random(seed)
+    cities = []
+    for index in range(count):
+        code = "".join(alphabet[(index // 36 ** power) % 36] for power in (2, 1, 0))
+        cities.append({
+            "CityCode": code,
+            "CityName": f"Ciudad {code}",
+            "Latitude": round(rng.uniform(*LATITUDE_RANGE), 4),
+            "Longitude": round(rng.uniform(*LONGITUDE_RANGE), 4),
+            # As persisted after the first tick, so /data/2.5/group is exercised
+            "OwmCityId": OWM_CITY_ID_BASE + index,
+        })
+    return cities
+
+
+def _satellite_image_bytes(size: int) -> bytes:
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (size, size), (12, 24, 48))
+    draw = ImageDraw.Draw(image)
+    for offset in range(0, size, 40):
+        draw.line((offset, 0, size - offset, size), fill=(200, 200, 200), width=3)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Serves the recorded fixtures; per-server settings live on self.server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, payload) -> None:
+        self._send(200, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        if server.latency_ms or server.jitter_ms:
+            time.sleep((server.latency_ms + random.uniform(0, server.jitter_ms)) / 1000)
+        with server.lock:
+            server.requests += 1
+            tick = server.requests
+
+        if parts.path == "/rest/GetCities":
+            self._send_json({"value": server.cities})
+        elif parts.path == "/data/2.5/weather":
+            payload = json.loads(json.dumps(server.fixtures["weather"]))
+            payload["coord"] = {"lat": float(query.get("lat", 0)), "lon": float(query.get("lon", 0))}
+            payload["dt"] = int(time.time()) + tick
+            city = server.cities_by_coord.get((payload["coord"]["lat"], payload["coord"]["lon"]))
+            if city is not None:
+                payload["id"] = city["OwmCityId"]
+            self._send_json(payload)
+        elif parts.path == "/data/2.5/group":
+            items = []
+            for owm_city_id in query.get("id", "").split(","):
+                city = server.cities_by_id.get(int(owm_city_id)) if owm_city_id.isdigit() else None
+                if city is None:
+                    continue
+                item = json.loads(json.dumps(server.fixtures["weather"]))
+                # Group items carry the UTC offset under sys and have no "base"
+                item["sys"]["timezone"] = item.pop("timezone")
+                item.pop("base", None)
+                item.update(id=city["OwmCityId"], dt=int(time.time()) + tick,
+                            coord={"lat": city["Latitude"], "lon": city["Longitude"]})
+                items.append(item)
+            self._send_json({"cnt": len(items), "list": items})
+        elif parts.path == "/data/2.5/air_pollution":
+            payload = json.loads(json.dumps(server.fixtures["air_pollution"]))
+            payload["list"][0]["dt"] = int(time.time()) + tick
+            self._send_json(payload)
+        elif parts.path == "/weather/forecast/hourly/json":
+            self._send_json(server.fixtures["forecast"])
+        elif parts.path == "/cgi-bin/get-abi":
+            self._send(200, server.fixtures["nasa_page"], "text/html")
+        elif parts.path.startswith("/tmp/"):
+            self._send(200, server.satellite_image, "image/jpeg")
+        elif parts.path.endswith("marker.png"):
+            self._send(200, server.marker_icon, "image/png")
+        else:
+            self._send(404, b"not recorded", "text/plain")
+
+
+def start_replay_server(city_count: int, latency_ms: float, jitter_ms: float, image_size: int):
+    """
+    Start the replay server on a free localhost port.
+
+    Returns:
+        tuple: (server, base_url)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ReplayHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.cities = synthetic_cities(city_count)
+    server.cities_by_id = {city["OwmCityId"]: city for city in server.cities}
+    server.cities_by_coord = {(city["Latitude"], city["Longitude"]): city for city in server.cities}
+    server.fixtures = {
+        "weather": _load_fixture("owm_weather.json"),
+        "air_pollution": _load_fixture("owm_air_pollution.json"),
+        "forecast": _load_fixture("azure_maps_hourly.json"),
+        "nasa_page": _load_fixture("nasa_get_abi.html"),
+    }
+    server.satellite_image = _satellite_image_bytes(image_size)
+    with open(MARKER_ICON_PATH, "rb") as icon:
+        server.marker_icon = icon.read()
+    threading.Thread(target=server.serve_forever, name="replay-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# =============================================================================
+# IN-MEMORY BLOB STORE
+# =============================================================================
+
+def _memory_etag(data: bytes) -> str:
+    return f'"{len(data)}-{zlib.crc32(data)}"'
+
+
+class MemoryDownload:
+    def __init__(self, data: bytes):
+        self._data = data
+        self.properties = types.SimpleNamespace(etag=_memory_etag(data))
+
+    def readall(self) -> bytes:
+        return self._data
+
+
+class MemoryBlobClient:
+    def __init__(self, store, container: str, name: str):
+        self._store, self._container, self._name = store, container, name
+
+    def upload_blob(self, data, blob_type=None, overwrite=False, etag=None, match_condition=None, **kwargs):
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+
+        if hasattr(data, "getvalue"):
+            data = data.getvalue()
+        elif hasattr(data, "read"):
+            data = data.read()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self._store.lock:
+            current = self._store.blobs.get((self._container, self._name))
+            if etag is not None and (current is None or _memory_etag(current) != etag):
+                raise ResourceModifiedError(f"{self._name} was modified")
+            if current is not None and not overwrite:
+                raise ResourceExistsError(f"{self._name} already exists")
+            self._store.blobs[(self._container, self._name)] = bytes(data)
+            self._store.uploads += 1
+
+    def download_blob(self, **kwargs):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        with self._store.lock:
+            data = self._store.blobs.get((self._container, self._name))
+            self._store.downloads += 1
+        if data is None:
+            raise ResourceNotFoundError(f"{self._name} not found")
+        return MemoryDownload(data)
+
+
+class MemoryContainerClient:
+    def __init__(self, store, container: str):
+        self._store, self._container = store, container
+
+    def get_blob_client(self, blob: str):
+        return MemoryBlobClient(self._store, self._container, blob)
+
+    def list_blobs(self, name_starts_with: str = ""):
+        with self._store.lock:
+            items = sorted(
+                (name, len(data)) for (container, name), data in self._store.blobs.items()
+                if container == self._container and name.startswith(name_starts_with)
+            )
+        return [types.SimpleNamespace(name=name, size=size) for name, size in items]
+
+    def walk_blobs(self, delimiter: str = "/"):
+        prefixes = sorted({blob.name.split(delimiter)[0] + delimiter for blob in self.list_blobs()})
+        return [types.SimpleNamespace(name=prefix) for prefix in prefixes]
+
+    def delete_blobs(self, *names):
+        with self._store.lock:
+            for name in names:
+                self._store.blobs.pop((self._container, name), None)
+
+
+class MemoryBlobStore:
+    """Stand-in for BlobServiceClient."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blobs = {}
+        self.uploads = 0
+        self.downloads = 0
+
+    def get_blob_client(self, container: str, blob: str):
+        return MemoryBlobClient(self, container, blob)
+
+    def get_container_client(self, container: str):
+        return MemoryContainerClient(self, container)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "objects": len(self.blobs),
+                "bytes": sum(len(data) for data in self.blobs.values()),
+                "uploads": self.uploads,
+                "downloads": self.downloads,
+            }
+
+
+# =============================================================================
+# FAKE DATABASE
+# =============================================================================
+
+def build_fake_pyodbc(rows_written: dict):
+    """
+    Minimal pyodbc replacement: statements succeed, SELECTs return no rows and
+    every executemany is counted per target table in rows_written.
+    """
+    module = types.ModuleType("pyodbc")
+
+    class Error(Exception):
+        pass
+
+    class FakeCursor:
+        def __init__(self, connection):
+            self.connection = connection
+            self.fast_executemany = False
+            self.rowcount = 0
+
+        def execute(self, query, *params):
+            self.rowcount = 0
+            return self
+
+        def executemany(self, query, rows):
+            table = query.split("INTO", 1)[1].split("(", 1)[0].strip()
+            rows_written[table] = rows_written.get(table, 0) + len(rows)
+            self.rowcount = len(rows)
+
+        def fetchone(self):
+            return (1,)
+
+        def fetchall(self):
+            return []
+
+        def close(self):
+            pass
+
+    class FakeConnection:
+        def cursor(self):
+            return FakeCursor(self)
+
+        def commit(self):
+            pass
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    module.Error = Error
+    module.connect = lambda connection_string, **kwargs: FakeConnection()
+    return module
+
+
+# =============================================================================
+# MEASUREMENT
+# =============================================================================
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 2)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def _provider_for(url: str) -> str:
+    path = urlsplit(url).path
+    if "air_pollution" in path:
+        return "owm_air_pollution"
+    if "/data/2.5/weather" in path:
+        return "owm_weather"
+    if "/data/2.5/group" in path:
+        return "owm_weather_group"
+    if "forecast" in path:
+        return "azure_maps_forecast"
+    if "get-abi" in path:
+        return "nasa_page"
+    if path.startswith("/tmp/"):
+        return "nasa_image"
+    if "GetCities" in path:
+        return "cities_api"
+    return "other"
+
+
+def run_worker(args) -> dict:
+    """Run both entry points once for args.worker_cities cities inside this process."""
+    import tracemalloc
+
+    work_dir = tempfile.mkdtemp(prefix="climaguate-bench-")
+    os.environ.update({
+        "connstr": "Driver=fake;Server=benchmark",
+        "apikey": "benchmark",
+        "azuremapskey": "benchmark",
+        "OPENWEATHER_BASE_URL": args.base_url,
+        "AZURE_MAPS_BASE_URL": args.base_url,
+        "NASA_BASE_URL": args.base_url,
+        "CITIES_API_URL": f"{args.base_url}/rest/GetCities",
+        "MARKER_ICON_URL": f"{args.base_url}/images/icons/marker.png",
+        "SATELLITE_PROCESSING_MODE": "queue" if args.satellite_mode == "off" else args.satellite_mode,
+        "CITY_CACHE_SNAPSHOT_PATH": os.path.join(work_dir, "cities.json"),
+        "WRITE_SPOOL_DIR": os.path.join(work_dir, "spool"),
+        "ANIMATION_FRAME_CACHE_DIR": os.path.join(work_dir, "frames"),
+        "COLD_START_PRELOAD": "lazy",
+        "HTTP_MAX_RETRIES": "0",
+        "HTTP_POOL_MAXSIZE": str(args.pool_size),
+    })
+
+    rows_written = {}
+    sys.modules["pyodbc"] = build_fake_pyodbc(rows_written)
+    sys.path.insert(0, BACKEND_DIR)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    import_start = time.perf_counter()
+    import function_app as fa
+    import_seconds = time.perf_counter() - import_start
+
+    blob_store = MemoryBlobStore()
+    fa.resources.blob_service_client = lambda: blob_store
+
+    stage_samples = {}
+    http_samples = {}
+    samples_lock = threading.Lock()
+
+    class RecordingStageTimings(fa.StageTimings):
+        @contextmanager
+        def measure(self, stage: str):
+            start = time.perf_counter()
+            with super().measure(stage):
+                yield
+            with samples_lock:
+                stage_samples.setdefault(stage, []).append(time.perf_counter() - start)
+
+    original_http_get = fa.http_get
+
+    def recording_http_get(url, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original_http_get(url, **kwargs)
+        finally:
+            with samples_lock:
+                http_samples.setdefault(_provider_for(url), []).append(time.perf_counter() - start)
+
+    original_satellite_job = fa.handle_satellite_job
+
+    def recording_satellite_job(message_body, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original_satellite_job(message_body, **kwargs)
+        finally:
+            with samples_lock:
+                stage_samples.setdefault("satellite_job", []).append(time.perf_counter() - start)
+
+    run_records = {}
+    original_finish_run = fa.finish_run
+
+    def recording_finish_run(run):
+        record = original_finish_run(run)
+        if record:
+            run_records[record["run"]] = record
+        return record
+
+    fa.StageTimings = RecordingStageTimings
+    fa.finish_run = recording_finish_run
+    fa.http_get = recording_http_get
+    fa.handle_satellite_job = recording_satellite_job
+
+    timer = types.SimpleNamespace(past_due=False)
+    results = {"cities": args.worker_cities, "import_seconds": round(import_seconds, 3), "entry_points": {}}
+
+    entry_points = [
+        ("run_city_batch", lambda: fa.run_city_batch(timer, fa.InProcessQueue(), fa.InProcessQueue())),
+        ("get_hourly_forecast", lambda: fa.get_hourly_forecast(timer)),
+    ]
+    for name, entry_point in entry_points:
+        stage_samples.clear()
+        http_samples.clear()
+        rows_written.clear()
+        if args.tracemalloc:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        entry_point()
+        wall = time.perf_counter() - start
+
+        entry_result = {
+            "wall_seconds": round(wall, 3),
+            "cities_per_second": round(args.worker_cities / wall, 2) if wall else None,
+            "stages": {stage: percentiles(values) for stage, values in stage_samples.items()},
+            "http": {provider: percentiles(values) for provider, values in http_samples.items()},
+            "rows_written": dict(rows_written),
+        }
+        if name in run_records:
+            entry_result["metrics"] = {key: run_records[name][key] for key in ("spans", "counters", "gauges", "bytes")}
+        if args.tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            entry_result["allocations"] = {
+                "traced_current_mb": round(current / 1024 / 1024, 2),
+                "traced_peak_mb": round(peak / 1024 / 1024, 2),
+                "live_blocks": sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename")),
+            }
+        results["entry_points"][name] = entry_result
+
+    results["blob_store"] = blob_store.stats()
+    results["peak_rss_mb"] = round(fa._peak_rss_mb() or 0, 1)
+    return results
+
+
+def compare(results: dict, baseline_path: str) -> list:
+    """Relative change of the headline metrics against an earlier results file."""
+    with open(baseline_path, "r", encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {run["cities"]: run for run in baseline.get("runs", [])}
+    lines = []
+    for run in results["runs"]:
+        before = previous.get(run["cities"])
+        if before is None:
+            continue
+        for name, entry in run["entry_points"].items():
+            old = before["entry_points"].get(name)
+            if not old:
+                continue
+            for metric in ("wall_seconds", "cities_per_second"):
+                if old.get(metric):
+                    change = (entry[metric] - old[metric]) / old[metric] * 100
+                    lines.append(f"{run['cities']:>5} cities {name} {metric}: {old[metric]} -> {entry[metric]} ({change:+.1f}%)")
+        if before.get("peak_rss_mb"):
+            change = (run["peak_rss_mb"] - before["peak_rss_mb"]) / before["peak_rss_mb"] * 100
+            lines.append(f"{run['cities']:>5} cities peak_rss_mb: {before['peak_rss_mb']} -> {run['peak_rss_mb']} ({change:+.1f}%)")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collection pipeline against local stand-ins")
+    parser.add_argument("--cities", type=int, nargs="+", default=[20, 200, 2000], help="City counts to run")
+    parser.add_argument("--latency-ms", type=float, default=40.0, help="Latency added to every replayed response")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="Random extra latency per response")
+    parser.add_argument("--image-size", type=int, default=1000, help="Edge of the replayed NASA image in pixels")
+    parser.add_argument("--satellite-mode", choices=("local", "inline", "off"), default="local",
+                        help="How satellite jobs run inside the benchmark (off = enqueue only)")
+    parser.add_argument("--pool-size", type=int, default=16, help="HTTP_POOL_MAXSIZE for the run")
+    parser.add_argument("--tracemalloc", action="store_true", help="Track Python allocations (slower)")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-cities", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    results = {
+        "benchmark": "pipeline",
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "settings": {
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "image_size": args.image_size,
+            "satellite_mode": args.satellite_mode,
+            "pool_size": args.pool_size,
+            "tracemalloc": args.tracemalloc,
+        },
+        "runs": [],
+    }
+    for city_count in args.cities:
+        server, base_url = start_replay_server(city_count, args.latency_ms, args.jitter_ms, args.image_size)
+        try:
+            command = [
+                sys.executable, os.path.abspath(__file__), "--worker",
+                "--worker-cities", str(city_count), "--base-url", base_url,
+                "--satellite-mode", args.satellite_mode, "--pool-size", str(args.pool_size),
+            ]
+            if args.tracemalloc:
+                command.append("--tracemalloc")
+            completed = subprocess.run(command, capture_output=True, text=True, check=True)
+            run = json.loads(completed.stdout.strip().splitlines()[-1])
+            run["upstream_requests"] = server.requests
+            results["runs"].append(run)
+            print(
+                f"{city_count:>5} cities: run_city_batch {run['entry_points']['run_city_batch']['wall_seconds']}s, "
+                f"get_hourly_forecast {run['entry_points']['get_hourly_forecast']['wall_seconds']}s, "
+                f"peak RSS {run['peak_rss_mb']}MB",
+                file=sys.stderr,
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    if args.compare:
+        for line in compare(results, args.compare):
+            print(line, file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+=============================================================================
+CROP SUITABILITY SCORING - PARITY CHECK AND BENCHMARK
+=============================================================================
+Checks that the vectorized score_suitability() in function_app.py returns
+exactly what agriculture.CalculateSuitabilityScore returns, and measures it
+against scoring one row at a time. The reference and pair generators below
+are also imported by tests/test_suitability.py, which runs the offline
+parity in the pytest suite.
+
+Offline (default):
+- parity against a row-by-row Decimal transliteration of the UDF on random
+  city x crop pairs plus an exhaustive grid around every branch boundary
+  (thresholds, NULLs, humidity adjustments pushing past 0 and 100)
+- timing: vectorized batch vs the per-row transliteration
+
+With --sql (connstr environment variable set):
+- the same pairs are loaded into a session temp table and scored by the
+  deployed UDF; every score must match the vectorized result
+- timing: vectorized batch vs one UDF call per row (--udf-calls sampled
+  round trips) and vs the set-based query that calls the UDF per row
+
+Usage:
+    python benchmarks/suitability_benchmark.py --pairs 100000
+    connstr="Driver=...;Server=...;" python benchmarks/suitability_benchmark.py --sql --udf-calls 500
+
+Output:
+    JSON with mismatch counts and timings; exits with status 1 on any mismatch
+=============================================================================
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("COLD_START_PRELOAD", "lazy")
+
+from function_app import score_suitability  # noqa: E402
+
+# Column order of score_suitability() and agriculture.CalculateSuitabilityScore
+FIELDS = (
+    "observed_temp", "observed_humidity",
+    "optimal_temp_min", "optimal_temp_max", "optimal_humidity_min", "optimal_humidity_max",
+    "stress_temp_min", "stress_temp_max", "local_temp_adjustment", "local_humidity_adjustment",
+)
+
+INPUT_TABLE_QUERY = '''
+    CREATE TABLE #SuitabilityInput (
+        Id INT NOT NULL PRIMARY KEY,
+        ObservedTempC FLOAT NULL, ObservedHumidityPct INT NULL,
+        OptimalTempMin FLOAT NOT NULL, OptimalTempMax FLOAT NOT NULL,
+        OptimalHumidityMin INT NOT NULL, OptimalHumidityMax INT NOT NULL,
+        StressTempMin FLOAT NOT NULL, StressTempMax FLOAT NOT NULL,
+        LocalTempAdjustment FLOAT NULL, LocalHumidityAdjustment INT NULL
+    );
+'''
+
+INPUT_INSERT_QUERY = "INSERT INTO #SuitabilityInput VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+UDF_ARGUMENTS = (
+    "ObservedTempC, ObservedHumidityPct, OptimalTempMin, OptimalTempMax, OptimalHumidityMin, "
+    "OptimalHumidityMax, StressTempMin, StressTempMax, LocalTempAdjustment, LocalHumidityAdjustment"
+)
+
+SET_BASED_QUERY = f"SELECT Id, agriculture.CalculateSuitabilityScore({UDF_ARGUMENTS}) FROM #SuitabilityInput ORDER BY Id"
+
+SINGLE_CALL_QUERY = "SELECT agriculture.CalculateSuitabilityScore(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def reference_score(
+    observed_temp, observed_humidity, optimal_temp_min, optimal_temp_max,
+    optimal_humidity_min, optimal_humidity_max, stress_temp_min, stress_temp_max,
+    local_temp_adjustment, local_humidity_adjustment,
+):
+    """
+    Row-by-row transliteration of the UDF. Returns None for a NULL result and
+    raises ArithmeticError where SQL Server would abort the statement.
+    """
+    if None in (observed_temp, observed_humidity, local_temp_adjustment, local_humidity_adjustment):
+        return None
+
+    adjusted_temp = observed_temp + local_temp_adjustment
+    adjusted_humidity = observed_humidity + local_humidity_adjustment
+
+    if optimal_temp_min <= adjusted_temp <= optimal_temp_max:
+        temp_score = 100.0
+    elif adjusted_temp < optimal_temp_min:
+        if adjusted_temp <= stress_temp_min:
+            temp_score = 0.0
+        else:
+            temp_score = 100.0 * (adjusted_temp - stress_temp_min) / (optimal_temp_min - stress_temp_min)
+    elif adjusted_temp >= stress_temp_max:
+        temp_score = 0.0
+    else:
+        temp_score = 100.0 * (stress_temp_max - adjusted_temp) / (stress_temp_max - optimal_temp_max)
+
+    # 100.0 * INT / INT is DECIMAL(15,1) / INT -> DECIMAL(26,12), truncated
+    if optimal_humidity_min <= adjusted_humidity <= optimal_humidity_max:
+        humidity_score = 100.0
+    else:
+        if adjusted_humidity < optimal_humidity_min:
+            numerator, denominator = adjusted_humidity, optimal_humidity_min
+        else:
+            numerator, denominator = 100 - adjusted_humidity, 100 - optimal_humidity_max
+        if denominator == 0:
+            raise ZeroDivisionError("Divide by zero error encountered.")
+        quotient = (Decimal("100.0") * numerator / denominator).quantize(Decimal("1E-12"), rounding=ROUND_DOWN)
+        humidity_score = float(quotient)
+
+    combined = 0.6 * temp_score + 0.4 * humidity_score
+    rounded = Decimal(combined).quantize(Decimal("1"), rounding=ROUND_HALF_UP)
+    if rounded < 0 or rounded > 255:
+        raise OverflowError("Arithmetic overflow error converting float to data type tinyint.")
+    return min(int(rounded), 100)
+
+
+def random_pairs(count: int, seed: int) -> list:
+    """Random crop profiles within the Crops/CityCrops check constraints."""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        stress_temp_min = round(rng.uniform(-5, 15), 1)
+        optimal_temp_min = round(stress_temp_min + rng.uniform(0, 10), 1)
+        optimal_temp_max = round(optimal_temp_min + rng.uniform(0.1, 12), 1)
+        stress_temp_max = round(optimal_temp_max + rng.uniform(0, 10), 1)
+        optimal_humidity_min = rng.randint(0, 90)
+        optimal_humidity_max = rng.randint(optimal_humidity_min + 1, 100)
+        rows.append((
+            None if rng.random() < 0.02 else round(rng.uniform(-5, 45), 2),
+            None if rng.random() < 0.02 else rng.randint(0, 100),
+            optimal_temp_min, optimal_temp_max, optimal_humidity_min, optimal_humidity_max,
+            stress_temp_min, stress_temp_max,
+            None if rng.random() < 0.01 else round(rng.uniform(-10, 10), 1),
+            None if rng.random() < 0.01 else rng.randint(-50, 50),
+        ))
+    return rows
+
+
+def boundary_pairs() -> list:
+    """Every humidity/adjustment combination on a few profiles, temperatures on each threshold."""
+    rows = []
+    profiles = [
+        (18.0, 24.0, 60, 80, 10.0, 30.0),
+        (20.0, 30.0, 1, 99, 20.0, 30.0),
+        (15.0, 22.0, 0, 100, 5.0, 32.0),
+        (24.0, 32.0, 70, 100, 18.0, 38.0),
+    ]
+    for optimal_temp_min, optimal_temp_max, humidity_min, humidity_max, stress_min, stress_max in profiles:
+        temps = {stress_min, optimal_temp_min, optimal_temp_max, stress_max,
+                 stress_min + 0.1, optimal_temp_min - 0.1, optimal_temp_max + 0.1, stress_max - 0.1}
+        for temp in sorted(temps):
+            for humidity in range(0, 101, 5):
+                for humidity_adjustment in (-50, -20, -1, 0, 1, 20, 50):
+                    rows.append((
+                        temp, humidity, optimal_temp_min, optimal_temp_max, humidity_min, humidity_max,
+                        stress_min, stress_max, 0.0, humidity_adjustment,
+                    ))
+    return rows
+
+
+def reference_results(rows: list) -> list:
+    """Reference scores; "error" where the UDF would raise."""
+    results = []
+    for row in rows:
+        try:
+            results.append(reference_score(*row))
+        except ArithmeticError:
+            results.append("error")
+    return results
+
+
+def as_columns(rows: list) -> list:
+    """One float array per UDF argument, NaN for NULL (what build_city_crop_scores passes)."""
+    import numpy as np
+
+    nan = float("nan")
+    return [
+        np.array([nan if value is None else value for value in column], dtype=np.float64)
+        for column in zip(*rows)
+    ]
+
+
+def as_scores(scores) -> list:
+    return [None if score != score else int(score) for score in scores.tolist()]
+
+
+def parity(rows: list, expected: list, actual: list) -> dict:
+    """Vectorized NaN must line up with a NULL or an error in the expected results."""
+    mismatches = []
+    for row, want, got in zip(rows, expected, actual):
+        if (want in (None, "error") and got is None) or want == got:
+            continue
+        mismatches.append({"inputs": dict(zip(FIELDS, row)), "expected": want, "vectorized": got})
+    return {"rows": len(rows), "mismatches": len(mismatches), "examples": mismatches[:5]}
+
+
+def timed(function, *args) -> tuple:
+    start = time.perf_counter()
+    result = function(*args)
+    return result, round((time.perf_counter() - start) * 1000, 2)
+
+
+def run_sql(rows: list, vectorized: list, expected: list, udf_calls: int) -> dict:
+    """Score the rows with the deployed UDF and time it against the vectorized pass."""
+    import pyodbc
+
+    connection_string = os.environ.get("connstr")
+    if not connection_string:
+        raise SystemExit("Set the connstr environment variable to a SQL Server connection string")
+
+    # Rows the UDF rejects would abort the whole statement
+    indexes = [index for index, want in enumerate(expected) if want != "error"]
+    conn = pyodbc.connect(connection_string)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(INPUT_TABLE_QUERY)
+        cursor.fast_executemany = True
+        cursor.executemany(INPUT_INSERT_QUERY, [(index,) + rows[index] for index in indexes])
+        cursor.fast_executemany = False
+
+        udf_rows, set_based_ms = timed(lambda: cursor.execute(SET_BASED_QUERY).fetchall())
+        udf_scores = {row[0]: row[1] for row in udf_rows}
+        sql_parity = parity(
+            [rows[index] for index in indexes],
+            [udf_scores[index] for index in indexes],
+            [vectorized[index] for index in indexes],
+        )
+
+        sample = indexes[:udf_calls]
+        _, per_row_ms = timed(lambda: [cursor.execute(SINGLE_CALL_QUERY, *rows[index]).fetchone() for index in sample])
+    finally:
+        conn.close()
+
+    return {
+        "parity_vs_udf": sql_parity,
+        "udf_set_based_ms": set_based_ms,
+        "udf_per_row_calls": len(sample),
+        "udf_per_row_ms": per_row_ms,
+        "udf_per_row_projected_ms": round(per_row_ms / max(len(sample), 1) * len(indexes), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vectorized crop suitability scoring: parity and benchmark")
+    parser.add_argument("--pairs", type=int, default=100000, help="Random city x crop pairs to score")
+    parser.add_argument("--seed", type=int, default=7, help="Seed for the random pairs")
+    parser.add_argument("--sql", action="store_true", help="Also compare against the deployed UDF (needs connstr)")
+    parser.add_argument("--udf-calls", type=int, default=500, help="Single-row UDF round trips to time with --sql")
+    args = parser.parse_args()
+
+    rows = boundary_pairs() + random_pairs(args.pairs, args.seed)
+
+    columns = as_columns(rows)
+    score_suitability(*(column[:10] for column in columns))  # import NumPy outside the timing
+
+    expected, reference_ms = timed(reference_results, rows)
+    scores, vectorized_ms = timed(score_suitability, *columns)
+    vectorized = as_scores(scores["score"])
+    results = {
+        "benchmark": "suitability_scoring",
+        "pairs": len(rows),
+        "udf_errors": expected.count("error"),
+        "parity_vs_reference": parity(rows, expected, vectorized),
+        "reference_per_row_ms": reference_ms,
+        "vectorized_ms": vectorized_ms,
+        "speedup_vs_reference": round(reference_ms / vectorized_ms, 1) if vectorized_ms else None,
+    }
+    if args.sql:
+        results["sql"] = run_sql(rows, vectorized, expected, args.udf_calls)
+
+    print(json.dumps(results, indent=2, default=str))
+    mismatches = results["parity_vs_reference"]["mismatches"] + results.get("sql", {}).get(
+        "parity_vs_udf", {}
+    ).get("mismatches", 0)
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,12 +17,25 @@ Functions:
 1. run_city_batch: Timer-triggered function (every 15 minutes)
    - Collects current weather data for all cities
    - Retrieves air quality information
-   - Downloads and processes NASA satellite images
+   - Enqueues one satellite job per city
+   - With CITY_SHARD_COUNT > 1, enqueues one message per city shard instead
    
 2. get_quarterday_forecast: Timer-triggered function (every 12 hours)
    - Fetches extended weather forecasts
    - Stores forecast data for chart generation
 
+3. prune_satellite_frames: Timer-triggered function (daily)
+   - Deletes satellite frames older than the retention window
+   - Optionally rolls them into daily archive blobs
+
+4. process_satellite_job: Queue-triggered function (satellite-jobs)
+   - Downloads and processes NASA satellite images
+   - Regenerates the city's satellite animation
+
+5. process_city_shard: Queue-triggered function (city-shards)
+   - Leases one shard of the tick in dbo.JobRunLock
+   - Runs the city batch for that shard's cities only
+
 Technical Stack:
 - Azure Functions with Python runtime
 - OpenWeatherMap API for weather and air quality data
@@ -46,6 +59,19 @@ import logging
 import datetime
 import os
 import json
+import time
+import queue
+import threading
+import tempfile
+import typing
+import bisect
+import heapq
+import itertools
+import contextvars
+from contextlib import contextmanager
+
+# Start of the cold-start clock (see ResourceRegistry.report)
+_MODULE_IMPORT_START = time.perf_counter()
 
 import azure.functions as func
 
@@ -56,572 +82,4586 @@ import azure.functions as func
 app = func.FunctionApp()
 
 # =============================================================================
-# HELPER FUNCTIONS - DATA RETRIEVAL AND PROCESSING
+# CONFIGURATION HELPERS
 # =============================================================================
 
-def get_cities_from_api():
+def get_env_number(setting: str, default, cast=int, minimum=None):
     """
-    Fetch cities from Data API Builder endpoint using urllib.
-    
-    This function retrieves the list of cities configured in the system
-    along with their coordinates for weather data collection.
-    
+    Read a numeric app setting, falling back to the default when it is
+    missing or invalid so a typo in the portal never breaks a run.
+
+    Args:
+        setting (str): Environment variable name
+        default: Value used when the setting is missing or invalid
+        cast: Conversion callable (int or float)
+        minimum: Optional lower bound applied to the parsed value
+
     Returns:
-        list: List of city dictionaries containing CityCode, CityName, 
-              Latitude, and Longitude, or empty list on failure
-              
-    Error Handling:
-        - HTTP errors from the API endpoint
-        - Network timeouts and connection issues  
-        - JSON parsing errors
+        The parsed (and clamped) value, or the default
     """
-    from urllib.request import urlopen, Request
-    from urllib.error import URLError, HTTPError
-    import time
-    import ssl
+    raw_value = os.environ.get(setting)
+    if not raw_value:
+        return default
+    try:
+        value = cast(raw_value)
+    except ValueError:
+        logging.warning(f"⚠️ Invalid {setting} value '{raw_value}', using {default}")
+        return default
+    if minimum is not None:
+        value = max(minimum, value)
+    return value
 
-    api_url = "http://172.176.200.181:5000/rest/GetCities"
-    request = Request(api_url)
-    request.add_header('User-Agent', 'ClimaguateWeatherApp/1.0')
 
-    # Create SSL context that doesn't verify self-signed certificates
-    # Needed because HTTP redirects to HTTPS with self-signed cert
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
+# =============================================================================
+# INSTRUMENTATION - SPANS, COUNTERS AND PER-RUN METRICS
+# =============================================================================
+
+# METRICS_ENABLED=false turns span() into a shared no-op and leaves the
+# instrumented functions completely unwrapped
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
 
-    max_retries = 3
-    for attempt in range(1, max_retries + 1):
-        try:
-            with urlopen(request, timeout=10, context=ssl_context) as response:
-                if response.status == 200:
-                    data = json.loads(response.read().decode('utf-8'))
-                    cities_list = data.get('value', [])
-                    logging.info(f"✅ Loaded {len(cities_list)} cities from API with coordinates.")
-                    return cities_list
-                elif response.status == 500:
-                    logging.error(f"❌ HTTP 500 from cities API (attempt {attempt})")
-                    if attempt < max_retries:
-                        logging.info(f"Waiting 30 seconds before retrying...")
-                        time.sleep(30)
-                    else:
-                        logging.error("❌ Max retries reached. Aborting city fetch.")
-                        return []
-                else:
-                    logging.error(f"❌ HTTP {response.status} from cities API (attempt {attempt})")
-                    return []
-        except HTTPError as e:
-            if e.code == 500:
-                logging.error(f"❌ HTTP 500 from cities API (attempt {attempt})")
-                if attempt < max_retries:
-                    logging.info(f"Waiting 30 seconds before retrying...")
-                    time.sleep(30)
-                else:
-                    logging.error("❌ Max retries reached. Aborting city fetch.")
-                    return []
-            else:
-                logging.error(f"❌ HTTPError fetching cities: {e}")
-                return []
-        except Exception as e:
-            logging.error(f"❌ Error fetching cities: {e}")
-            return []
+# Also export spans, durations and byte counters through OpenTelemetry when the
+# package is installed (Azure Monitor is configured if the distro is present)
+METRICS_OTEL_ENABLED = os.environ.get("METRICS_OTEL_ENABLED", "false").lower() == "true"
 
+# Upper bounds (milliseconds) of the per-run duration histogram buckets
+METRICS_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
 
-def process_city_weather(cursor, apikey: str, city_code: str, city_name: str, latitude: float, longitude: float) -> None:
+# Run collector of the current invocation; worker threads receive it through
+# contextvars.copy_context() (see run_city_fanout and InProcessQueue.drain)
+_current_run = contextvars.ContextVar("climaguate_run_metrics", default=None)
+
+_otel = None
+_otel_lock = threading.Lock()
+
+
+class _NoopSpan:
+    """Returned by span() when metrics are disabled or no run is active."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class RunMetrics:
     """
-    Fetch current weather data for a city from OpenWeatherMap API and insert into database.
-    
-    This function retrieves comprehensive weather information including temperature,
-    humidity, wind, pressure, visibility, and precipitation data.
-    
-    Args:
-        cursor: Database cursor for SQL operations
-        apikey (str): OpenWeatherMap API key
-        city_code (str): Unique city identifier (e.g., 'GUA')
-        city_name (str): Human-readable city name  
-        latitude (float): City latitude coordinate
-        longitude (float): City longitude coordinate
-        
-    Database Operations:
-        - Inserts complete weather record into weather.WeatherData table
-        - Converts Unix timestamps to Central America timezone
-        - Handles nullable fields gracefully
-        
-    API Integration:
-        - Uses metric units and Spanish language
-        - Includes current conditions and atmospheric data
-        - Error handling for API failures and network issues
+    Aggregates span durations, counters, gauges and bytes transferred for one function
+    invocation and renders them as a single structured record.
     """
-    import requests  # Import inside function
-    
-    try:
-        api_call = (
-            f"https://api.openweathermap.org/data/2.5/weather?lat={latitude}&lon={longitude}"
-            f"&appid={apikey}&lang=es&units=metric"
-        )
 
-        response = requests.get(api_call)
-        response.raise_for_status()
-        data = response.json()
+    def __init__(self, run_name: str):
+        self.run_name = run_name
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._spans = {}
+        self._counters = {}
+        self._gauges = {}
+        self._bytes = {"in": {}, "out": {}}
+        self._token = None
 
-        # Extract coordinate data
-        coord_lon = data["coord"]["lon"]
-        coord_lat = data["coord"]["lat"]
-        
-        # Weather condition information
-        weather_id = data["weather"][0]["id"]
-        weather_main = data["weather"][0]["main"]
-        weather_description = data["weather"][0]["description"]
-        weather_icon = data["weather"][0]["icon"]
-        
-        # Base station and main atmospheric data
-        base = data.get("base")
-        main_temp = data["main"]["temp"]
-        main_feels_like = data["main"]["feels_like"]
-        main_pressure = data["main"]["pressure"]
-        main_humidity = data["main"]["humidity"]
-        main_temp_min = data["main"]["temp_min"]
-        main_temp_max = data["main"]["temp_max"]
-        main_sea_level = data["main"].get("sea_level")
-        main_grnd_level = data["main"].get("grnd_level")
-        
-        # Visibility and wind data
-        visibility = data.get("visibility")
-        wind_speed = data["wind"]["speed"]
-        wind_deg = data["wind"]["deg"]
-        wind_gust = data["wind"].get("gust")
-        
-        # Cloud coverage and precipitation
-        clouds_all = data["clouds"]["all"]
-        rain_1h = data.get("rain", {}).get("1h")
-        rain_3h = data.get("rain", {}).get("3h")
-        
-        # Timestamp and system data
-        dt = data["dt"]
-        sys_country = data["sys"]["country"]
-        sys_sunrise = data["sys"]["sunrise"]
-        sys_sunset = data["sys"]["sunset"]
-        timezone = data["timezone"]
-        city_id = data["id"]
-
-        # Insert weather data into database with timezone conversion
-        insert_query = '''
-                INSERT INTO weather.WeatherData (
-                    Coord_Lon, Coord_Lat, Weather_Id, Weather_Main, Weather_Description, 
-                    Weather_Icon, Base, Main_Temp, Main_Feels_Like, Main_Pressure, 
-                    Main_Humidity, Main_Temp_Min, Main_Temp_Max, Main_Sea_Level, 
-                    Main_Grnd_Level, Visibility, Wind_Speed, Wind_Deg, Wind_Gust, 
-                    Clouds_All, Rain_1h, Rain_3h, Dt, Sys_Country, Sys_Sunrise, 
-                    Sys_Sunset, Timezone, Id, Name, CityCode, Date_gt,date_sunrise,date_sunset
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-                DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time',
-                DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time',
-                DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time')
-        '''
+    def observe(self, name: str, seconds: float, failed: bool) -> None:
+        with self._lock:
+            stats = self._spans.get(name)
+            if stats is None:
+                stats = self._spans[name] = {
+                    "count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                    "buckets": [0] * (len(METRICS_BUCKETS_MS) + 1),
+                }
+            stats["count"] += 1
+            stats["errors"] += failed
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["buckets"][bisect.bisect_left(METRICS_BUCKETS_MS, seconds * 1000)] += 1
 
-        cursor.execute(
-            insert_query,
-            (
-                coord_lon,
-                coord_lat,
-                weather_id,
-                weather_main,
-                weather_description,
-                weather_icon,
-                base,
-                main_temp,
-                main_feels_like,
-                main_pressure,
-                main_humidity,
-                main_temp_min,
-                main_temp_max,
-                main_sea_level,
-                main_grnd_level,
-                visibility,
-                wind_speed,
-                wind_deg,
-                wind_gust,
-                clouds_all,
-                rain_1h,
-                rain_3h,
-                dt,
-                sys_country,
-                sys_sunrise,
-                sys_sunset,
-                timezone,
-                city_id,
-                city_name,
-                city_code,
-                dt,
-                sys_sunrise,
-                sys_sunset,
-            ),
-        )
+    def add(self, name: str, value) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
 
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to get weather data for {city_name}: {e}")
+    def set_gauge(self, name: str, value) -> None:
+        with self._lock:
+            self._gauges[name] = value
 
+    def add_bytes(self, direction: str, peer: str, size: int) -> None:
+        with self._lock:
+            peers = self._bytes[direction]
+            peers[peer] = peers.get(peer, 0) + size
 
-def process_city_air_quality(cursor, apikey: str, city_code: str, city_name: str, latitude: float, longitude: float) -> None:
+    def record(self) -> dict:
+        """Return the run as a JSON-serializable record."""
+        labels = [f"le_{bound}ms" for bound in METRICS_BUCKETS_MS] + ["le_inf"]
+        with self._lock:
+            spans = {
+                name: {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "total_ms": round(stats["total"] * 1000, 1),
+                    "mean_ms": round(stats["total"] * 1000 / stats["count"], 1),
+                    "max_ms": round(stats["max"] * 1000, 1),
+                    "histogram": {label: n for label, n in zip(labels, stats["buckets"]) if n},
+                }
+                for name, stats in self._spans.items()
+            }
+            return {
+                "run": self.run_name,
+                "started_at": self.started_at.isoformat(),
+                "duration_ms": round((time.perf_counter() - self._start) * 1000, 1),
+                "spans": spans,
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "bytes": {direction: dict(peers) for direction, peers in self._bytes.items()},
+            }
+
+
+def _init_otel():
     """
-    Fetch air quality data for a city from OpenWeatherMap API and insert into database.
-    
-    This function retrieves comprehensive air pollution data including AQI levels
-    and individual pollutant concentrations for health monitoring.
-    
-    Args:
-        cursor: Database cursor for SQL operations
-        apikey (str): OpenWeatherMap API key
-        city_code (str): Unique city identifier
-        city_name (str): Human-readable city name
-        latitude (float): City latitude coordinate
-        longitude (float): City longitude coordinate
-        
-    Air Quality Data:
-        - Overall AQI (Air Quality Index) on 1-5 scale
-        - Individual pollutant concentrations (μg/m³):
-          * CO (Carbon Monoxide)
-          * NO (Nitrogen Monoxide) 
-          * NO2 (Nitrogen Dioxide)
-          * O3 (Ozone)
-          * SO2 (Sulfur Dioxide)
-          * PM2.5 (Fine Particulate Matter)
-          * PM10 (Coarse Particulate Matter)
-          * NH3 (Ammonia)
-          
-    Database Operations:
-        - Inserts complete air quality record into weather.AirQuality table
-        - Maps numeric AQI to descriptive categories
-        - Handles missing pollutant data with default values
+    Resolve the OpenTelemetry tracer and instruments once per process.
+
+    Returns:
+        dict or None: tracer, duration histogram and byte counter, or None when
+        OpenTelemetry is disabled or not installed
     """
-    import requests  # Import inside function
-    
-    try:
-        api_call = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={latitude}&lon={longitude}&appid={apikey}"
+    global _otel
+    if _otel is not None or not METRICS_OTEL_ENABLED:
+        return _otel or None
+    with _otel_lock:
+        if _otel is not None:
+            return _otel or None
+        try:
+            from opentelemetry import trace, metrics as otel_metrics
+        except ImportError:
+            logging.warning("⚠️ METRICS_OTEL_ENABLED is set but opentelemetry is not installed, using log records only")
+            _otel = {}
+            return None
 
-        response = requests.get(api_call)
-        response.raise_for_status()
-        data = response.json()
+        if os.environ.get("APPLICATIONINSIGHTS_CONNECTION_STRING"):
+            try:
+                from azure.monitor.opentelemetry import configure_azure_monitor
+                # The Functions host already ships the log stream
+                configure_azure_monitor(disable_logging=True)
+            except ImportError:
+                pass
 
-        # Extract air quality data from API response
-        air_data = data["list"][0]  # Current air quality data
-        aqi = air_data["main"]["aqi"]  # Air Quality Index (1-5)
-        components = air_data["components"]
-        
-        # Get timestamp for data collection
-        dt = air_data["dt"]
-        
-        # Map numeric AQI to descriptive categories for database storage
-        aqi_categories = {
-            1: "Good",
-            2: "Fair", 
-            3: "Moderate",
-            4: "Poor",
-            5: "Very Poor"
+        meter = otel_metrics.get_meter("climaguate")
+        _otel = {
+            "tracer": trace.get_tracer("climaguate"),
+            "duration": meter.create_histogram("climaguate.span.duration", unit="ms"),
+            "bytes": meter.create_counter("climaguate.bytes", unit="By"),
+            "counter": meter.create_counter("climaguate.events"),
         }
-        category = aqi_categories.get(aqi, "Unknown")
+        return _otel
 
-        # Insert air quality data into database
-        insert_query = '''
-            INSERT INTO weather.AirQuality (
-                CityCode, CityName, Latitude, Longitude, 
-                AQI, Category, 
-                CO, NO, NO2, O3, SO2, PM2_5, PM10, NH3,
-                Timestamp, Date_gt
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
-                DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time')
-        '''
 
-        cursor.execute(
-            insert_query,
-            (
-                city_code,
-                city_name,
-                latitude,
-                longitude,
-                aqi,
-                category,
-                components.get("co", 0),        # Carbon monoxide (μg/m³)
-                components.get("no", 0),        # Nitrogen monoxide (μg/m³)
-                components.get("no2", 0),       # Nitrogen dioxide (μg/m³)
-                components.get("o3", 0),        # Ozone (μg/m³)
-                components.get("so2", 0),       # Sulphur dioxide (μg/m³)
-                components.get("pm2_5", 0),     # PM2.5 (μg/m³)
-                components.get("pm10", 0),      # PM10 (μg/m³)
-                components.get("nh3", 0),       # Ammonia (μg/m³)
-                dt,
-                dt
-            ),
-        )
-        
-        logging.info(f"Air quality data inserted for {city_name} - AQI: {aqi} ({category})")
+class _Span:
+    __slots__ = ("name", "attributes", "run", "start", "otel_span")
 
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to get air quality data for {city_name}: {e}")
-    except Exception as e:
-        logging.error(f"Error processing air quality data for {city_name}: {e}")
+    def __init__(self, name: str, attributes: dict, run: RunMetrics):
+        self.name = name
+        self.attributes = attributes
+        self.run = run
+        self.otel_span = None
 
+    def __enter__(self):
+        otel = _otel
+        if otel:
+            self.otel_span = otel["tracer"].start_as_current_span(self.name, attributes=self.attributes)
+            self.otel_span.__enter__()
+        self.start = time.perf_counter()
+        return self
 
-def process_city_nasa(
-    blob_service_client,
-    container_name: str,
-    icon_url: str,
-    city_code: str,
-    latitude: float,
-    longitude: float,
-) -> None:
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if self.run is not None:
+            self.run.observe(self.name, elapsed, exc_type is not None)
+        if self.otel_span is not None:
+            _otel["duration"].record(elapsed * 1000, {"span": self.name, "error": exc_type is not None})
+            self.otel_span.__exit__(exc_type, exc, tb)
+        return False
+
+    def set_attribute(self, key, value) -> None:
+        self.attributes[key] = value
+
+
+def span(name: str, **attributes):
     """
-    Fetch NASA GOES satellite image for a city, overlay location icon, and generate animation.
-    
-    This function downloads infrared satellite imagery from NASA's GOES satellite system,
-    processes the image by cropping and adding a location marker, uploads to Azure Blob Storage,
-    and triggers animation generation from recent images.
-    
+    Time a block of work under the given span name.
+
+    Durations land in the active run's histogram (and in OpenTelemetry when
+    enabled); exceptions are counted as errors and always propagate.
+
     Args:
-        blob_service_client: Azure Blob Storage service client
-        container_name (str): Blob storage container name
-        icon_url (str): URL to location marker icon
-        city_code (str): Unique city identifier for file organization
-        latitude (float): City latitude for satellite positioning
-        longitude (float): City longitude for satellite positioning
-        
-    Image Processing:
-        - Downloads infrared imagery from NASA GOES satellite
-        - Crops to 400x400 pixel square centered on coordinates
-        - Overlays location marker icon for geographic reference
-        - Saves as JPEG format for web optimization
-        
-    Storage Operations:
-        - Uploads processed image to Azure Blob Storage
-        - Organizes files by city code in folder structure
-        - Triggers animation generation from recent images
-        - Provides timestamped filename for tracking
-        
-    Error Handling:
-        - Network failures during image download
-        - Image processing errors
-        - Blob storage upload failures
-        - HTML parsing issues from NASA website
+        name (str): Span name, e.g. "process_city_weather"
+        **attributes: Extra attributes attached to the OpenTelemetry span
+
+    Returns:
+        A context manager; a shared no-op when there is nothing to record into
     """
-    import requests  # Import inside function
-    from bs4 import BeautifulSoup
-    
-    try:
-        # Generate timestamped filename for image organization
-        date_img = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        blob_name = f"{city_code}/{date_img}.jpg"
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    run = _current_run.get()
+    if run is None and not _otel:
+        return _NOOP_SPAN
+    return _Span(name, attributes, run)
 
-        # Construct NASA GOES satellite image URL with specific parameters
-        image_page_url = (
-            "https://weather.ndc.nasa.gov/cgi-bin/get-abi?"
-            f"satellite=GOESEastfullDiskband13&lat={latitude}&lon={longitude}&quality=100&palette=ir2.pal&colorbar=0&mapcolor=white"
-        )
 
-        response = requests.get(image_page_url)
-        if response.status_code == 200:
-            html_content = response.text
-
-            # Parse HTML to extract the actual satellite image URL
-            soup = BeautifulSoup(html_content, "html.parser")
-            img_tag = soup.find("img")
-            if img_tag and "src" in img_tag.attrs:
-                img_url = "https://weather.ndc.nasa.gov" + img_tag["src"]
-
-                # Download the satellite image
-                img_response = requests.get(img_url)
-                if img_response.status_code == 200:
-                    from PIL import Image
-                    from io import BytesIO
-                    
-                    # Convert bytes to PIL Image for processing
-                    image_data = Image.open(BytesIO(img_response.content))
-                    main_width, main_height = image_data.size
-
-                    # Crop the image to a square from the center, approximately 400x400 pixels
-                    # This focuses the view on the specific geographic area of interest
-                    crop_size = 400
-                    left = (main_width - crop_size) // 2
-                    top = (main_height - crop_size) // 2
-                    right = left + crop_size
-                    bottom = top + crop_size
-                    
-                    # Ensure crop bounds are within image dimensions to prevent errors
-                    left = max(0, left)
-                    top = max(0, top)
-                    right = min(main_width, right)
-                    bottom = min(main_height, bottom)
-                    
-                    # Perform the crop operation
-                    image_data = image_data.crop((left, top, right, bottom))
-
-                    # Add location marker icon to the processed image
-                    modified_image_data = add_icon_to_image(image_data, icon_url)
-
-                    # Upload processed image to Azure Blob Storage
-                    blob_client = blob_service_client.get_blob_client(
-                        container=container_name, blob=blob_name
-                    )
-                    blob_client.upload_blob(
-                        modified_image_data, blob_type="BlockBlob", overwrite=True
-                    )
-                    logging.info(f"Image uploaded to {container_name}/{blob_name}")
+def instrumented(name: str = None):
+    """
+    Decorator that wraps every call of a function in span(name). With
+    METRICS_ENABLED=false the function is returned unchanged.
+    """
+    def decorate(function):
+        if not METRICS_ENABLED:
+            return function
+        span_name = name or function.__name__
 
-                    # Generate updated animation from recent images
-                    generate_animation_for_city(
-                        city_code, blob_service_client, container_name
-                    )
+        import functools
 
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to get NASA image for {city_code}: {e}")
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return function(*args, **kwargs)
 
+        return wrapper
 
-# =============================================================================
-# MAIN AZURE FUNCTIONS - TIMER TRIGGERED SERVICES
-# =============================================================================
+    return decorate
 
-@app.schedule(schedule="0 */20 * * * *", arg_name="timer", run_on_startup=False, use_monitor=False)
-def run_city_batch(timer: func.TimerRequest) -> None:
+
+def count(name: str, value=1) -> None:
+    """Add to a per-run counter (rows written, cache hits, ...)."""
+    if not METRICS_ENABLED:
+        return
+    run = _current_run.get()
+    if run is not None:
+        run.add(name, value)
+    if _otel:
+        _otel["counter"].add(value, {"name": name})
+
+
+def gauge(name: str, value) -> None:
+    """Set a per-run gauge to its latest value (e.g. a circuit breaker state)."""
+    if not METRICS_ENABLED:
+        return
+    run = _current_run.get()
+    if run is not None:
+        run.set_gauge(name, value)
+
+
+def record_duration(name: str, seconds: float) -> None:
+    """Add a duration measured outside a span (e.g. queue waits) to the run histograms."""
+    if not METRICS_ENABLED:
+        return
+    run = _current_run.get()
+    if run is not None:
+        run.observe(name, seconds, False)
+    if _otel:
+        _otel["duration"].record(seconds * 1000, {"span": name, "error": False})
+
+
+def record_bytes(direction: str, peer: str, size: int) -> None:
     """
-    Main weather data collection function - Executes every 20 minutes.
+    Account payload bytes moved in ("in") or out ("out") of the function.
 
-    This timer-triggered function orchestrates the complete weather data collection
-    process for all configured cities in the Climaguate system.
+    Args:
+        direction (str): "in" or "out"
+        peer (str): Remote host or "blob" for storage traffic
+        size (int): Number of bytes
+    """
+    if not METRICS_ENABLED or not size:
+        return
+    run = _current_run.get()
+    if run is not None:
+        run.add_bytes(direction, peer, size)
+    if _otel:
+        _otel["bytes"].add(size, {"direction": direction, "peer": peer})
 
-    Schedule: Every 20 minutes (CRON: "0 */20 * * * *")
 
-    Process Flow:
-    1. Retrieves list of cities from Data API
-    2. Connects to SQL database using environment variables
-    3. Initializes Azure Blob Storage with managed identity
-    4. For each city:
-       - Collects current weather data from OpenWeatherMap
-       - Retrieves air quality information and AQI levels
-       - Downloads and processes NASA GOES satellite imagery
-       - Generates animated satellite imagery timeline
-    5. Commits all database transactions atomically
-    
-    Error Handling:
-    - Individual city failures don't stop processing of other cities
-    - Database connection errors are logged and handled gracefully
-    - API failures are retried automatically by the timer schedule
-    - Blob storage operations have built-in retry mechanisms
-    
-    Authentication:
-    - Uses environment variables for API keys and connection strings
-    - Managed identity for Azure Blob Storage access
-    - No hardcoded secrets or credentials
-    
-    Performance Optimization:
-    - Single database connection for all operations
-    - Batch commits for improved throughput
-    - Memory-efficient image processing
-    - Parallel-safe error isolation per city
+def start_run(run_name: str):
     """
-    # Import problematic modules inside the function to avoid registration issues
-    import pyodbc
-    from azure.storage.blob import BlobServiceClient
-    
-    if timer.past_due:
-        logging.info('The timer is past due!')
+    Begin collecting metrics for one invocation; pair with finish_run().
 
-    conn = None
-    cursor = None
+    Returns:
+        RunMetrics or None when metrics are disabled
+    """
+    if not METRICS_ENABLED:
+        return None
+    _init_otel()
+    run = RunMetrics(run_name)
+    run._token = _current_run.set(run)
+    return run
+
+
+def finish_run(run) -> dict:
+    """
+    Stop collecting for the run and log its structured record as one JSON line.
+
+    Returns:
+        dict: The record (empty when metrics are disabled)
+    """
+    if run is None:
+        return {}
     try:
-        logging.info('Starting the process to retrieve configuration from environment variables.')
+        _current_run.reset(run._token)
+    except ValueError:
+        # Finished from a different context; the contextvar dies with it anyway
+        pass
+    record = run.record()
+    logging.info(f"📊 {run.run_name} metrics: {json.dumps(record, sort_keys=True)}")
+    return record
+
+
+def submit_in_context(executor, function, *args, **kwargs):
+    """Submit to a thread pool so the task sees the caller's run and span context."""
+    return executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+
+# =============================================================================
+# REQUEST SCHEDULER - PER-PROVIDER RATE LIMITS AND PRIORITIES
+# =============================================================================
+
+# Set REQUEST_SCHEDULER_ENABLED=false to send every request as soon as it is made
+REQUEST_SCHEDULER_ENABLED = os.environ.get("REQUEST_SCHEDULER_ENABLED", "true").lower() == "true"
+
+# Budget defaults: (calls per minute, concurrent in-flight requests), 0 = unlimited.
+# Override with REQUEST_BUDGET_<NAME>_PER_MINUTE / REQUEST_BUDGET_<NAME>_IN_FLIGHT.
+# OpenWeatherMap counts weather, group and air pollution calls against one key;
+# NASA publishes no quota, so only its concurrency is capped.
+REQUEST_BUDGET_DEFAULTS = {
+    "openweathermap": (600, 16),
+    "azure_maps": (3000, 16),
+    "nasa": (0, 4),
+    "data_api": (0, 4),
+}
+
+# http_get provider label -> (budget, priority); lower priorities are served first
+PROVIDER_SCHEDULE = {
+    "cities_api": ("data_api", 0),
+    "owm_weather": ("openweathermap", 0),
+    "owm_weather_group": ("openweathermap", 0),
+    "owm_air_pollution": ("openweathermap", 1),
+    "azure_maps_forecast": ("azure_maps", 1),
+    "nasa_abi": ("nasa", 2),
+    "nasa_image": ("nasa", 2),
+}
+
+# Tokens an idle budget may accumulate, in seconds of its rate
+REQUEST_BURST_SECONDS = get_env_number("REQUEST_BURST_SECONDS", 5.0, float, 0.0)
+
+# Throttled (HTTP 429) requests are re-queued this many times before the 429
+# is returned; a Retry-After longer than REQUEST_MAX_RETRY_AFTER gives up at once
+REQUEST_MAX_REQUEUES = get_env_number("REQUEST_MAX_REQUEUES", 3, int, 0)
+REQUEST_MAX_RETRY_AFTER = get_env_number("REQUEST_MAX_RETRY_AFTER", 120.0, float, 1.0)
+
+# Pause applied to a budget when a 429 carries no usable Retry-After (seconds)
+REQUEST_DEFAULT_RETRY_AFTER = 2.0
+
+
+def parse_retry_after(value, default: float = REQUEST_DEFAULT_RETRY_AFTER) -> float:
+    """
+    Parse a Retry-After header given in seconds or as an HTTP date.
+
+    Returns:
+        float: Seconds to wait (never negative), or the default when missing/invalid
+    """
+    from email.utils import parsedate_to_datetime
+
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class ProviderBudget:
+    """
+    Token bucket plus in-flight cap for one upstream quota.
+
+    Waiting requests are admitted strictly in (priority, arrival) order, so a
+    queued weather call always goes before queued air quality or imagery
+    calls on the same budget. A 429 pauses the whole budget until its
+    Retry-After has passed, not just the request that received it.
+    """
+
+    def __init__(self, name: str, per_minute: int, max_in_flight: int):
+        self.name = name
+        self.per_minute = per_minute
+        self.max_in_flight = max_in_flight
+        self._rate = per_minute / 60.0
+        self._capacity = max(1.0, self._rate * REQUEST_BURST_SECONDS)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.stats = {
+            "requests": 0, "queued": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+            "throttled": 0, "paused_seconds": 0.0, "given_up": 0,
+        }
+
+    def _admission_delay(self, now: float):
+        """Seconds until the head of the queue may start; None means wait for a release."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.max_in_flight and self._in_flight >= self.max_in_flight:
+            return None
+        if self._rate:
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens < 1.0:
+                return (1.0 - self._tokens) / self._rate
+        return 0.0
+
+    def acquire(self, priority: int) -> float:
+        """
+        Block until the request may be sent, then take a token and an in-flight slot.
+
+        Returns:
+            float: Seconds spent waiting in the queue
+        """
+        start = time.monotonic()
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            while True:
+                now = time.monotonic()
+                delay = self._admission_delay(now) if self._waiting[0] == ticket else None
+                if delay == 0.0:
+                    break
+                self._condition.wait(timeout=delay)
+
+            heapq.heappop(self._waiting)
+            if self._rate:
+                self._tokens -= 1.0
+            self._in_flight += 1
+            waited = now - start
+            self.stats["requests"] += 1
+            self.stats["queued"] += waited > 0.001
+            self.stats["wait_seconds"] += waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+            # The next request in line re-evaluates now that the head has moved
+            self._condition.notify_all()
+        return waited
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def throttle(self, retry_after: float) -> None:
+        """Pause the budget after a 429 until Retry-After has elapsed."""
+        with self._condition:
+            now = time.monotonic()
+            paused_until = now + min(retry_after, REQUEST_MAX_RETRY_AFTER)
+            if paused_until > self._paused_until:
+                self.stats["paused_seconds"] += paused_until - max(now, self._paused_until)
+                self._paused_until = paused_until
+            self.stats["throttled"] += 1
+            self._condition.notify_all()
+
+    def give_up(self) -> None:
+        with self._condition:
+            self.stats["given_up"] += 1
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            stats = dict(self.stats)
+            stats.update(waiting=len(self._waiting), in_flight=self._in_flight)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        stats["max_wait_seconds"] = round(stats["max_wait_seconds"], 3)
+        stats["paused_seconds"] = round(stats["paused_seconds"], 3)
+        return stats
+
+
+class RequestScheduler:
+    """Process-wide registry of provider budgets, shared by all invocations."""
+
+    def __init__(self):
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def budget(self, name: str) -> ProviderBudget:
+        budget = self._budgets.get(name)
+        if budget is not None:
+            return budget
+        with self._lock:
+            budget = self._budgets.get(name)
+            if budget is None:
+                per_minute, in_flight = REQUEST_BUDGET_DEFAULTS.get(name, (0, 0))
+                budget = ProviderBudget(
+                    name,
+                    get_env_number(f"REQUEST_BUDGET_{name.upper()}_PER_MINUTE", per_minute, int, 0),
+                    get_env_number(f"REQUEST_BUDGET_{name.upper()}_IN_FLIGHT", in_flight, int, 0),
+                )
+                self._budgets[name] = budget
+        return budget
+
+    def send(self, provider: str, send_request):
+        """
+        Run send_request() under the provider's budget and priority.
+
+        A 429 pauses the budget for its Retry-After and re-queues the request
+        at the same priority, up to REQUEST_MAX_REQUEUES times.
+
+        Args:
+            provider (str): Provider label from PROVIDER_SCHEDULE
+            send_request: Callable performing the request and returning the response
+
+        Returns:
+            requests.Response: The final response
+        """
+        budget_name, priority = PROVIDER_SCHEDULE[provider]
+        budget = self.budget(budget_name)
+        for attempt in range(REQUEST_MAX_REQUEUES + 1):
+            record_duration(f"queue_wait.{budget_name}", budget.acquire(priority))
+            try:
+                response = send_request()
+            finally:
+                budget.release()
+            if response.status_code != 429:
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            budget.throttle(retry_after)
+            count(f"throttled.{budget_name}")
+            if attempt == REQUEST_MAX_REQUEUES or retry_after > REQUEST_MAX_RETRY_AFTER:
+                break
+            logging.warning(f"⏳ {provider} throttled (HTTP 429), re-queued after {retry_after:.1f}s")
+            response.close()
+
+        budget.give_up()
+        logging.error(f"❌ {provider} still throttled after {attempt + 1} attempts")
+        return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            budgets = list(self._budgets.values())
+        return {budget.name: budget.snapshot() for budget in budgets}
+
+
+# Shared by every function in the worker process
+request_scheduler = RequestScheduler()
+
+
+def log_scheduler_stats(run_name: str) -> None:
+    for name, stats in request_scheduler.stats().items():
+        logging.info(
+            f"🚦 {run_name} budget {name}: {stats['requests']} requests, {stats['queued']} queued "
+            f"(wait {stats['wait_seconds']}s, max {stats['max_wait_seconds']}s), "
+            f"{stats['throttled']} throttled, paused {stats['paused_seconds']}s, {stats['given_up']} given up"
+        )
+
+
+# =============================================================================
+# CIRCUIT BREAKERS - FAIL FAST DURING UPSTREAM OUTAGES
+# =============================================================================
+
+# Set CIRCUIT_BREAKER_ENABLED=false to always send the request
+CIRCUIT_BREAKER_ENABLED = os.environ.get("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+
+# http_get provider label -> breaker; labels sharing an upstream share its breaker
+PROVIDER_BREAKERS = {
+    "cities_api": "data_api",
+    "owm_weather": "owm_weather",
+    "owm_weather_group": "owm_weather",
+    "owm_air_pollution": "owm_air_pollution",
+    "azure_maps_forecast": "azure_maps",
+    "nasa_abi": "nasa",
+    "nasa_image": "nasa",
+}
+
+# Breaker defaults: (failure rate, slow-call seconds) over the sliding window.
+# Override with CIRCUIT_<NAME>_FAILURE_RATE / CIRCUIT_<NAME>_SLOW_SECONDS.
+# A call's time includes the urllib3 retries, so a dead host is slow as well.
+CIRCUIT_BREAKER_DEFAULTS = {
+    "data_api": (0.5, 15.0),
+    "owm_weather": (0.5, 10.0),
+    "owm_air_pollution": (0.5, 10.0),
+    "azure_maps": (0.5, 15.0),
+    "nasa": (0.5, 30.0),
+}
+
+# The breaker opens when, over the last CIRCUIT_WINDOW_SIZE calls (and at least
+# CIRCUIT_MIN_CALLS), the failure rate or the share of slow calls (CIRCUIT_SLOW_RATE)
+# reaches its threshold. Failures are exceptions (timeouts, refused connections)
+# and 5xx responses; 4xx mean the upstream is up. A call that is still 429 after
+# the scheduler's re-queues is left out of the window.
+CIRCUIT_WINDOW_SIZE = get_env_number("CIRCUIT_WINDOW_SIZE", 20, int, 1)
+CIRCUIT_MIN_CALLS = get_env_number("CIRCUIT_MIN_CALLS", 5, int, 1)
+CIRCUIT_SLOW_RATE = get_env_number("CIRCUIT_SLOW_RATE", 0.8, float, 0.0)
+
+# An open breaker rejects calls for CIRCUIT_OPEN_SECONDS, then lets
+# CIRCUIT_HALF_OPEN_PROBES calls through: all of them fast and successful closes
+# it again, any failure reopens it
+CIRCUIT_OPEN_SECONDS = get_env_number("CIRCUIT_OPEN_SECONDS", 60.0, float, 1.0)
+CIRCUIT_HALF_OPEN_PROBES = get_env_number("CIRCUIT_HALF_OPEN_PROBES", 1, int, 1)
+
+# Gauge values of the breaker states in the metrics record
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+_circuit_open_error_class = None
+
+
+def get_circuit_open_error():
+    """
+    Return CircuitOpenError, a requests.RequestException subclass raised by
+    http_get while a provider's breaker is open. Built on first use so requests
+    stays out of the module import; every caller already handles it through
+    its existing RequestException branch.
+    """
+    global _circuit_open_error_class
+    if _circuit_open_error_class is None:
+        import requests
+
+        class CircuitOpenError(requests.exceptions.RequestException):
+            """The provider's circuit breaker is open; the call was not sent."""
+
+        _circuit_open_error_class = CircuitOpenError
+    return _circuit_open_error_class
+
+
+class CircuitBreaker:
+    """
+    Failure-rate and latency circuit breaker for one upstream.
+
+    Closed: calls go through and their outcome lands in a sliding window.
+    Open: calls are rejected at once with CircuitOpenError until
+    CIRCUIT_OPEN_SECONDS have passed. Half-open: up to
+    CIRCUIT_HALF_OPEN_PROBES probe calls decide between closing and reopening.
+    """
+
+    def __init__(self, name: str, failure_rate: float, slow_seconds: float):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.state = "closed"
+        self._lock = threading.Lock()
+        self._window = []
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.stats = {"calls": 0, "failures": 0, "slow": 0, "rejected": 0, "opened": 0}
+
+    def acquire(self) -> None:
+        """
+        Admit one call or raise CircuitOpenError.
+
+        Raises:
+            CircuitOpenError: While open, or half-open with every probe in flight
+        """
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= CIRCUIT_OPEN_SECONDS:
+                self._transition("half_open")
+            if self.state == "closed":
+                return
+            if self.state == "half_open" and self._probes < CIRCUIT_HALF_OPEN_PROBES:
+                self._probes += 1
+                return
+            self.stats["rejected"] += 1
+            retry_in = max(0.0, CIRCUIT_OPEN_SECONDS - (time.monotonic() - self._opened_at))
+        count(f"circuit_rejected.{self.name}")
+        raise get_circuit_open_error()(f"Circuit for {self.name} is {self.state}, retry in {retry_in:.0f}s")
+
+    def record(self, failed: bool, seconds: float) -> None:
+        """Add the outcome of an admitted call and move the state machine."""
+        slow = seconds >= self.slow_seconds
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["failures"] += failed
+            self.stats["slow"] += slow
+            if self.state == "half_open":
+                if failed or slow:
+                    self._transition("open")
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= CIRCUIT_HALF_OPEN_PROBES:
+                        self._transition("closed")
+                return
+            if self.state == "open":
+                # A call admitted before the breaker opened; the window restarts on close
+                return
+
+            self._window.append((failed, slow))
+            if len(self._window) > CIRCUIT_WINDOW_SIZE:
+                del self._window[0]
+            if len(self._window) < CIRCUIT_MIN_CALLS:
+                return
+            failures = sum(1 for call_failed, _ in self._window if call_failed)
+            slow_calls = sum(1 for _, call_slow in self._window if call_slow)
+            if (failures / len(self._window) >= self.failure_rate
+                    or slow_calls / len(self._window) >= CIRCUIT_SLOW_RATE):
+                self._transition("open")
+
+    def release(self) -> None:
+        """
+        Give back an admitted call without an outcome.
+
+        A call still throttled (429) after its re-queues says nothing about
+        whether the upstream recovered, so it frees its half-open probe slot
+        for another call instead of counting as a success or a failure.
+        """
+        with self._lock:
+            if self.state == "half_open" and self._probes > 0:
+                self._probes -= 1
+
+    def _transition(self, state: str) -> None:
+        # Caller holds self._lock
+        previous, self.state = self.state, state
+        if state == "open":
+            self._opened_at = time.monotonic()
+            self.stats["opened"] += 1
+            logging.warning(
+                f"🔌 Circuit for {self.name} opened ({previous}), failing fast for {CIRCUIT_OPEN_SECONDS:.0f}s"
+            )
+        elif state == "half_open":
+            logging.info(f"🔌 Circuit for {self.name} half-open, probing")
+        else:
+            logging.info(f"🔌 Circuit for {self.name} closed")
+        self._window = []
+        self._probes = 0
+        self._probe_successes = 0
+        count(f"circuit_{state}.{self.name}")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["state"] = self.state
+        return stats
+
+
+class CircuitBreakerRegistry:
+    """Process-wide breakers, so their state carries over warm invocations."""
+
+    def __init__(self):
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def for_provider(self, provider: str):
+        """
+        Returns:
+            CircuitBreaker or None for providers without a breaker
+        """
+        name = PROVIDER_BREAKERS.get(provider)
+        if name is None:
+            return None
+        breaker = self._breakers.get(name)
+        if breaker is not None:
+            return breaker
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                failure_rate, slow_seconds = CIRCUIT_BREAKER_DEFAULTS[name]
+                breaker = CircuitBreaker(
+                    name,
+                    get_env_number(f"CIRCUIT_{name.upper()}_FAILURE_RATE", failure_rate, float, 0.0),
+                    get_env_number(f"CIRCUIT_{name.upper()}_SLOW_SECONDS", slow_seconds, float, 0.1),
+                )
+                self._breakers[name] = breaker
+        return breaker
+
+    def stats(self) -> dict:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+# Shared by every function in the worker process
+circuit_breakers = CircuitBreakerRegistry()
+
+
+def log_circuit_stats(run_name: str) -> None:
+    for name, stats in circuit_breakers.stats().items():
+        gauge(f"circuit_state.{name}", CIRCUIT_STATES[stats["state"]])
+        logging.info(
+            f"🔌 {run_name} circuit {name}: {stats['state']}, {stats['calls']} calls, "
+            f"{stats['failures']} failed, {stats['slow']} slow, {stats['rejected']} rejected, "
+            f"opened {stats['opened']} times"
+        )
+
+
+# =============================================================================
+# HTTP CLIENT LAYER - POOLED SESSIONS, TIMEOUTS AND RETRIES
+# =============================================================================
+
+# Connect and read timeouts (seconds) applied to every outbound request
+HTTP_CONNECT_TIMEOUT = get_env_number("HTTP_CONNECT_TIMEOUT", 5.0, float, 0.5)
+HTTP_READ_TIMEOUT = get_env_number("HTTP_READ_TIMEOUT", 30.0, float, 1.0)
+
+# Shared retry policy: exponential backoff (1s, 2s, 4s...) plus random jitter
+HTTP_MAX_RETRIES = get_env_number("HTTP_MAX_RETRIES", 3, int, 0)
+HTTP_BACKOFF_FACTOR = 1.0
+HTTP_BACKOFF_JITTER = 1.0
+# 429 is left to the request scheduler, which pauses the whole provider budget
+HTTP_RETRY_STATUSES = (500, 502, 503, 504) if REQUEST_SCHEDULER_ENABLED else (429, 500, 502, 503, 504)
+
+# Maximum pooled keep-alive connections per host (covers the fan-out workers)
+HTTP_POOL_MAXSIZE = get_env_number("HTTP_POOL_MAXSIZE", 16, int, 1)
+
+# One session per scheme://host, kept at module level so warm invocations reuse
+# the already established TCP/TLS connections
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+_http_retry_counts = {}
+_http_retry_class = None
+
+
+def _http_origin(url: str) -> str:
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _record_http_retry(host: str) -> None:
+    with _http_sessions_lock:
+        _http_retry_counts[host] = _http_retry_counts.get(host, 0) + 1
+
+
+def _build_http_retry():
+    """
+    Build the shared urllib3 retry policy. The Retry subclass only adds a
+    per-host counter so retries show up in get_http_stats().
+    """
+    global _http_retry_class
+    from urllib3.util.retry import Retry
+
+    if _http_retry_class is None:
+        class CountingRetry(Retry):
+            def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+                if _pool is not None:
+                    _record_http_retry(_pool.host)
+                return super().increment(method, url, response, error, _pool, _stacktrace)
+
+        _http_retry_class = CountingRetry
+
+    retry_options = dict(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=HTTP_RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        return _http_retry_class(backoff_jitter=HTTP_BACKOFF_JITTER, **retry_options)
+    except TypeError:
+        # urllib3 < 2.0 has no built-in jitter; plain exponential backoff still applies
+        return _http_retry_class(**retry_options)
+
+
+def get_http_session(url: str):
+    """
+    Return the pooled requests session for the host of the given URL.
+
+    Sessions are created lazily, once per scheme://host, with a keep-alive
+    connection pool and the shared retry policy, and are reused for the
+    lifetime of the worker process.
+
+    Args:
+        url (str): Any URL on the target host
+
+    Returns:
+        requests.Session: Session bound to a pooled adapter for that host
+    """
+    origin = _http_origin(url)
+    session = _http_sessions.get(origin)
+    if session is not None:
+        return session
+
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _http_sessions_lock:
+        session = _http_sessions.get(origin)
+        if session is None:
+            session = requests.Session()
+            session.headers.update({'User-Agent': 'ClimaguateWeatherApp/1.0'})
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                max_retries=_build_http_retry(),
+            )
+            session.mount(f"{origin}/", adapter)
+            _http_sessions[origin] = session
+    return session
+
+
+def http_get(url: str, provider: str = None, **kwargs):
+    """
+    Issue a GET through the pooled session for the URL's host.
+
+    Connect/read timeouts are always applied so a hung socket can no longer
+    stall a whole batch; callers can still override them per request.
+    Requests with a provider label listed in PROVIDER_SCHEDULE wait for their
+    provider budget (rate, in-flight cap, priority, Retry-After) first. Labels
+    listed in PROVIDER_BREAKERS go through that upstream's circuit breaker.
+
+    Args:
+        url (str): Request URL
+        provider (str): Optional provider label, e.g. "owm_weather"
+        **kwargs: Extra arguments forwarded to requests.Session.get
+
+    Returns:
+        requests.Response: The final response after any retries
+
+    Raises:
+        CircuitOpenError: The provider's breaker is open (a RequestException)
+    """
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    breaker = circuit_breakers.for_provider(provider) if CIRCUIT_BREAKER_ENABLED else None
+    if breaker is not None:
+        # Rejected before queueing for the budget, so an outage costs no waiting
+        breaker.acquire()
+
+    # Upstream time summed over the scheduler's attempts, without the budget waits
+    upstream_seconds = [0.0]
+
+    def send_request():
+        start = time.perf_counter()
+        try:
+            return get_http_session(url).get(url, **kwargs)
+        finally:
+            upstream_seconds[0] += time.perf_counter() - start
+
+    try:
+        if REQUEST_SCHEDULER_ENABLED and provider in PROVIDER_SCHEDULE:
+            response = request_scheduler.send(provider, send_request)
+        else:
+            response = send_request()
+    except Exception:
+        if breaker is not None:
+            breaker.record(True, upstream_seconds[0])
+        raise
+    if breaker is not None:
+        # One outcome per admitted call, once the 429 re-queues are over
+        if response.status_code == 429:
+            breaker.release()
+        else:
+            breaker.record(response.status_code >= 500, upstream_seconds[0])
+    if METRICS_ENABLED and not kwargs.get("stream"):
+        # Streamed bodies are accounted by whoever consumes them (read_bounded_image)
+        record_bytes("in", _http_origin(url).split("://", 1)[-1], len(response.content))
+    return response
+
+
+def get_http_stats() -> dict:
+    """
+    Collect connection reuse and retry counters per host.
+
+    Returns:
+        dict: host -> requests, new_connections, reused_connections, retries
+    """
+    stats = {}
+    with _http_sessions_lock:
+        sessions = list(_http_sessions.values())
+        retry_counts = dict(_http_retry_counts)
+
+    for session in sessions:
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host_stats = stats.setdefault(
+                    pool.host, {"requests": 0, "new_connections": 0, "reused_connections": 0, "retries": 0}
+                )
+                host_stats["requests"] += pool.num_requests
+                host_stats["new_connections"] += pool.num_connections
+                host_stats["reused_connections"] += max(0, pool.num_requests - pool.num_connections)
+
+    for host, retries in retry_counts.items():
+        stats.setdefault(
+            host, {"requests": 0, "new_connections": 0, "reused_connections": 0, "retries": 0}
+        )["retries"] = retries
+    return stats
+
+
+def log_http_stats(run_name: str) -> None:
+    for host, host_stats in get_http_stats().items():
+        logging.info(
+            f"🌐 {run_name} HTTP {host}: {host_stats['requests']} requests, "
+            f"{host_stats['new_connections']} new connections, "
+            f"{host_stats['reused_connections']} reused, {host_stats['retries']} retries"
+        )
+
+
+# =============================================================================
+# CONDITIONAL FETCH (RESPONSE CACHE)
+# =============================================================================
+
+# Set RESPONSE_CACHE_ENABLED=false to always run the full parse/insert/image pipeline
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_ENTRIES = get_env_number("RESPONSE_CACHE_MAX_ENTRIES", 2048, int, 16)
+
+# Query parameters that carry credentials and must never become part of a cache key
+SECRET_QUERY_PARAMS = frozenset(["appid", "subscription-key", "api_key", "apikey"])
+
+# Returned instead of a payload when the upstream data is byte-identical to the last run
+RESPONSE_UNCHANGED = object()
+
+
+def normalize_request_url(url: str) -> str:
+    """
+    Build the cache key for a request URL: lowercase scheme/host, credentials
+    stripped and query parameters sorted.
+    """
+    from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+    parts = urlsplit(url)
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in SECRET_QUERY_PARAMS
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ""))
+
+
+class ResponseCache:
+    """
+    Validators (ETag, Last-Modified) and content hashes of the last response
+    per normalized URL.
+
+    Requests are sent with If-None-Match / If-Modified-Since when validators
+    are known. A 304, or a 200 whose body hashes to the stored SHA-256, is
+    reported as unchanged so callers can skip parsing, inserts and image work.
+    Skip counters are kept per provider label to tune the schedules.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _count(self, provider: str, outcome: str) -> None:
+        with self._lock:
+            provider_stats = self._stats.setdefault(
+                provider, {"requests": 0, "not_modified": 0, "unchanged": 0, "changed": 0}
+            )
+            provider_stats["requests"] += 1
+            provider_stats[outcome] += 1
+
+    def _store(self, key: str, entry: dict) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+
+    def get(self, url: str, provider: str, **kwargs):
+        """
+        Conditional GET through the pooled session.
+
+        Args:
+            url (str): Request URL (may contain the API key)
+            provider (str): Label used for the skip statistics
+            **kwargs: Extra arguments forwarded to http_get
+
+        Returns:
+            tuple: (response, changed). changed is False for a 304 or a byte-identical body.
+        """
+        import hashlib
+
+        if not RESPONSE_CACHE_ENABLED:
+            return http_get(url, provider=provider, **kwargs), True
+
+        key = normalize_request_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = http_get(url, provider=provider, headers=headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self._count(provider, "not_modified")
+            return response, False
+        if response.status_code != 200:
+            return response, True
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        if entry is not None and entry.get("sha256") == digest:
+            self._count(provider, "unchanged")
+            return response, False
+
+        self._store(key, {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": digest,
+        })
+        self._count(provider, "changed")
+        return response, True
+
+    def content_changed(self, url: str, provider: str, content: bytes) -> bool:
+        """
+        Hash-only check for payloads fetched indirectly (the NASA image behind a
+        get-abi page), keyed by the URL that identifies the request.
+        """
+        import hashlib
+
+        if not RESPONSE_CACHE_ENABLED:
+            return True
+
+        key = normalize_request_url(url)
+        digest = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry.get("sha256") == digest:
+            self._count(provider, "unchanged")
+            return False
+        self._store(key, {"sha256": digest})
+        self._count(provider, "changed")
+        return True
+
+    def forget(self, url: str) -> None:
+        """Drop a URL whose payload could not be processed so the next run retries it."""
+        with self._lock:
+            self._entries.pop(normalize_request_url(url), None)
+
+    def clear(self) -> None:
+        """Drop every entry, e.g. after a failed commit."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: provider -> requests, not_modified, unchanged, changed, skip_ratio
+        """
+        with self._lock:
+            stats = {provider: dict(values) for provider, values in self._stats.items()}
+        for values in stats.values():
+            skipped = values["not_modified"] + values["unchanged"]
+            values["skip_ratio"] = round(skipped / values["requests"], 3) if values["requests"] else 0.0
+        return stats
+
+
+# Shared by every function in the worker process
+_response_cache = ResponseCache()
+
+
+def log_response_cache_stats(run_name: str) -> None:
+    for provider, values in _response_cache.stats().items():
+        logging.info(
+            f"♻️ {run_name} {provider}: {values['requests']} requests, "
+            f"{values['not_modified']} not modified, {values['unchanged']} unchanged, "
+            f"skip ratio {values['skip_ratio']:.0%}"
+        )
+
+
+# =============================================================================
+# AZURE BLOB STORAGE SETTINGS
+# =============================================================================
+
+STORAGE_ACCOUNT_NAME = "imagefilesclimaguate"
+SATELLITE_CONTAINER_NAME = "mapimages"
+MARKER_ICON_URL = os.environ.get("MARKER_ICON_URL", "https://climaguate.com/images/icons/marker.png")
+
+
+# =============================================================================
+# PROCESS-WIDE RESOURCES
+# =============================================================================
+
+# Idle pyodbc connections kept per connection string between invocations
+SQL_POOL_MAX_IDLE = get_env_number("SQL_POOL_MAX_IDLE", 2, int, 0)
+
+# "background" imports the heavy libraries on a daemon thread while the host starts,
+# "lazy" leaves them to the first invocation that needs them
+COLD_START_PRELOAD = os.environ.get("COLD_START_PRELOAD", "background").lower()
+
+# Heavy modules the functions import lazily, timed by warm_imports()
+HEAVY_MODULES = (
+    "requests",
+    "pyodbc",
+    "azure.identity",
+    "azure.storage.blob",
+    "PIL.Image",
+    "apng",
+    "bs4",
+    "numpy",
+)
+
+
+class ResourceRegistry:
+    """
+    Lazily initialised, process-wide clients shared by every invocation.
+
+    Azure keeps the Python worker alive between ticks, so the credential
+    (and its cached tokens), the blob client and SQL connections are built
+    once and reused instead of being recreated on every run. HTTP sessions
+    are already pooled per host by get_http_session().
+
+    SQL connections:
+        - acquire_sql_connection() hands out an idle connection after a
+          SELECT 1 health check, reconnecting when the check fails
+        - release_sql_connection() rolls back anything uncommitted and parks
+          the connection; broken ones are closed instead
+        - Each connection is used by one invocation at a time, so concurrent
+          functions never share a pyodbc connection
+
+    Cold start:
+        - Import and first-use timings are collected for report()
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._credential = None
+        self._blob_service_client = None
+        self._idle_connections = {}
+        self.init_timings = {}
+        self.import_timings = {}
+        self.stats = {"sql_connects": 0, "sql_reuses": 0, "sql_reconnects": 0, "sql_discarded": 0}
+
+    def _record_init(self, name: str, start: float) -> None:
+        self.init_timings.setdefault(name, round(time.perf_counter() - start, 3))
+
+    def warm_imports(self, modules=HEAVY_MODULES) -> dict:
+        """Import the heavy modules, timing the ones not loaded yet."""
+        import importlib
+        import sys
+
+        for module_name in modules:
+            if module_name in self.import_timings:
+                continue
+            already_loaded = module_name in sys.modules
+            start = time.perf_counter()
+            try:
+                importlib.import_module(module_name)
+            except ImportError as e:
+                logging.warning(f"⚠️ Could not preload {module_name}: {e}")
+                continue
+            self.import_timings[module_name] = 0.0 if already_loaded else round(time.perf_counter() - start, 3)
+        return dict(self.import_timings)
+
+    def credential(self):
+        if self._credential is None:
+            with self._lock:
+                if self._credential is None:
+                    from azure.identity import DefaultAzureCredential
+
+                    start = time.perf_counter()
+                    self._credential = DefaultAzureCredential()
+                    self._record_init("credential", start)
+        return self._credential
+
+    def blob_service_client(self):
+        if self._blob_service_client is None:
+            credential = self.credential()
+            with self._lock:
+                if self._blob_service_client is None:
+                    from azure.storage.blob import BlobServiceClient
+
+                    start = time.perf_counter()
+                    self._blob_service_client = BlobServiceClient(
+                        account_url=f"https://{STORAGE_ACCOUNT_NAME}.blob.core.windows.net",
+                        credential=credential
+                    )
+                    self._record_init("blob_service_client", start)
+        return self._blob_service_client
+
+    def http_session(self, url: str):
+        return get_http_session(url)
+
+    def acquire_sql_connection(self, connection_string: str):
+        """
+        Return a healthy pyodbc connection for exclusive use by the caller.
+
+        Raises:
+            pyodbc.Error: If no connection can be established
+        """
+        import pyodbc
+
+        while True:
+            with self._lock:
+                idle = self._idle_connections.get(connection_string) or []
+                conn = idle.pop() if idle else None
+            if conn is None:
+                break
+            try:
+                health_cursor = conn.cursor()
+                health_cursor.execute("SELECT 1").fetchone()
+                health_cursor.close()
+                conn.rollback()
+                self.stats["sql_reuses"] += 1
+                return conn
+            except pyodbc.Error as e:
+                logging.warning(f"⚠️ Pooled SQL connection failed its health check, reconnecting: {str(e)}")
+                self.stats["sql_reconnects"] += 1
+                self._close_quietly(conn)
+
+        start = time.perf_counter()
+        conn = pyodbc.connect(connection_string)
+        self._record_init("sql_connection", start)
+        self.stats["sql_connects"] += 1
+        return conn
+
+    def release_sql_connection(self, connection_string: str, conn, broken: bool = False) -> None:
+        """Park a connection for the next invocation, or close it if it is broken."""
+        import pyodbc
+
+        if conn is None:
+            return
+        if not broken:
+            try:
+                conn.rollback()
+            except pyodbc.Error:
+                broken = True
+
+        if not broken:
+            with self._lock:
+                idle = self._idle_connections.setdefault(connection_string, [])
+                if len(idle) < SQL_POOL_MAX_IDLE:
+                    idle.append(conn)
+                    return
+        self.stats["sql_discarded"] += 1
+        self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def report(self) -> dict:
+        """
+        Cold-start and reuse report for this worker process.
+
+        Returns:
+            dict: module import time, heavy module import times, first-use
+                  initialisation times and SQL connection reuse counters
+        """
+        import sys
+
+        with self._lock:
+            idle = sum(len(connections) for connections in self._idle_connections.values())
+        return {
+            "pid": os.getpid(),
+            "module_import_seconds": _MODULE_IMPORT_SECONDS,
+            "process_age_seconds": round(time.perf_counter() - _MODULE_IMPORT_START, 1),
+            "heavy_imports": dict(self.import_timings),
+            "loaded_heavy_modules": [name for name in HEAVY_MODULES if name in sys.modules],
+            "first_use": dict(self.init_timings),
+            "sql": dict(self.stats, idle=idle),
+        }
+
+
+# Shared by every function in the worker process
+resources = ResourceRegistry()
+_cold_start_reported = set()
+
+
+def log_resource_report(run_name: str) -> None:
+    """Log the full cold-start report on a function's first run, reuse counters afterwards."""
+    report = resources.report()
+    if run_name not in _cold_start_reported:
+        _cold_start_reported.add(run_name)
+        logging.info(f"🧊 {run_name} cold start report: {json.dumps(report)}")
+    else:
+        logging.info(f"♨️ {run_name} warm process {report['pid']}: sql {report['sql']}")
+
+
+def create_blob_service_client():
+    """
+    Return the Blob Storage client for the satellite image account.
+
+    Uses managed identity (DefaultAzureCredential) for secure authentication,
+    so no storage keys are kept in configuration. The client and credential
+    are built once per worker process by the resource registry.
+    """
+    return resources.blob_service_client()
+
+
+# =============================================================================
+# HELPER FUNCTIONS - DATA RETRIEVAL AND PROCESSING
+# =============================================================================
+
+# City catalogue cache: process memory -> local snapshot file -> Data API.
+# The list rarely changes, so a fresh copy is served without any network call.
+CITY_CACHE_TTL_SECONDS = get_env_number("CITY_CACHE_TTL_SECONDS", 3600, int, 0)
+CITY_CACHE_SNAPSHOT_PATH = os.environ.get(
+    "CITY_CACHE_SNAPSHOT_PATH",
+    os.path.join(tempfile.gettempdir(), "climaguate_cities.json"),
+)
+CITIES_API_URL = os.environ.get("CITIES_API_URL", "http://172.176.200.181:5000/rest/GetCities")
+
+_city_cache = {"cities": None, "etag": None, "last_modified": None, "fetched_at": 0.0}
+_city_cache_lock = threading.Lock()
+# Set while one invocation revalidates the list; the others serve the stale copy
+_city_revalidating = False
+_city_cache_refreshed = threading.Condition(_city_cache_lock)
+_city_cache_stats = {
+    "memory_hits": 0,
+    "snapshot_hits": 0,
+    "api_fetches": 0,
+    "not_modified": 0,
+    "stale_served": 0,
+    "misses": 0,
+}
+
+
+def _load_city_snapshot() -> bool:
+    """Populate the memory cache from the local snapshot file, if present."""
+    try:
+        with open(CITY_CACHE_SNAPSHOT_PATH, "r", encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(snapshot.get("cities"), list):
+        return False
+    _city_cache.update(
+        cities=snapshot["cities"],
+        etag=snapshot.get("etag"),
+        last_modified=snapshot.get("last_modified"),
+        fetched_at=float(snapshot.get("fetched_at", 0.0)),
+    )
+    return True
+
+
+def _save_city_snapshot() -> None:
+    try:
+        temp_path = f"{CITY_CACHE_SNAPSHOT_PATH}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+            json.dump(_city_cache, snapshot_file)
+        os.replace(temp_path, CITY_CACHE_SNAPSHOT_PATH)
+    except OSError as e:
+        logging.warning(f"Could not write city snapshot: {e}")
+
+
+def _fetch_cities(etag: str = None, last_modified: str = None):
+    """
+    Call the Data API Builder endpoint, conditionally when validators are known.
+
+    Returns:
+        tuple: (status code, list of cities or None, response headers)
+    """
+    import urllib3
+
+    # HTTP redirects to HTTPS with a self-signed certificate, so verification
+    # is disabled for this internal endpoint only
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    response = http_get(CITIES_API_URL, provider="cities_api", headers=headers, verify=False)
+    if response.status_code == 200:
+        return 200, response.json().get('value', []), response.headers
+    return response.status_code, None, response.headers
+
+
+def get_city_cache_stats() -> dict:
+    with _city_cache_lock:
+        return dict(_city_cache_stats)
+
+
+@instrumented()
+def get_cities_from_api():
+    """
+    Fetch cities through the layered city catalogue cache.
+    
+    This function retrieves the list of cities configured in the system
+    along with their coordinates for weather data collection.
+    
+    Returns:
+        list: List of city dictionaries containing CityCode, CityName, 
+              Latitude, and Longitude, or empty list on failure
+              
+    Cache Layers:
+        - Process memory, trusted for CITY_CACHE_TTL_SECONDS
+        - Local snapshot file (CITY_CACHE_SNAPSHOT_PATH) for cold instances
+        - Data API, revalidated with If-None-Match / If-Modified-Since by one
+          invocation at a time, outside the cache lock
+        - Stale copy served to the others while it revalidates
+          (stale-while-revalidate) and when the API is down (stale-if-error)
+        - A cold instance with no copy waits for the revalidating invocation
+              
+    Error Handling:
+        - HTTP 5xx responses are retried with exponential backoff and jitter
+          by the shared retry policy (seconds instead of fixed 30s sleeps)
+        - Network timeouts and connection issues  
+        - JSON parsing errors
+    """
+    import requests  # Import inside function
+
+    global _city_revalidating
+    with _city_cache_lock:
+        if _city_cache["cities"] is None and _load_city_snapshot():
+            source = "snapshot_hits"
+        else:
+            source = "memory_hits"
+
+        # Cold start: nothing to serve until the invocation already fetching is done
+        waited = False
+        while _city_revalidating and _city_cache["cities"] is None:
+            waited = True
+            _city_cache_refreshed.wait()
+        if waited and _city_cache["cities"] is None:
+            _city_cache_stats["misses"] += 1
+            logging.error("❌ No cached city list available. Aborting city fetch.")
+            return []
+
+        age = time.time() - _city_cache["fetched_at"]
+        if _city_cache["cities"] is not None and age < CITY_CACHE_TTL_SECONDS:
+            _city_cache_stats[source] += 1
+            logging.info(f"✅ Loaded {len(_city_cache['cities'])} cities from {source.split('_')[0]} cache (age {age:.0f}s).")
+            return list(_city_cache["cities"])
+
+        if _city_revalidating:
+            _city_cache_stats["stale_served"] += 1
+            logging.info(
+                f"♻️ Serving stale city list ({len(_city_cache['cities'])} cities, age {age:.0f}s) "
+                f"while another invocation revalidates it."
+            )
+            return list(_city_cache["cities"])
+
+        # This invocation revalidates; the lock is not held during the request and its retries
+        _city_revalidating = True
+        etag, last_modified = _city_cache["etag"], _city_cache["last_modified"]
+
+    fetched = None
+    try:
+        fetched = _fetch_cities(etag, last_modified)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"❌ Error fetching cities: {e}")
+    except ValueError as e:
+        logging.error(f"❌ Invalid JSON from cities API: {e}")
+    except BaseException:
+        with _city_cache_lock:
+            _city_revalidating = False
+            _city_cache_refreshed.notify_all()
+        raise
+
+    with _city_cache_lock:
+        _city_revalidating = False
+        _city_cache_refreshed.notify_all()
+
+        if fetched is not None:
+            status, cities_list, headers = fetched
+            if status == 304 and _city_cache["cities"] is not None:
+                _city_cache_stats["not_modified"] += 1
+                _city_cache["fetched_at"] = time.time()
+                _save_city_snapshot()
+                logging.info(f"✅ City list unchanged (HTTP 304), {len(_city_cache['cities'])} cities.")
+                return list(_city_cache["cities"])
+            if status == 200:
+                _city_cache_stats["api_fetches"] += 1
+                _city_cache.update(
+                    cities=cities_list,
+                    etag=headers.get("ETag"),
+                    last_modified=headers.get("Last-Modified"),
+                    fetched_at=time.time(),
+                )
+                _save_city_snapshot()
+                logging.info(f"✅ Loaded {len(cities_list)} cities from API with coordinates.")
+                return list(cities_list)
+            logging.error(f"❌ HTTP {status} from cities API after retries.")
+
+        # API unavailable: keep the batch running on the last known city list
+        if _city_cache["cities"] is not None:
+            _city_cache_stats["stale_served"] += 1
+            logging.warning(f"⚠️ Serving stale city list ({len(_city_cache['cities'])} cities, age {age:.0f}s).")
+            return list(_city_cache["cities"])
+
+        _city_cache_stats["misses"] += 1
+        logging.error("❌ No cached city list available. Aborting city fetch.")
+        return []
+
+
+# Upstream base URLs; overridable so benchmarks can point them at a local replay server
+OPENWEATHER_BASE_URL = os.environ.get("OPENWEATHER_BASE_URL", "https://api.openweathermap.org")
+AZURE_MAPS_BASE_URL = os.environ.get("AZURE_MAPS_BASE_URL", "https://atlas.microsoft.com")
+
+
+def build_weather_row(data: dict, city_code: str, city_name: str) -> tuple:
+    """
+    Turn one OpenWeatherMap current-weather payload into a WeatherData row.
+
+    Accepts both the /data/2.5/weather response and an item of the
+    /data/2.5/group list, so both collectors feed the same insert path.
+
+    Args:
+        data (dict): Decoded current-weather payload
+        city_code (str): Unique city identifier (e.g., 'GUA')
+        city_name (str): Human-readable city name
+
+    Returns:
+        tuple: Parameters for WEATHER_INSERT_QUERY
+
+    Raises:
+        KeyError, IndexError, TypeError: If the payload misses required fields
+    """
+    # Extract coordinate data
+    coord_lon = data["coord"]["lon"]
+    coord_lat = data["coord"]["lat"]
+    
+    # Weather condition information
+    weather_id = data["weather"][0]["id"]
+    weather_main = data["weather"][0]["main"]
+    weather_description = data["weather"][0]["description"]
+    weather_icon = data["weather"][0]["icon"]
+    
+    # Base station and main atmospheric data
+    base = data.get("base")  # not part of /group items
+    main_temp = data["main"]["temp"]
+    main_feels_like = data["main"]["feels_like"]
+    main_pressure = data["main"]["pressure"]
+    main_humidity = data["main"]["humidity"]
+    main_temp_min = data["main"]["temp_min"]
+    main_temp_max = data["main"]["temp_max"]
+    main_sea_level = data["main"].get("sea_level")
+    main_grnd_level = data["main"].get("grnd_level")
+    
+    # Visibility and wind data
+    visibility = data.get("visibility")
+    wind_speed = data["wind"]["speed"]
+    wind_deg = data["wind"]["deg"]
+    wind_gust = data["wind"].get("gust")
+    
+    # Cloud coverage and precipitation
+    clouds_all = data["clouds"]["all"]
+    rain_1h = data.get("rain", {}).get("1h")
+    rain_3h = data.get("rain", {}).get("3h")
+    
+    # Timestamp and system data
+    dt = data["dt"]
+    sys_country = data["sys"]["country"]
+    sys_sunrise = data["sys"]["sunrise"]
+    sys_sunset = data["sys"]["sunset"]
+    # /group items carry the UTC offset under sys instead of the top level
+    timezone = data["timezone"] if "timezone" in data else data["sys"]["timezone"]
+    city_id = data["id"]
+
+    # Parameter tuple for WEATHER_INSERT_QUERY (timestamps converted by SQL Server)
+    return (
+        coord_lon,
+        coord_lat,
+        weather_id,
+        weather_main,
+        weather_description,
+        weather_icon,
+        base,
+        main_temp,
+        main_feels_like,
+        main_pressure,
+        main_humidity,
+        main_temp_min,
+        main_temp_max,
+        main_sea_level,
+        main_grnd_level,
+        visibility,
+        wind_speed,
+        wind_deg,
+        wind_gust,
+        clouds_all,
+        rain_1h,
+        rain_3h,
+        dt,
+        sys_country,
+        sys_sunrise,
+        sys_sunset,
+        timezone,
+        city_id,
+        city_name,
+        city_code,
+        dt,
+        sys_sunrise,
+        sys_sunset,
+    )
+
+
+@instrumented()
+def process_city_weather(apikey: str, city_code: str, city_name: str, latitude: float, longitude: float):
+    """
+    Fetch current weather data for a city from OpenWeatherMap API and build its database row.
+    
+    This function retrieves comprehensive weather information including temperature,
+    humidity, wind, pressure, visibility, and precipitation data.
+    
+    Args:
+        apikey (str): OpenWeatherMap API key
+        city_code (str): Unique city identifier (e.g., 'GUA')
+        city_name (str): Human-readable city name  
+        latitude (float): City latitude coordinate
+        longitude (float): City longitude coordinate
+        
+    Returns:
+        tuple: Parameters for WEATHER_INSERT_QUERY, or None if the API call failed
+        
+    Database Operations:
+        - Row is written later by BatchWriter into weather.WeatherData
+        - Converts Unix timestamps to Central America timezone
+        - Handles nullable fields gracefully
+        
+    API Integration:
+        - Uses metric units and Spanish language
+        - Includes current conditions and atmospheric data
+        - Error handling for API failures and network issues
+    """
+    import requests  # Import inside function
+    
+    try:
+        api_call = (
+            f"{OPENWEATHER_BASE_URL}/data/2.5/weather?lat={latitude}&lon={longitude}"
+            f"&appid={apikey}&lang=es&units=metric"
+        )
+
+        response, changed = _response_cache.get(api_call, "owm_weather")
+        response.raise_for_status()
+        if not changed:
+            logging.info(f"Weather for {city_name} unchanged since last run, skipping")
+            return None
+        data = response.json()
+        return build_weather_row(data, city_code, city_name)
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to get weather data for {city_name}: {e}")
+        return None
+    except (KeyError, IndexError, TypeError, ValueError) as e:
+        # Unexpected payload: forget it so the next run does not skip it as unchanged
+        _response_cache.forget(api_call)
+        logging.error(f"Error processing weather data for {city_name}: {e}")
+        return None
+
+
+# OpenWeatherMap /data/2.5/group: current weather for several city ids per call.
+# Set OWM_GROUP_REQUESTS_ENABLED=false to go back to one coordinate request per city.
+OWM_GROUP_REQUESTS_ENABLED = os.environ.get("OWM_GROUP_REQUESTS_ENABLED", "true").lower() == "true"
+OWM_GROUP_MAX_IDS = 20
+OWM_GROUP_SIZE = min(OWM_GROUP_MAX_IDS, get_env_number("OWM_GROUP_SIZE", OWM_GROUP_MAX_IDS, int, 1))
+
+# Position of the OpenWeatherMap city id (WeatherData.Id) inside a weather row
+WEATHER_OWM_ID_POSITION = 27
+
+OWM_CITY_ID_UPDATE_QUERY = "UPDATE weather.cities SET OwmCityId = ? WHERE CityCode = ? AND OwmCityId IS NULL"
+
+# Ids learned from coordinate lookups in this process, used until the cached
+# city list carries the persisted OwmCityId
+_owm_city_ids = {}
+_owm_city_ids_lock = threading.Lock()
+
+
+def get_owm_city_id(city: dict):
+    """Return the city's OpenWeatherMap id from the city list or this process, or None."""
+    with _owm_city_ids_lock:
+        return city.get("OwmCityId") or _owm_city_ids.get(city.get("CityCode"))
+
+
+def remember_owm_city_id(city: dict, owm_city_id) -> bool:
+    """
+    Record the id returned by a coordinate lookup for a city that had none.
+
+    Returns:
+        bool: True when the id is new and still has to be persisted
+    """
+    if not owm_city_id or city.get("OwmCityId"):
+        return False
+    with _owm_city_ids_lock:
+        if _owm_city_ids.get(city["CityCode"]) == owm_city_id:
+            return False
+        _owm_city_ids[city["CityCode"]] = owm_city_id
+    return True
+
+
+def plan_weather_groups(cities: list) -> tuple:
+    """
+    Split cities into /group batches and cities that need a coordinate request.
+
+    Cities without a resolved id, or sharing one with another city (the group
+    call would give them identical weather), stay on the coordinate request.
+
+    Returns:
+        tuple: (list of groups, each a list of (owm_id, city), list of unmapped cities)
+    """
+    by_id = {}
+    unmapped = []
+    for city in cities:
+        owm_city_id = get_owm_city_id(city)
+        if owm_city_id:
+            by_id.setdefault(owm_city_id, []).append(city)
+        else:
+            unmapped.append(city)
+
+    mapped = []
+    for owm_city_id, members in sorted(by_id.items()):
+        if len(members) == 1:
+            mapped.append((owm_city_id, members[0]))
+        else:
+            unmapped.extend(members)
+
+    groups = [mapped[start:start + OWM_GROUP_SIZE] for start in range(0, len(mapped), OWM_GROUP_SIZE)]
+    return groups, unmapped
+
+
+def fetch_weather_group(apikey: str, members: list) -> tuple:
+    """
+    Fetch current weather for one group of mapped cities.
+
+    Args:
+        apikey (str): OpenWeatherMap API key
+        members (list): (owm_id, city) pairs, at most OWM_GROUP_MAX_IDS
+
+    Returns:
+        tuple: (WeatherData rows, cities to retry with a coordinate request)
+    """
+    import requests
+
+    ids = ",".join(str(owm_city_id) for owm_city_id, _ in members)
+    api_call = f"{OPENWEATHER_BASE_URL}/data/2.5/group?id={ids}&appid={apikey}&lang=es&units=metric"
+    cities_by_id = {owm_city_id: city for owm_city_id, city in members}
+
+    try:
+        response, changed = _response_cache.get(api_call, "owm_weather_group")
+        response.raise_for_status()
+        if not changed:
+            logging.info(f"Weather group of {len(members)} cities unchanged since last run, skipping")
+            return [], []
+        items = response.json()["list"]
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"⚠️ Weather group request failed, falling back to coordinates: {e}")
+        return [], list(cities_by_id.values())
+    except (KeyError, TypeError, ValueError) as e:
+        _response_cache.forget(api_call)
+        logging.warning(f"⚠️ Unexpected weather group payload, falling back to coordinates: {e}")
+        return [], list(cities_by_id.values())
+
+    rows = []
+    for item in items:
+        city = cities_by_id.pop(item.get("id"), None) if isinstance(item, dict) else None
+        if city is None:
+            continue
+        try:
+            rows.append(build_weather_row(item, city["CityCode"], city["CityName"]))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logging.error(f"Error processing group weather data for {city['CityName']}: {e}")
+            cities_by_id[item["id"]] = city
+
+    if cities_by_id:
+        # Ids missing from the answer (or unparsable) are retried individually;
+        # the cached payload is dropped so the retry next tick is not skipped
+        _response_cache.forget(api_call)
+    return rows, list(cities_by_id.values())
+
+
+@instrumented()
+def fetch_weather_groups(apikey: str, cities: list, max_workers: int = 1) -> tuple:
+    """
+    Collect current weather for every mapped city with /data/2.5/group calls.
+
+    Args:
+        apikey (str): OpenWeatherMap API key
+        cities (list): Validated city dictionaries
+        max_workers (int): Concurrent group requests
+
+    Returns:
+        tuple: (WeatherData rows, cities that still need process_city_weather)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    groups, fallback = plan_weather_groups(cities)
+    rows = []
+    if groups:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="weather-group") as executor:
+            futures = [submit_in_context(executor, fetch_weather_group, apikey, members) for members in groups]
+            for future in futures:
+                group_rows, group_fallback = future.result()
+                rows.extend(group_rows)
+                fallback.extend(group_fallback)
+
+    mapped = sum(len(members) for members in groups)
+    logging.info(
+        f"🌤️ Weather groups: {mapped} cities in {len(groups)} requests, "
+        f"{len(fallback)} cities by coordinates"
+    )
+    count("owm_group_requests", len(groups))
+    return rows, fallback
+
+
+def persist_owm_city_ids(cursor, resolved: dict) -> None:
+    """
+    Store newly resolved OpenWeatherMap ids on weather.cities and commit.
+    A failure only means the ids are resolved again by the next tick.
+
+    Args:
+        cursor: pyodbc cursor of the batch connection
+        resolved (dict): CityCode -> OpenWeatherMap city id
+    """
+    import pyodbc
+
+    try:
+        cursor.executemany(OWM_CITY_ID_UPDATE_QUERY, [(owm_city_id, code) for code, owm_city_id in resolved.items()])
+        cursor.connection.commit()
+        logging.info(f"🌤️ Resolved OpenWeatherMap ids for {len(resolved)} cities")
+    except pyodbc.Error as e:
+        cursor.connection.rollback()
+        # Forget them so the next tick resolves and stores them again
+        with _owm_city_ids_lock:
+            for code in resolved:
+                _owm_city_ids.pop(code, None)
+        logging.warning(f"⚠️ Could not store OpenWeatherMap city ids: {str(e)}")
+
+
+@instrumented()
+def process_city_air_quality(apikey: str, city_code: str, city_name: str, latitude: float, longitude: float):
+    """
+    Fetch air quality data for a city from OpenWeatherMap API and build its database row.
+    
+    This function retrieves comprehensive air pollution data including AQI levels
+    and individual pollutant concentrations for health monitoring.
+    
+    Args:
+        apikey (str): OpenWeatherMap API key
+        city_code (str): Unique city identifier
+        city_name (str): Human-readable city name
+        latitude (float): City latitude coordinate
+        longitude (float): City longitude coordinate
+        
+    Air Quality Data:
+        - Overall AQI (Air Quality Index) on 1-5 scale
+        - Individual pollutant concentrations (μg/m³):
+          * CO (Carbon Monoxide)
+          * NO (Nitrogen Monoxide) 
+          * NO2 (Nitrogen Dioxide)
+          * O3 (Ozone)
+          * SO2 (Sulfur Dioxide)
+          * PM2.5 (Fine Particulate Matter)
+          * PM10 (Coarse Particulate Matter)
+          * NH3 (Ammonia)
+          
+    Returns:
+        tuple: Parameters for AIR_QUALITY_INSERT_QUERY, or None on failure
+          
+    Database Operations:
+        - Row is written later by BatchWriter into weather.AirQuality
+        - Maps numeric AQI to descriptive categories
+        - Handles missing pollutant data with default values
+    """
+    import requests  # Import inside function
+    
+    try:
+        api_call = f"{OPENWEATHER_BASE_URL}/data/2.5/air_pollution?lat={latitude}&lon={longitude}&appid={apikey}"
+
+        response, changed = _response_cache.get(api_call, "owm_air_pollution")
+        response.raise_for_status()
+        if not changed:
+            logging.info(f"Air quality for {city_name} unchanged since last run, skipping")
+            return None
+        data = response.json()
+
+        # Extract air quality data from API response
+        air_data = data["list"][0]  # Current air quality data
+        aqi = air_data["main"]["aqi"]  # Air Quality Index (1-5)
+        components = air_data["components"]
+        
+        # Get timestamp for data collection
+        dt = air_data["dt"]
+        
+        # Map numeric AQI to descriptive categories for database storage
+        aqi_categories = {
+            1: "Good",
+            2: "Fair", 
+            3: "Moderate",
+            4: "Poor",
+            5: "Very Poor"
+        }
+        category = aqi_categories.get(aqi, "Unknown")
+
+        logging.info(f"Air quality data collected for {city_name} - AQI: {aqi} ({category})")
+
+        # Parameter tuple for AIR_QUALITY_INSERT_QUERY
+        return (
+            city_code,
+            city_name,
+            latitude,
+            longitude,
+            aqi,
+            category,
+            components.get("co", 0),        # Carbon monoxide (μg/m³)
+            components.get("no", 0),        # Nitrogen monoxide (μg/m³)
+            components.get("no2", 0),       # Nitrogen dioxide (μg/m³)
+            components.get("o3", 0),        # Ozone (μg/m³)
+            components.get("so2", 0),       # Sulphur dioxide (μg/m³)
+            components.get("pm2_5", 0),     # PM2.5 (μg/m³)
+            components.get("pm10", 0),      # PM10 (μg/m³)
+            components.get("nh3", 0),       # Ammonia (μg/m³)
+            dt,
+            dt
+        )
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to get air quality data for {city_name}: {e}")
+    except Exception as e:
+        _response_cache.forget(api_call)
+        logging.error(f"Error processing air quality data for {city_name}: {e}")
+    return None
+
+
+# Parser used to find the image in the get-abi page: "stream" (stop at the first
+# <img src>), or "lxml" / "html.parser" for a full BeautifulSoup parse. The
+# alternatives are kept so parse time can be compared in the logs.
+NASA_PAGE_PARSER = os.environ.get("NASA_PAGE_PARSER", "stream")
+
+# Upper bounds for the streamed page scan and the satellite image download
+NASA_PAGE_SCAN_LIMIT = 256 * 1024
+NASA_IMAGE_MAX_BYTES = get_env_number("NASA_IMAGE_MAX_BYTES", 32 * 1024 * 1024, int, 1024 * 1024)
+
+NASA_BASE_URL = os.environ.get("NASA_BASE_URL", "https://weather.ndc.nasa.gov")
+
+
+def _peak_rss_mb():
+    """Peak resident set size of the worker process in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def find_first_img_src(response, parser: str = "stream"):
+    """
+    Extract the src of the first <img> tag from a streamed HTML response.
+
+    The streaming scanner reads the body in chunks and stops regex scanning as
+    soon as the first img src is complete, so the rest of the page is never
+    parsed (and, for oversized pages, never downloaded). If nothing matches within
+    NASA_PAGE_SCAN_LIMIT bytes, the scanned text is handed to lxml instead.
+
+    Args:
+        response: requests.Response opened with stream=True
+        parser (str): "stream", "lxml" or "html.parser"
+
+    Returns:
+        str: The src attribute value, or None if no image was found
+    """
+    import re
+    from bs4 import BeautifulSoup
+
+    if parser != "stream":
+        img_tag = BeautifulSoup(response.content, parser).find("img")
+        return img_tag.get("src") if img_tag else None
+
+    img_pattern = re.compile(rb"<img\b[^>]*?\bsrc\s*=\s*[\"']([^\"']+)[\"']", re.IGNORECASE)
+    scanned = bytearray()
+    img_src = None
+    try:
+        for chunk in response.iter_content(chunk_size=8192):
+            scanned.extend(chunk)
+            match = img_pattern.search(scanned)
+            if match:
+                img_src = match.group(1).decode("utf-8", errors="replace")
+                break
+            if len(scanned) >= NASA_PAGE_SCAN_LIMIT:
+                break
+        if img_src is not None:
+            # Small pages are drained so the keep-alive connection returns to the pool
+            page_size = int(response.headers.get("Content-Length") or 0)
+            if 0 < page_size <= NASA_PAGE_SCAN_LIMIT:
+                for _ in response.iter_content(chunk_size=8192):
+                    pass
+            return img_src
+    finally:
+        response.close()
+
+    # Unusual markup (e.g. unquoted attributes): fall back to a real parser
+    img_tag = BeautifulSoup(bytes(scanned), "lxml").find("img")
+    return img_tag.get("src") if img_tag else None
+
+
+def read_bounded_image(response):
+    """
+    Stream an image response into memory with a hard size limit.
+
+    Returns:
+        BytesIO: Buffer positioned at the start, ready for Image.open
+
+    Raises:
+        ValueError: If the image is larger than NASA_IMAGE_MAX_BYTES
+    """
+    from io import BytesIO
+
+    declared_size = int(response.headers.get("Content-Length") or 0)
+    if declared_size > NASA_IMAGE_MAX_BYTES:
+        response.close()
+        raise ValueError(f"Satellite image too large ({declared_size} bytes)")
+
+    buffer = BytesIO()
+    try:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            buffer.write(chunk)
+            if buffer.tell() > NASA_IMAGE_MAX_BYTES:
+                raise ValueError(f"Satellite image exceeded {NASA_IMAGE_MAX_BYTES} bytes")
+    finally:
+        response.close()
+    record_bytes("in", _http_origin(response.url or "").split("://", 1)[-1], buffer.tell())
+    buffer.seek(0)
+    return buffer
+
+
+def decode_center_crop(image_buffer, crop_size: int = 400):
+    """
+    Open a satellite image and return the centered crop.
+
+    Image.open only reads the header, so the crop box is computed before any
+    pixel data is decoded; the full raster is decoded once, cropped and then
+    released. Image.draft/reduce are not used because the crop is kept at
+    native resolution and reducing would change the map scale.
+    """
+    from PIL import Image
+
+    with Image.open(image_buffer) as image_data:
+        main_width, main_height = image_data.size
+
+        # Crop the image to a square from the center, approximately 400x400 pixels
+        # This focuses the view on the specific geographic area of interest
+        left = max(0, (main_width - crop_size) // 2)
+        top = max(0, (main_height - crop_size) // 2)
+        right = min(main_width, left + crop_size)
+        bottom = min(main_height, top + crop_size)
+
+        cropped = image_data.crop((left, top, right, bottom))
+        cropped.load()
+    return cropped
+
+
+def satellite_page_url(latitude: float, longitude: float) -> str:
+    """get-abi page URL for the given center; also the response cache key of its image."""
+    return (
+        f"{NASA_BASE_URL}/cgi-bin/get-abi?"
+        f"satellite=GOESEastfullDiskband13&lat={latitude}&lon={longitude}&quality=100&palette=ir2.pal&colorbar=0&mapcolor=white"
+    )
+
+
+def fetch_satellite_image(latitude: float, longitude: float, label: str):
+    """
+    Download the get-abi satellite image centered on the given coordinates.
+
+    Args:
+        latitude (float): Center latitude
+        longitude (float): Center longitude
+        label (str): Name used in the timing log line (city code or "region")
+
+    Returns:
+        BytesIO: Bounded buffer with the encoded image, None if unavailable, or
+                 RESPONSE_UNCHANGED if the image is byte-identical to the last one.
+                 The new image's hash is recorded at once; a caller that fails to
+                 publish it must _response_cache.forget(satellite_page_url(...))
+    """
+    # Construct NASA GOES satellite image URL with specific parameters
+    image_page_url = satellite_page_url(latitude, longitude)
+
+    scan_start = time.perf_counter()
+    response = http_get(image_page_url, provider="nasa_abi", stream=(NASA_PAGE_PARSER == "stream"))
+    if response.status_code != 200:
+        response.close()
+        return None
+
+    # Find the actual satellite image URL, stopping at the first <img src>
+    img_src = find_first_img_src(response, NASA_PAGE_PARSER)
+    scan_seconds = time.perf_counter() - scan_start
+    if not img_src:
+        return None
+
+    # Stream the satellite image into a bounded buffer
+    download_start = time.perf_counter()
+    img_response = http_get(NASA_BASE_URL + img_src, provider="nasa_image", stream=True)
+    if img_response.status_code != 200:
+        img_response.close()
+        return None
+    image_buffer = read_bounded_image(img_response)
+
+    # The image URL is a new temporary name each time, so the page URL is the cache key
+    if not _response_cache.content_changed(image_page_url, "nasa_abi", image_buffer.getbuffer()):
+        logging.info(f"NASA {label}: image unchanged since last run, skipping")
+        return RESPONSE_UNCHANGED
+
+    logging.info(
+        f"NASA {label}: page scan {scan_seconds * 1000:.0f}ms ({NASA_PAGE_PARSER}), "
+        f"image {image_buffer.getbuffer().nbytes / 1024:.0f}KB in "
+        f"{(time.perf_counter() - download_start) * 1000:.0f}ms, peak RSS {_peak_rss_mb() or 0:.0f}MB"
+    )
+    return image_buffer
+
+
+# Shared regional fetch: one get-abi image per tick, every city cropped from it.
+# get-abi does not report its map scale, so NASA_PIXELS_PER_DEGREE must be
+# calibrated against a per-city image before enabling NASA_SHARED_FETCH.
+NASA_SHARED_FETCH = os.environ.get("NASA_SHARED_FETCH", "false").lower() == "true"
+NASA_PIXELS_PER_DEGREE = get_env_number("NASA_PIXELS_PER_DEGREE", 50.0, float, 1.0)
+SATELLITE_CROP_SIZE = 400
+
+
+class RegionalSatelliteImage:
+    """
+    One decoded satellite raster shared by all cities of a tick.
+
+    City coordinates are projected into pixel space with a local
+    equirectangular approximation around the raster center, which is accurate
+    enough over the few degrees Guatemala spans.
+    """
+
+    def __init__(self, image, center_latitude: float, center_longitude: float, pixels_per_degree: float):
+        import math
+
+        self.image = image
+        self.center_latitude = center_latitude
+        self.center_longitude = center_longitude
+        self.pixels_per_degree_lat = pixels_per_degree
+        self.pixels_per_degree_lon = pixels_per_degree * math.cos(math.radians(center_latitude))
+
+    def project(self, latitude: float, longitude: float):
+        """Return the (x, y) pixel of a coordinate in the regional raster."""
+        width, height = self.image.size
+        x = width / 2 + (longitude - self.center_longitude) * self.pixels_per_degree_lon
+        y = height / 2 - (latitude - self.center_latitude) * self.pixels_per_degree_lat
+        return int(round(x)), int(round(y))
+
+    def crop_for(self, latitude: float, longitude: float, crop_size: int = SATELLITE_CROP_SIZE):
+        """
+        Cut the city's square from the shared raster.
+
+        Returns:
+            PIL.Image: The crop, or None if the square does not fit inside the raster
+                       (the caller then falls back to a per-city request)
+        """
+        x, y = self.project(latitude, longitude)
+        left, top = x - crop_size // 2, y - crop_size // 2
+        right, bottom = left + crop_size, top + crop_size
+        width, height = self.image.size
+        if left < 0 or top < 0 or right > width or bottom > height:
+            return None
+        return self.image.crop((left, top, right, bottom))
+
+
+def regional_center(cities: list):
+    """
+    Center of the bounding box of all cities, rounded like the get-abi query.
+
+    Returns:
+        tuple: (latitude, longitude), or None for an empty city list
+    """
+    latitudes = [city['Latitude'] for city in cities]
+    longitudes = [city['Longitude'] for city in cities]
+    if not latitudes:
+        return None
+    return (
+        round((min(latitudes) + max(latitudes)) / 2, 4),
+        round((min(longitudes) + max(longitudes)) / 2, 4),
+    )
+
+
+def fetch_regional_satellite_image(center_latitude: float, center_longitude: float):
+    """
+    Fetch a single satellite image centered on the region (see regional_center).
+
+    Returns:
+        RegionalSatelliteImage: Shared raster, None if the fetch failed, or
+                                RESPONSE_UNCHANGED if the raster did not change
+    """
+    import requests  # Import inside function
+    from PIL import Image
+
+    try:
+        image_buffer = fetch_satellite_image(center_latitude, center_longitude, "region")
+        if image_buffer is None or image_buffer is RESPONSE_UNCHANGED:
+            return image_buffer
+        image = Image.open(image_buffer)
+        image.load()
+    except (requests.exceptions.RequestException, ValueError, OSError) as e:
+        # An undecodable raster must not be reported unchanged next tick
+        _response_cache.forget(satellite_page_url(center_latitude, center_longitude))
+        logging.error(f"Failed to get regional NASA image, using per-city requests: {e}")
+        return None
+
+    logging.info(f"Regional NASA image {image.size[0]}x{image.size[1]} centered on ({center_latitude}, {center_longitude})")
+    return RegionalSatelliteImage(image, center_latitude, center_longitude, NASA_PIXELS_PER_DEGREE)
+
+
+def publish_satellite_frame(
+    blob_service_client, container_name: str, icon_url: str, city_code: str, image_data, frame_time=None
+) -> None:
+    """
+    Overlay the marker on a cropped frame, upload it and refresh the city animation.
+
+    frame_time names the blob (defaults to now, naive UTC like satellite_tick);
+    queued jobs pass their tick so a redelivered job overwrites the same frame
+    instead of adding a second one.
+    """
+    # Generate timestamped filename for image organization
+    frame_time = frame_time or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    date_img = frame_time.strftime(FRAME_TIMESTAMP_FORMAT)
+    blob_name = f"{city_code}/{date_img}.jpg"
+
+    # Add location marker icon to the processed image
+    modified_image_data = add_icon_to_image(image_data, icon_url)
+
+    # Upload processed image to Azure Blob Storage
+    blob_client = blob_service_client.get_blob_client(
+        container=container_name, blob=blob_name
+    )
+    blob_client.upload_blob(
+        modified_image_data, blob_type="BlockBlob", overwrite=True
+    )
+    record_bytes("out", "blob", len(modified_image_data))
+    logging.info(f"Image uploaded to {container_name}/{blob_name}")
+
+    # Record the frame in the city's index.json so nothing has to list the prefix
+    frame_names = update_frame_manifest(
+        city_code, blob_service_client, container_name, blob_name
+    )
+
+    # Generate updated animation, reusing the frames encoded by earlier runs
+    generate_animation_for_city(
+        city_code, blob_service_client, container_name,
+        new_frame_name=blob_name, new_frame_bytes=modified_image_data,
+        frame_names=frame_names
+    )
+
+
+@instrumented()
+def process_city_nasa(
+    blob_service_client,
+    container_name: str,
+    icon_url: str,
+    city_code: str,
+    latitude: float,
+    longitude: float,
+    regional_image: RegionalSatelliteImage = None,
+    frame_time: datetime.datetime = None,
+) -> str:
+    """
+    Fetch NASA GOES satellite image for a city, overlay location icon, and generate animation.
+    
+    This function downloads infrared satellite imagery from NASA's GOES satellite system,
+    processes the image by cropping and adding a location marker, uploads to Azure Blob Storage,
+    and triggers animation generation from recent images.
+    
+    Args:
+        blob_service_client: Azure Blob Storage service client
+        container_name (str): Blob storage container name
+        icon_url (str): URL to location marker icon
+        city_code (str): Unique city identifier for file organization
+        latitude (float): City latitude for satellite positioning
+        longitude (float): City longitude for satellite positioning
+        regional_image (RegionalSatelliteImage): Shared raster of this tick (optional)
+        frame_time (datetime): Timestamp used in the frame blob name (defaults to now)
+
+    Returns:
+        str: "published", "unchanged" (same image as the last published frame,
+             nothing written) or "failed" if NASA could not be reached or
+             returned no image (the queue worker turns this into a retry)
+        
+    Image Processing:
+        - Cuts the city square from the shared regional raster when available
+        - Skips the frame entirely when the image is byte-identical to the last
+          published one (a frame that failed to publish is fetched again)
+        - Otherwise streams the get-abi page only until the first <img src> is found
+          and streams the city's own image into a bounded buffer
+        - Crops to 400x400 pixel square centered on coordinates
+        - Overlays location marker icon for geographic reference
+        - Saves as JPEG format for web optimization
+        
+    Storage Operations:
+        - Uploads processed image to Azure Blob Storage
+        - Organizes files by city code in folder structure
+        - Appends the frame to the city's index.json manifest
+        - Triggers animation generation from recent images
+        - Provides timestamped filename for tracking
+        
+    Error Handling:
+        - Network failures during image download
+        - Oversized images (NASA_IMAGE_MAX_BYTES) are rejected while streaming
+        - Image processing errors
+        - Blob storage upload failures
+        - HTML parsing issues from NASA website
+    """
+    import requests  # Import inside function
+    
+    fetched = False
+    published = False
+    try:
+        image_data = None
+        if regional_image is not None:
+            image_data = regional_image.crop_for(latitude, longitude)
+            if image_data is None:
+                logging.info(f"{city_code} is outside the regional NASA image, using per-city request")
+
+        if image_data is None:
+            image_buffer = fetch_satellite_image(latitude, longitude, city_code)
+            if image_buffer is RESPONSE_UNCHANGED:
+                return "unchanged"
+            if image_buffer is None:
+                logging.warning(f"NASA returned no image for {city_code}")
+                return "failed"
+            fetched = True
+            image_data = decode_center_crop(image_buffer, SATELLITE_CROP_SIZE)
+            del image_buffer
+
+        publish_satellite_frame(blob_service_client, container_name, icon_url, city_code, image_data, frame_time)
+        published = True
+        return "published"
+
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Failed to get NASA image for {city_code}: {e}")
+        return "failed"
+    finally:
+        if fetched and not published:
+            # The image hash was recorded on download; drop it so the retry publishes the frame
+            _response_cache.forget(satellite_page_url(latitude, longitude))
+
+
+# =============================================================================
+# SATELLITE JOB QUEUE
+# =============================================================================
+
+# "queue": run_city_batch enqueues one job per city for process_satellite_job,
+# "local": the same jobs through an in-process queue drained after the DB commit,
+# "inline": the NASA stage runs inside the batch fan-out as before
+SATELLITE_PROCESSING_MODES = ("queue", "local", "inline")
+SATELLITE_PROCESSING_MODE = os.environ.get("SATELLITE_PROCESSING_MODE", "queue").lower()
+if SATELLITE_PROCESSING_MODE not in SATELLITE_PROCESSING_MODES:
+    logging.warning(f"⚠️ Unknown SATELLITE_PROCESSING_MODE={SATELLITE_PROCESSING_MODE}, using queue")
+    SATELLITE_PROCESSING_MODE = "queue"
+
+# Storage queue on AzureWebJobsStorage; worker concurrency is set in host.json (extensions.queues)
+SATELLITE_QUEUE_NAME = "satellite-jobs"
+
+# Jobs are keyed on the batch tick; jobs older than two ticks are superseded and dropped
+SATELLITE_TICK_MINUTES = 20
+SATELLITE_JOB_MAX_AGE_SECONDS = get_env_number("SATELLITE_JOB_MAX_AGE_SECONDS", 2 * SATELLITE_TICK_MINUTES * 60, int, 60)
+
+# Regional raster shared by the jobs of one tick (only the latest tick is kept)
+_regional_tick_image = {}
+_regional_tick_lock = threading.Lock()
+
+
+def satellite_tick(now: datetime.datetime = None) -> datetime.datetime:
+    """Floor a UTC time (naive, like the frame names) to its batch tick."""
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return now.replace(
+        minute=now.minute - now.minute % SATELLITE_TICK_MINUTES, second=0, microsecond=0
+    )
+
+
+def build_satellite_jobs(
+    cities: list, tick: datetime.datetime, shared_fetch: bool = NASA_SHARED_FETCH, center: tuple = None
+) -> list:
+    """
+    Build one JSON job per city for the tick, de-duplicated on CityCode.
+
+    Args:
+        center (tuple): Regional raster center; defaults to the center of these
+                        cities (shards pass the center of the whole city list)
+
+    Returns:
+        list: Message bodies for the satellite queue
+    """
+    if shared_fetch and center is None:
+        center = regional_center(cities)
+    elif not shared_fetch:
+        center = None
+    jobs = {}
+    for city in cities:
+        jobs[city['CityCode']] = json.dumps({
+            "city_code": city['CityCode'],
+            "latitude": city['Latitude'],
+            "longitude": city['Longitude'],
+            "tick": tick.strftime(FRAME_TIMESTAMP_FORMAT),
+            "region": list(center) if center else None,
+        })
+    return list(jobs.values())
+
+
+class InProcessQueue:
+    """
+    In-process stand-in for the satellite queue.
+
+    Exposes the same set()/get() surface as the func.Out output binding so
+    run_city_batch can enqueue without knowing which one it got, and drain()
+    runs handle_satellite_job over the messages with a bounded thread pool.
+    """
+
+    def __init__(self):
+        self._messages = []
+
+    def set(self, messages) -> None:
+        self._messages.extend(messages if isinstance(messages, list) else [messages])
+
+    def get(self) -> list:
+        return list(self._messages)
+
+    def drain(self, handler=None, max_workers: int = 1, **handler_kwargs) -> dict:
+        """
+        Process and remove every queued message.
+
+        Returns:
+            dict: outcome -> number of jobs
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        handler = handler or handle_satellite_job
+        messages, self._messages = self._messages, []
+        outcomes = {}
+
+        def run(message):
+            try:
+                return handler(message, **handler_kwargs)
+            except Exception as e:
+                logging.error(f"Satellite job failed: {str(e)}")
+                return "failed"
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = [submit_in_context(executor, run, message) for message in messages]
+            for future in futures:
+                outcome = future.result()
+                outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        return outcomes
+
+
+def _regional_image_for_tick(tick_name: str, center: list):
+    """Fetch the regional raster once per tick and share it between jobs."""
+    with _regional_tick_lock:
+        if tick_name not in _regional_tick_image:
+            _regional_tick_image.clear()
+            _regional_tick_image[tick_name] = fetch_regional_satellite_image(center[0], center[1])
+        return _regional_tick_image[tick_name]
+
+
+def handle_satellite_job(message_body: str, blob_service_client=None, now: datetime.datetime = None) -> str:
+    """
+    Run the satellite pipeline (fetch, crop, marker, upload, animation) for one city job.
+
+    Args:
+        message_body (str): JSON job built by build_satellite_jobs
+        blob_service_client: Blob client to use (created on demand if None)
+        now (datetime): Current naive UTC time, for the age check
+
+    Returns:
+        str: "processed", "duplicate" (frame of this tick already published),
+             "expired" (superseded by a newer tick), "unchanged", "invalid" or
+             "failed" (NASA unreachable or no image; worth a retry)
+    """
+    try:
+        job = json.loads(message_body)
+        city_code = job["city_code"]
+        tick = datetime.datetime.strptime(job["tick"], FRAME_TIMESTAMP_FORMAT)
+        latitude, longitude = float(job["latitude"]), float(job["longitude"])
+    except (KeyError, TypeError, ValueError) as e:
+        logging.error(f"Invalid satellite job {message_body!r}: {e}")
+        return "invalid"
+
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    if (now - tick).total_seconds() > SATELLITE_JOB_MAX_AGE_SECONDS:
+        logging.info(f"Satellite job for {city_code} at {job['tick']} superseded, dropping")
+        return "expired"
+
+    blob_service_client = blob_service_client or create_blob_service_client()
+
+    # Redelivered jobs find their frame already in the index and stop here
+    frame_name = f"{city_code}/{job['tick']}.jpg"
+    if frame_name in (load_frame_manifest(city_code, blob_service_client, SATELLITE_CONTAINER_NAME) or []):
+        return "duplicate"
+
+    regional_image = None
+    if job.get("region"):
+        regional_image = _regional_image_for_tick(job["tick"], job["region"])
+        if regional_image is RESPONSE_UNCHANGED:
+            return "unchanged"
+
+    outcome = process_city_nasa(
+        blob_service_client, SATELLITE_CONTAINER_NAME, MARKER_ICON_URL, city_code, latitude, longitude,
+        regional_image, frame_time=tick
+    )
+    return "processed" if outcome == "published" else outcome
+
+
+@app.queue_trigger(arg_name="job", queue_name=SATELLITE_QUEUE_NAME, connection="AzureWebJobsStorage")
+def process_satellite_job(job: func.QueueMessage) -> None:
+    """
+    Queue-triggered satellite worker.
+
+    Picks up the per-city jobs enqueued by run_city_batch, so the slow NASA
+    fetch, PIL work, blob uploads and APNG build never hold the batch's SQL
+    connection. Concurrency is tuned apart from ingestion through
+    host.json (extensions.queues.batchSize / newBatchThreshold); failures,
+    including a NASA fetch that failed, raise so the queue retries the job up
+    to maxDequeueCount and then moves it to the poison queue.
+    """
+    start = time.perf_counter()
+    run_metrics = start_run("process_satellite_job")
+    try:
+        outcome = handle_satellite_job(job.get_body().decode("utf-8"))
+        count(f"satellite_jobs.{outcome}")
+    finally:
+        finish_run(run_metrics)
+    logging.info(
+        f"🛰️ Satellite job {job.id} (dequeue {job.dequeue_count}): {outcome} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    if outcome == "failed":
+        raise RuntimeError(f"Satellite job {job.id} failed, leaving it to the queue retry")
+
+
+# =============================================================================
+# DATABASE BATCH WRITER - ONE ROUND TRIP PER TABLE
+# =============================================================================
+
+WEATHER_INSERT_QUERY = '''
+        INSERT INTO weather.WeatherData (
+            Coord_Lon, Coord_Lat, Weather_Id, Weather_Main, Weather_Description, 
+            Weather_Icon, Base, Main_Temp, Main_Feels_Like, Main_Pressure, 
+            Main_Humidity, Main_Temp_Min, Main_Temp_Max, Main_Sea_Level, 
+            Main_Grnd_Level, Visibility, Wind_Speed, Wind_Deg, Wind_Gust, 
+            Clouds_All, Rain_1h, Rain_3h, Dt, Sys_Country, Sys_Sunrise, 
+            Sys_Sunset, Timezone, Id, Name, CityCode, Date_gt,date_sunrise,date_sunset
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+        DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time',
+        DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time',
+        DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time')
+'''
+
+AIR_QUALITY_INSERT_QUERY = '''
+    INSERT INTO weather.AirQuality (
+        CityCode, CityName, Latitude, Longitude, 
+        AQI, Category, 
+        CO, NO, NO2, O3, SO2, PM2_5, PM10, NH3,
+        Timestamp, Date_gt
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+        DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time')
+'''
+
+FORECAST_INSERT_QUERY = '''
+    INSERT INTO weather.WeatherForecast (
+        CityCode, ForecastDate, EffectiveDate, Quarter,
+        IconPhrase, Phrase,
+        Temperature, RealFeelTemperature,
+        DewPoint, RelativeHumidity,
+        WindDirectionDegrees, WindDirectionDescription, WindSpeed,
+        WindGustSpeed,
+        Visibility, CloudCover,
+        HasPrecipitation, PrecipitationType, PrecipitationIntensity,
+        PrecipitationProbability,
+        TotalLiquid, Rain
+    ) VALUES (
+        ?, 
+        SYSDATETIMEOFFSET() AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time',  
+        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+    )
+'''
+
+# Rebuilds one city's hourly rollup for the hours of its new observations
+# (first and last Unix seconds, converted the same way as Date_gt). The bounds
+# are floored to the hour before the SMALLDATETIME cast, which would round up.
+WEATHER_ROLLUP_REFRESH_QUERY = '''
+    DECLARE @FromTime DATETIME2(0) = CAST(
+        DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time'
+        AS DATETIME2(0));
+    DECLARE @ToTime DATETIME2(0) = CAST(
+        DATEADD(second, ?, '1970-01-01') AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time'
+        AS DATETIME2(0));
+    DECLARE @FromDate SMALLDATETIME = DATEADD(hour, DATEDIFF(hour, 0, @FromTime), 0);
+    DECLARE @ToDate SMALLDATETIME = DATEADD(hour, DATEDIFF(hour, 0, @ToTime) + 1, 0);
+    EXEC weather.RefreshWeatherHourlyRollup @FromDate = @FromDate, @ToDate = @ToDate, @CityCode = ?;
+'''
+
+# Insert statement used for every table the batch writer knows about
+TABLE_INSERT_QUERIES = {
+    "WeatherData": WEATHER_INSERT_QUERY,
+    "AirQuality": AIR_QUALITY_INSERT_QUERY,
+    "WeatherForecast": FORECAST_INSERT_QUERY,
+}
+
+
+# City -> (first, last) observation time whose rollup refresh failed; the next
+# tick on this worker refreshes those hours along with its own
+_pending_rollup_refresh = {}
+_pending_rollup_lock = threading.Lock()
+
+
+def refresh_weather_rollup(cursor, batch_rows: list) -> dict:
+    """
+    Refresh weather.WeatherHourlyRollup for the hours the committed rows touched.
+
+    Runs after the batch commit, one short transaction per city, so the
+    MERGE ... HOLDLOCK only covers that city's hours and a deadlock or aborting
+    error can never roll back the raw rows. A failed city is kept in
+    _pending_rollup_refresh and retried by the next tick.
+
+    Args:
+        cursor: pyodbc cursor of the batch connection (no open transaction)
+        batch_rows (list): Committed (table, row) pairs
+
+    Returns:
+        dict: refreshed and failed city counts
+    """
+    import pyodbc
+
+    with _pending_rollup_lock:
+        ranges = dict(_pending_rollup_refresh)
+        _pending_rollup_refresh.clear()
+    code_position, dt_position = OBSERVATION_KEY_POSITIONS["WeatherData"]
+    for table, row in batch_rows:
+        if table != "WeatherData" or row[dt_position] is None:
+            continue
+        first, last = ranges.get(row[code_position], (row[dt_position], row[dt_position]))
+        ranges[row[code_position]] = (min(first, row[dt_position]), max(last, row[dt_position]))
+
+    result = {"refreshed": 0, "failed": 0}
+    for city_code, (first, last) in ranges.items():
+        try:
+            cursor.execute(WEATHER_ROLLUP_REFRESH_QUERY, first, last, city_code)
+            cursor.connection.commit()
+            result["refreshed"] += 1
+        except pyodbc.Error as e:
+            cursor.connection.rollback()
+            with _pending_rollup_lock:
+                pending_first, pending_last = _pending_rollup_refresh.get(city_code, (first, last))
+                _pending_rollup_refresh[city_code] = (min(first, pending_first), max(last, pending_last))
+            result["failed"] += 1
+            logging.warning(f"⚠️ Hourly rollup refresh failed for {city_code}, retried next tick: {str(e)}")
+    return result
+
+
+# =============================================================================
+# FORECAST UPSERT
+# =============================================================================
+
+# "merge": upsert the hot table and move superseded forecasts to WeatherForecast,
+# "merge_only": upsert without history, "append": legacy insert of every run
+FORECAST_WRITE_MODES = ("merge", "merge_only", "append")
+FORECAST_WRITE_MODE = os.environ.get("FORECAST_WRITE_MODE", "merge").lower()
+if FORECAST_WRITE_MODE not in FORECAST_WRITE_MODES:
+    logging.warning(f"⚠️ Unknown FORECAST_WRITE_MODE={FORECAST_WRITE_MODE}, using merge")
+    FORECAST_WRITE_MODE = "merge"
+
+FORECAST_COLUMNS = (
+    "CityCode", "ForecastDate", "EffectiveDate", "Quarter",
+    "IconPhrase", "Phrase",
+    "Temperature", "RealFeelTemperature",
+    "DewPoint", "RelativeHumidity",
+    "WindDirectionDegrees", "WindDirectionDescription", "WindSpeed",
+    "WindGustSpeed",
+    "Visibility", "CloudCover",
+    "HasPrecipitation", "PrecipitationType", "PrecipitationIntensity",
+    "PrecipitationProbability",
+    "TotalLiquid", "Rain",
+)
+
+# Session-scoped staging table with the hot table's columns (no keys)
+FORECAST_STAGE_CREATE_QUERY = '''
+    IF OBJECT_ID('tempdb..#ForecastStage') IS NOT NULL DROP TABLE #ForecastStage;
+    SELECT TOP (0) * INTO #ForecastStage FROM weather.WeatherForecastCurrent;
+'''
+
+# Same parameters as FORECAST_INSERT_QUERY, loaded into the staging table
+FORECAST_STAGE_INSERT_QUERY = FORECAST_INSERT_QUERY.replace(
+    "INSERT INTO weather.WeatherForecast (", "INSERT INTO #ForecastStage ("
+)
+
+FORECAST_MERGE_QUERY = '''
+    MERGE weather.WeatherForecastCurrent WITH (HOLDLOCK) AS target
+    USING #ForecastStage AS source
+        ON target.CityCode = source.CityCode AND target.EffectiveDate = source.EffectiveDate
+    WHEN MATCHED THEN
+        UPDATE SET {updates}
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT ({columns}) VALUES ({source_columns})
+'''.format(
+    updates=", ".join(f"{c} = source.{c}" for c in FORECAST_COLUMNS[1:] if c != "EffectiveDate"),
+    columns=", ".join(FORECAST_COLUMNS),
+    source_columns=", ".join(f"source.{c}" for c in FORECAST_COLUMNS),
+)
+
+# Composable DML: the rows replaced by the MERGE are appended to the history table
+FORECAST_MERGE_WITH_HISTORY_QUERY = '''
+    INSERT INTO weather.WeatherForecast ({columns})
+    SELECT {columns}
+    FROM (
+        {merge}
+        OUTPUT $action AS MergeAction, {deleted_columns}
+    ) AS changes
+    WHERE changes.MergeAction = 'UPDATE';
+'''.format(
+    columns=", ".join(FORECAST_COLUMNS),
+    merge=FORECAST_MERGE_QUERY.strip(),
+    deleted_columns=", ".join(f"deleted.{c}" for c in FORECAST_COLUMNS),
+)
+
+
+def merge_forecast_rows(cursor, rows: list, keep_history: bool = True) -> dict:
+    """
+    Upsert forecast rows into weather.WeatherForecastCurrent on (CityCode, EffectiveDate).
+
+    Rows are bulk loaded into #ForecastStage with fast_executemany and applied
+    with a single MERGE, so the hot table only ever holds the latest forecast
+    for each city and hour.
+
+    Args:
+        cursor: pyodbc cursor owned by the calling thread
+        rows (list): Parameter tuples in FORECAST_INSERT_QUERY order
+        keep_history (bool): Append superseded forecasts to weather.WeatherForecast
+
+    Returns:
+        dict: staged rows and superseded rows moved to history
+    """
+    # MERGE may not touch a target row twice: keep the last row per key
+    latest = {}
+    for row in rows:
+        if row[1] is None:
+            continue
+        latest[(row[0], row[1])] = row
+    if not latest:
+        return {"staged": 0, "superseded": 0}
+
+    cursor.execute(FORECAST_STAGE_CREATE_QUERY)
+    cursor.fast_executemany = True
+    try:
+        cursor.executemany(FORECAST_STAGE_INSERT_QUERY, list(latest.values()))
+    finally:
+        cursor.fast_executemany = False
+
+    cursor.execute(FORECAST_MERGE_WITH_HISTORY_QUERY if keep_history else FORECAST_MERGE_QUERY + ";")
+    superseded = cursor.rowcount if keep_history else 0
+    cursor.execute("DROP TABLE #ForecastStage;")
+
+    result = {"staged": len(latest), "superseded": max(superseded, 0)}
+    count("rows_written.WeatherForecastCurrent", result["staged"])
+    logging.info(
+        f"💾 WeatherForecastCurrent: {result['staged']} rows merged, "
+        f"{result['superseded']} superseded forecasts moved to history"
+    )
+    return result
+
+
+# =============================================================================
+# OBSERVATION DEDUPLICATION
+# =============================================================================
+
+# Positions of (CityCode, observation Unix timestamp) inside each insert tuple
+OBSERVATION_KEY_POSITIONS = {
+    "WeatherData": (29, 22),
+    "AirQuality": (0, 14),
+}
+
+
+class ObservationCache:
+    """
+    Per-city last-seen observation timestamps for WeatherData and AirQuality.
+
+    OpenWeatherMap refreshes current conditions less often than the 20-minute
+    tick, so many rows would repeat the previous (CityCode, Dt). The cache lets
+    the batch drop those rows before any DB write or downstream work. It is
+    warmed from the database once per process and only advanced after a
+    successful commit; the unique (CityCode, Dt) indexes remain the final guard.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_seen = {table: {} for table in OBSERVATION_KEY_POSITIONS}
+        self.warmed = False
+        self.skipped = {table: 0 for table in OBSERVATION_KEY_POSITIONS}
+
+    def warm(self, cursor) -> None:
+        """Load the newest stored timestamp per city from both tables."""
+        queries = {
+            "WeatherData": "SELECT CityCode, MAX(Dt) FROM weather.WeatherData GROUP BY CityCode",
+            "AirQuality": "SELECT CityCode, MAX([Timestamp]) FROM weather.AirQuality GROUP BY CityCode",
+        }
+        for table, query in queries.items():
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            with self._lock:
+                for city_code, last_dt in rows:
+                    if last_dt is not None:
+                        self._last_seen[table][city_code.strip()] = int(last_dt)
+        self.warmed = True
+        logging.info(
+            f"Observation cache warmed for {len(self._last_seen['WeatherData'])} weather "
+            f"and {len(self._last_seen['AirQuality'])} air quality cities"
+        )
+
+    def is_new(self, table: str, row: tuple) -> bool:
+        """Return False (and count a skip) when the row repeats the last stored observation."""
+        city_pos, dt_pos = OBSERVATION_KEY_POSITIONS[table]
+        city_code, dt = row[city_pos], row[dt_pos]
+        with self._lock:
+            last_dt = self._last_seen[table].get(city_code)
+            if last_dt is not None and dt is not None and int(dt) <= last_dt:
+                self.skipped[table] += 1
+                return False
+        return True
+
+    def remember(self, committed_rows: list) -> None:
+        """Advance the cache with rows that are now committed."""
+        with self._lock:
+            for table, row in committed_rows:
+                city_pos, dt_pos = OBSERVATION_KEY_POSITIONS[table]
+                if row[dt_pos] is not None:
+                    last_seen = self._last_seen[table]
+                    last_seen[row[city_pos]] = max(int(row[dt_pos]), last_seen.get(row[city_pos], 0))
+
+
+# Lives for the whole worker process so warm invocations skip the warm-up query
+_observation_cache = ObservationCache()
+
+
+class BatchWriter:
+    """
+    Collects insert parameter tuples and writes each table in a single call.
+
+    Collectors (possibly running on worker threads) only call add(); the
+    pyodbc cursor is touched exclusively by flush(), which runs on the thread
+    that owns the connection. This keeps the cursor single-threaded and turns
+    one round trip per row into one fast_executemany call per table.
+
+    Error Handling:
+        - flush() must be the first write of the transaction: if any bulk call
+          fails, the uncommitted work is rolled back and every buffered row is
+          written again one by one, so one bad record only loses its own city
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = {}
+        self.failed_rows = 0
+
+    def add(self, table: str, row: tuple) -> None:
+        if table not in TABLE_INSERT_QUERIES:
+            raise ValueError(f"Unknown table for batch writer: {table}")
+        with self._lock:
+            self._rows.setdefault(table, []).append(row)
+
+    def pending(self) -> dict:
+        with self._lock:
+            return {table: len(rows) for table, rows in self._rows.items()}
+
+    def take(self, table: str) -> list:
+        """Remove and return the buffered rows of one table (for writers other than flush)."""
+        with self._lock:
+            return self._rows.pop(table, [])
+
+    def flush(self, cursor) -> dict:
+        """
+        Write every buffered row, one executemany call per table.
+
+        Args:
+            cursor: pyodbc cursor owned by the calling thread
+
+        Returns:
+            dict: Mapping of table name to number of rows written
+        """
+        with self._lock:
+            batches, self._rows = self._rows, {}
+        batches = {table: rows for table, rows in batches.items() if rows}
+
+        written = {}
+        try:
+            cursor.fast_executemany = True
+            for table, rows in batches.items():
+                cursor.executemany(TABLE_INSERT_QUERIES[table], rows)
+                written[table] = len(rows)
+        except Exception as e:
+            logging.warning(f"⚠️ Bulk insert failed ({str(e)}), retrying row by row")
+            cursor.connection.rollback()
+            written = {
+                table: self._write_rows_individually(cursor, table, rows)
+                for table, rows in batches.items()
+            }
+        finally:
+            cursor.fast_executemany = False
+
+        for table, row_count in written.items():
+            logging.info(f"💾 {table}: {row_count} rows written")
+            count(f"rows_written.{table}", row_count)
+        return written
+
+    def _write_rows_individually(self, cursor, table: str, rows: list) -> int:
+        written = 0
+        for row in rows:
+            try:
+                cursor.execute(TABLE_INSERT_QUERIES[table], row)
+                written += 1
+            except Exception as e:
+                self.failed_rows += 1
+                logging.error(f"Database write failed for {table} row: {str(e)}")
+        return written
+
+
+# =============================================================================
+# AGRICULTURE SUITABILITY SCORING - VECTORIZED CITY x CROP SCORES
+# =============================================================================
+
+# Set SUITABILITY_SCORING_ENABLED=false to stop refreshing agriculture.CityCropScore
+SUITABILITY_SCORING_ENABLED = os.environ.get("SUITABILITY_SCORING_ENABLED", "true").lower() == "true"
+
+# Crop thresholds and local adjustments change rarely; reloaded after this many seconds
+CROP_PROFILE_TTL_SECONDS = get_env_number("CROP_PROFILE_TTL_SECONDS", 3600, int, 0)
+
+# Positions of Main_Temp and Main_Humidity inside a WeatherData insert tuple
+WEATHER_TEMP_POSITION = 7
+WEATHER_HUMIDITY_POSITION = 10
+
+# Scale of the DECIMAL quotient SQL Server produces for 100.0 * INT / INT
+# (DECIMAL(26,12), truncated) before it is assigned to the FLOAT subscore
+SQL_HUMIDITY_SCORE_SCALE = 10 ** 12
+
+CROP_PROFILE_QUERY = '''
+    SELECT cc.CityCode, cc.CropID,
+           cr.OptimalTempMin, cr.OptimalTempMax, cr.OptimalHumidityMin, cr.OptimalHumidityMax,
+           cr.StressTempMin, cr.StressTempMax, cc.LocalTempAdjustment, cc.LocalHumidityAdjustment
+    FROM agriculture.CityCrops cc
+    INNER JOIN agriculture.Crops cr ON cc.CropID = cr.CropID
+    WHERE cr.IsActive = 1
+'''
+
+CITY_CROP_SCORE_STAGE_CREATE_QUERY = '''
+    IF OBJECT_ID('tempdb..#CityCropScoreStage') IS NOT NULL DROP TABLE #CityCropScoreStage;
+    CREATE TABLE #CityCropScoreStage (
+        CityCode CHAR(3) NOT NULL, CropID INT NOT NULL, ObservedDt BIGINT NULL,
+        ObservedTempC FLOAT NULL, ObservedHumidityPct INT NULL,
+        TempScore FLOAT NULL, HumidityScore FLOAT NULL, SuitabilityScore TINYINT NULL
+    );
+'''
+
+CITY_CROP_SCORE_STAGE_INSERT_QUERY = '''
+    INSERT INTO #CityCropScoreStage (
+        CityCode, CropID, ObservedDt, ObservedTempC, ObservedHumidityPct,
+        TempScore, HumidityScore, SuitabilityScore
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+CITY_CROP_SCORE_MERGE_QUERY = '''
+    MERGE agriculture.CityCropScore WITH (HOLDLOCK) AS target
+    USING #CityCropScoreStage AS source
+        ON target.CityCode = source.CityCode AND target.CropID = source.CropID
+    WHEN MATCHED THEN
+        UPDATE SET ObservedDt = source.ObservedDt, ObservedTempC = source.ObservedTempC,
+                   ObservedHumidityPct = source.ObservedHumidityPct, TempScore = source.TempScore,
+                   HumidityScore = source.HumidityScore, SuitabilityScore = source.SuitabilityScore,
+                   UpdatedAt = SYSUTCDATETIME()
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT (CityCode, CropID, ObservedDt, ObservedTempC, ObservedHumidityPct,
+                TempScore, HumidityScore, SuitabilityScore)
+        VALUES (source.CityCode, source.CropID, source.ObservedDt, source.ObservedTempC,
+                source.ObservedHumidityPct, source.TempScore, source.HumidityScore, source.SuitabilityScore);
+    DROP TABLE #CityCropScoreStage;
+'''
+
+# Process-level cache of the CROP_PROFILE_QUERY rows
+_crop_profiles = {"rows": None, "loaded_at": 0.0}
+_crop_profiles_lock = threading.Lock()
+
+
+def _sql_humidity_ratio(numerator: int, denominator: int) -> float:
+    """
+    Evaluate 100.0 * numerator / denominator the way the UDF does: an exact
+    DECIMAL(26,12) quotient truncated toward zero, then converted to FLOAT.
+
+    Returns:
+        float: The subscore, or NaN where SQL Server raises a divide-by-zero
+    """
+    from fractions import Fraction
+
+    if denominator == 0:
+        return float("nan")
+    scaled = abs(100 * numerator) * SQL_HUMIDITY_SCORE_SCALE // abs(denominator)
+    if (numerator < 0) != (denominator < 0):
+        scaled = -scaled
+    return float(Fraction(scaled, SQL_HUMIDITY_SCORE_SCALE))
+
+
+def score_suitability(
+    observed_temp, observed_humidity,
+    optimal_temp_min, optimal_temp_max, optimal_humidity_min, optimal_humidity_max,
+    stress_temp_min, stress_temp_max, local_temp_adjustment, local_humidity_adjustment,
+) -> dict:
+    """
+    Vectorized agriculture.CalculateSuitabilityScore over aligned arrays.
+
+    Every argument is a 1-D array (or list) with one element per city x crop
+    pair; NaN stands for SQL NULL. The result matches the UDF exactly:
+    temperature in float arithmetic, humidity through the truncated DECIMAL
+    quotient, ROUND half away from zero and the TINYINT conversion.
+
+    Returns:
+        dict: "temp_score", "humidity_score" (float arrays) and "score"
+        (float array of whole numbers, NaN where the UDF returns NULL or
+        would raise for these inputs)
+    """
+    import numpy as np
+
+    def column(values):
+        return np.asarray(values, dtype=np.float64)
+
+    observed_temp, observed_humidity = column(observed_temp), column(observed_humidity)
+    optimal_temp_min, optimal_temp_max = column(optimal_temp_min), column(optimal_temp_max)
+    optimal_humidity_min, optimal_humidity_max = column(optimal_humidity_min), column(optimal_humidity_max)
+    stress_temp_min, stress_temp_max = column(stress_temp_min), column(stress_temp_max)
+    local_temp_adjustment = column(local_temp_adjustment)
+    local_humidity_adjustment = column(local_humidity_adjustment)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Temperature subscore: plain FLOAT arithmetic, evaluated in the UDF's order
+        adjusted_temp = observed_temp + local_temp_adjustment
+        below_min = adjusted_temp < optimal_temp_min
+        temp_score = np.select(
+            [
+                (adjusted_temp >= optimal_temp_min) & (adjusted_temp <= optimal_temp_max),
+                below_min & (adjusted_temp <= stress_temp_min),
+                below_min,
+                adjusted_temp >= stress_temp_max,
+            ],
+            [
+                100.0,
+                0.0,
+                100.0 * (adjusted_temp - stress_temp_min) / (optimal_temp_min - stress_temp_min),
+                0.0,
+            ],
+            default=100.0 * (stress_temp_max - adjusted_temp) / (stress_temp_max - optimal_temp_max),
+        )
+
+        # Humidity subscore: the integer inputs only take a few hundred distinct
+        # values, so the exact DECIMAL quotient is computed once per combination
+        adjusted_humidity = observed_humidity + local_humidity_adjustment
+        humidity_score = np.full(adjusted_humidity.shape, np.nan)
+        known = ~np.isnan(adjusted_humidity)
+        in_range = known & (adjusted_humidity >= optimal_humidity_min) & (adjusted_humidity <= optimal_humidity_max)
+        humidity_score[in_range] = 100.0
+        below = known & (adjusted_humidity < optimal_humidity_min)
+        above = known & ~in_range & ~below
+        ratio_numerator = np.where(below, adjusted_humidity, 100 - adjusted_humidity)
+        ratio_denominator = np.where(below, optimal_humidity_min, 100 - optimal_humidity_max)
+        ratio_mask = below | above
+        if ratio_mask.any():
+            # Packed as complex numbers so a 1-D unique finds the distinct pairs
+            pairs = ratio_numerator[ratio_mask] + 1j * ratio_denominator[ratio_mask]
+            unique_pairs, inverse = np.unique(pairs, return_inverse=True)
+            ratios = np.array([_sql_humidity_ratio(int(pair.real), int(pair.imag)) for pair in unique_pairs])
+            humidity_score[ratio_mask] = ratios[inverse.ravel()]
+
+        # ROUND(float, 0) rounds half away from zero; TINYINT rejects anything below 0
+        combined = 0.6 * temp_score + 0.4 * humidity_score
+        magnitude = np.abs(combined)
+        rounded = np.floor(magnitude)
+        rounded = np.copysign(np.where(magnitude - rounded >= 0.5, rounded + 1.0, rounded), combined)
+        score = np.where(rounded >= 0, np.minimum(rounded, 100.0), np.nan)
+
+    return {"temp_score": temp_score, "humidity_score": humidity_score, "score": score}
+
+
+def get_crop_profiles(cursor) -> list:
+    """
+    Return the active city x crop profiles, reloading them from SQL once the
+    cached copy is older than CROP_PROFILE_TTL_SECONDS.
+    """
+    with _crop_profiles_lock:
+        if (
+            _crop_profiles["rows"] is not None
+            and time.monotonic() - _crop_profiles["loaded_at"] < CROP_PROFILE_TTL_SECONDS
+        ):
+            return _crop_profiles["rows"]
+        cursor.execute(CROP_PROFILE_QUERY)
+        rows = [tuple(row) for row in cursor.fetchall()]
+        _crop_profiles.update(rows=rows, loaded_at=time.monotonic())
+        return rows
+
+
+def latest_weather_by_city(rows: list) -> dict:
+    """
+    Pick the newest WeatherData observation per city from (table, row) pairs.
+
+    Returns:
+        dict: CityCode -> (Dt, Main_Temp, Main_Humidity)
+    """
+    city_position, dt_position = OBSERVATION_KEY_POSITIONS["WeatherData"]
+    latest = {}
+    for table, row in rows:
+        if table != "WeatherData" or row[dt_position] is None:
+            continue
+        current = latest.get(row[city_position])
+        if current is None or row[dt_position] > current[0]:
+            latest[row[city_position]] = (
+                row[dt_position], row[WEATHER_TEMP_POSITION], row[WEATHER_HUMIDITY_POSITION]
+            )
+    return latest
+
+
+def build_city_crop_scores(profiles: list, observations: dict) -> list:
+    """
+    Score every profile whose city has an observation in one vectorized pass.
+
+    Args:
+        profiles (list): Rows of CROP_PROFILE_QUERY
+        observations (dict): Output of latest_weather_by_city
+
+    Returns:
+        list: #CityCropScoreStage rows
+    """
+    import numpy as np
+
+    selected = [profile for profile in profiles if profile[0] in observations]
+    if not selected:
+        return []
+
+    def as_float(value):
+        return np.nan if value is None else value
+
+    temps = [as_float(observations[profile[0]][1]) for profile in selected]
+    humidities = [as_float(observations[profile[0]][2]) for profile in selected]
+    columns = list(zip(*((as_float(value) for value in profile[2:]) for profile in selected)))
+    scores = score_suitability(temps, humidities, *columns)
+
+    def as_sql(value):
+        return None if np.isnan(value) else float(value)
+
+    stage_rows = []
+    for index, profile in enumerate(selected):
+        dt, temp, humidity = observations[profile[0]]
+        score = scores["score"][index]
+        stage_rows.append((
+            profile[0], profile[1], dt, temp, humidity,
+            as_sql(scores["temp_score"][index]),
+            as_sql(scores["humidity_score"][index]),
+            None if np.isnan(score) else int(score),
+        ))
+    return stage_rows
+
+
+@instrumented()
+def refresh_city_crop_scores(cursor, rows: list) -> int:
+    """
+    Recompute agriculture.CityCropScore for the cities observed in this batch
+    and commit. Runs after the observation commit; a failure only leaves the
+    previous scores in place.
+
+    Args:
+        cursor: pyodbc cursor of the batch connection
+        rows (list): (table, row) pairs committed by this tick
+
+    Returns:
+        int: Number of city x crop scores written
+    """
+    import pyodbc
+
+    observations = latest_weather_by_city(rows)
+    if not observations:
+        return 0
+    try:
+        stage_rows = build_city_crop_scores(get_crop_profiles(cursor), observations)
+        if not stage_rows:
+            return 0
+        cursor.execute(CITY_CROP_SCORE_STAGE_CREATE_QUERY)
+        cursor.fast_executemany = True
+        try:
+            cursor.executemany(CITY_CROP_SCORE_STAGE_INSERT_QUERY, stage_rows)
+        finally:
+            cursor.fast_executemany = False
+        cursor.execute(CITY_CROP_SCORE_MERGE_QUERY)
+        cursor.connection.commit()
+    except pyodbc.Error as e:
+        cursor.connection.rollback()
+        logging.warning(f"⚠️ City crop score refresh failed, previous scores kept: {str(e)}")
+        return 0
+
+    unscored = sum(1 for row in stage_rows if row[7] is None)
+    logging.info(
+        f"🌱 CityCropScore: {len(stage_rows)} scores for {len(observations)} cities "
+        f"({unscored} without a score)"
+    )
+    count("rows_written.CityCropScore", len(stage_rows))
+    return len(stage_rows)
+
+
+# =============================================================================
+# WRITE-AHEAD SPOOL
+# =============================================================================
+
+# Collected rows are written here before the DB commit and removed once committed
+WRITE_SPOOL_DIR = os.environ.get(
+    "WRITE_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "climaguate_spool")
+)
+WRITE_SPOOL_MAX_BYTES = get_env_number("WRITE_SPOOL_MAX_BYTES", 64 * 1024 * 1024, int, 1024 * 1024)
+# A claim older than this belongs to a run that died without releasing it (above functionTimeout)
+WRITE_SPOOL_CLAIM_TIMEOUT_SECONDS = get_env_number("WRITE_SPOOL_CLAIM_TIMEOUT_SECONDS", 900, int, 60)
+
+
+class WriteSpool:
+    """
+    Append-only JSON-lines spool for rows that have not been committed yet.
+
+    Every tick writes one segment file before touching the database. A
+    segment is deleted only after the commit that contains its rows succeeds,
+    so a SQL outage leaves the data on local disk and a later tick replays
+    the backlog.
+
+    Ownership (several shard runs share the directory in one worker):
+        - {utc timestamp}-{pid}.jsonl is backlog from a failed tick, free to replay
+        - {segment}.jsonl.{owner} is claimed by the run holding that owner token,
+          either its own tick or backlog it took over with an atomic rename
+        - A failed run releases its claims back to .jsonl; claims older than
+          WRITE_SPOOL_CLAIM_TIMEOUT_SECONDS are taken over as abandoned
+
+    Replay is idempotent: rows are de-duplicated on (table, CityCode, Dt)
+    before writing and the unique IGNORE_DUP_KEY indexes drop anything that
+    was already committed.
+
+    Eviction:
+        - When the spool exceeds WRITE_SPOOL_MAX_BYTES the oldest backlog
+          segments are deleted first and counted in stats()["evicted_rows"]
+    """
+
+    def __init__(self, directory: str = WRITE_SPOOL_DIR, max_bytes: int = WRITE_SPOOL_MAX_BYTES,
+                 claim_timeout_seconds: float = WRITE_SPOOL_CLAIM_TIMEOUT_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.claim_timeout_seconds = claim_timeout_seconds
+        self.evicted_segments = 0
+        self.evicted_rows = 0
+
+    @staticmethod
+    def new_owner() -> str:
+        """Token identifying one run's claims."""
+        import uuid
+
+        return f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _list(self, claimed: bool) -> list:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        if claimed:
+            names = [name for name in names if ".jsonl." in name and not name.endswith(".tmp")]
+        else:
+            names = [name for name in names if name.endswith(".jsonl")]
+        return [os.path.join(self.directory, name) for name in sorted(names)]
+
+    def _segments(self) -> list:
+        return self._list(claimed=False)
+
+    def append(self, rows: list, owner: str):
+        """
+        Write one segment with the given (table, row) pairs, claimed by owner, and fsync it.
+
+        Returns:
+            str: Path of the new segment, or None if there was nothing to spool
+        """
+        if not rows:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%d%H%M%S%f")
+        path = os.path.join(self.directory, f"{stamp}-{os.getpid()}.jsonl.{owner}")
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as spool_file:
+            for table, row in rows:
+                spool_file.write(json.dumps({"table": table, "row": list(row)}, ensure_ascii=False))
+                spool_file.write("\n")
+            spool_file.flush()
+            os.fsync(spool_file.fileno())
+        # Rename so a crash mid-write never leaves a half segment that looks complete
+        os.replace(temp_path, path)
+        self.enforce_cap()
+        return path
+
+    def claim(self, owner: str) -> list:
+        """
+        Take over the backlog and any abandoned claims with an atomic rename.
+
+        A segment another run renamed first is skipped, so each one is
+        replayed by a single run; in-flight segments of live runs are never seen.
+
+        Returns:
+            list: Paths of the segments now claimed by owner
+        """
+        candidates = self._segments()
+        cutoff = time.time() - self.claim_timeout_seconds
+        for path in self._list(claimed=True):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    candidates.append(path)
+            except FileNotFoundError:
+                continue
+
+        claimed = []
+        for path in candidates:
+            base = path[:path.index(".jsonl") + len(".jsonl")]
+            target = f"{base}.{owner}"
+            try:
+                os.rename(path, target)
+                # Refresh the mtime so the claim is not mistaken for an abandoned one
+                os.utime(target)
+            except FileNotFoundError:
+                continue
+            if path != base:
+                logging.warning(f"⚠️ Took over abandoned spool segment {os.path.basename(base)}")
+            claimed.append(target)
+        return claimed
+
+    def load(self, segments: list) -> tuple:
+        """
+        Read claimed segments.
+
+        Args:
+            segments (list): Segment paths returned by claim()
+
+        Returns:
+            tuple: (segment paths read, list of (table, row) pairs)
+        """
+        loaded, rows = [], []
+        for path in segments:
+            try:
+                with open(path, "r", encoding="utf-8") as spool_file:
+                    for line in spool_file:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        record = json.loads(line)
+                        if record.get("table") in OBSERVATION_KEY_POSITIONS:
+                            rows.append((record["table"], tuple(record["row"])))
+            except (OSError, ValueError) as e:
+                logging.warning(f"⚠️ Skipping unreadable spool segment {path}: {str(e)}")
+                continue
+            loaded.append(path)
+        return loaded, rows
+
+    def release(self, segments: list) -> None:
+        """Hand claimed segments back to the backlog after a failed commit."""
+        for path in segments:
+            base = path[:path.index(".jsonl") + len(".jsonl")]
+            try:
+                os.rename(path, base)
+            except FileNotFoundError:
+                pass
+
+    def remove(self, segments: list) -> None:
+        """Truncate the spool after a successful commit."""
+        for path in segments:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def enforce_cap(self) -> None:
+        """Evict the oldest backlog segments until the spool fits in max_bytes."""
+        segments = self._segments()
+        sizes = {path: os.path.getsize(path) for path in segments}
+        total = sum(sizes.values())
+        for path in self._list(claimed=True):
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        for path in segments:
+            if total <= self.max_bytes:
+                break
+            try:
+                # Claim before deleting so a segment another run is replaying is left alone
+                evicting = path + ".evicting"
+                os.rename(path, evicting)
+            except FileNotFoundError:
+                continue
+            with open(evicting, "r", encoding="utf-8") as spool_file:
+                evicted = sum(1 for line in spool_file if line.strip())
+            self.remove([evicting])
+            total -= sizes[path]
+            self.evicted_segments += 1
+            self.evicted_rows += evicted
+            logging.warning(f"⚠️ Spool over {self.max_bytes} bytes, evicted {path} ({evicted} rows)")
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: backlog segments, bytes, age of the oldest segment, in-flight claims and eviction counters
+        """
+        segments = self._segments()
+        oldest_age = 0.0
+        if segments:
+            oldest_age = max(0.0, time.time() - os.path.getmtime(segments[0]))
+        return {
+            "segments": len(segments),
+            "bytes": sum(os.path.getsize(path) for path in segments),
+            "oldest_age_seconds": round(oldest_age, 1),
+            "claimed_segments": len(self._list(claimed=True)),
+            "evicted_segments": self.evicted_segments,
+            "evicted_rows": self.evicted_rows,
+        }
+
+
+def dedupe_observations(rows: list) -> list:
+    """Keep the first row per (table, CityCode, Dt), preserving order."""
+    seen = set()
+    unique = []
+    for table, row in rows:
+        city_pos, dt_pos = OBSERVATION_KEY_POSITIONS[table]
+        key = (table, row[city_pos], row[dt_pos])
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append((table, row))
+    return unique
+
+
+_write_spool = WriteSpool()
+
+
+# =============================================================================
+# BATCH DEADLINE - TIME BUDGET AND RESUMABLE CHECKPOINTS
+# =============================================================================
+
+# host.json stops every run at functionTimeout (10 minutes), before the commit
+# if it gets that far; the batch plans against a smaller budget of its own
+BATCH_TIME_BUDGET_SECONDS = get_env_number("BATCH_TIME_BUDGET_SECONDS", 480, float, 30)
+
+# Kept for the spool, DB write and commit: no provider call starts once less is left
+BATCH_WRITE_RESERVE_SECONDS = get_env_number("BATCH_WRITE_RESERVE_SECONDS", 90, float, 0)
+
+# Image and animation work (inline NASA stage, local satellite jobs) stops this
+# much earlier, so weather and air quality get the end of the budget
+BATCH_IMAGE_RESERVE_SECONDS = get_env_number("BATCH_IMAGE_RESERVE_SECONDS", 150, float, 0)
+
+# Order in which the fan-out schedules the stages; image stages go last
+BATCH_STAGE_PRIORITY = ("weather", "air_quality", "nasa", "satellite")
+BATCH_IMAGE_STAGES = {"nasa", "satellite"}
+
+# One JSON checkpoint per run (all cities, or one shard) with its deferred work
+BATCH_CHECKPOINT_DIR = os.environ.get(
+    "BATCH_CHECKPOINT_DIR", os.path.join(tempfile.gettempdir(), "climaguate_checkpoints")
+)
+
+# "unchanged": the stage ran but had nothing new to write (e.g. the same satellite image)
+BATCH_OUTCOMES = ("completed", "unchanged", "failed", "deferred")
+
+
+class BatchDeadline:
+    """
+    Time budget of one batch run, measured on the monotonic clock from its start.
+    """
+
+    def __init__(
+        self,
+        budget_seconds: float = BATCH_TIME_BUDGET_SECONDS,
+        write_reserve: float = BATCH_WRITE_RESERVE_SECONDS,
+        image_reserve: float = BATCH_IMAGE_RESERVE_SECONDS,
+    ):
+        self.started = time.monotonic()
+        self.budget_seconds = budget_seconds
+        self.write_reserve = write_reserve
+        self.image_reserve = image_reserve
+
+    def remaining(self) -> float:
+        return self.budget_seconds - (time.monotonic() - self.started)
+
+    def allows(self, stage: str) -> bool:
+        """True while there is time to start one more job of the stage."""
+        reserve = self.write_reserve + (self.image_reserve if stage in BATCH_IMAGE_STAGES else 0)
+        return self.remaining() > reserve
+
+
+class BatchProgress:
+    """
+    Thread-safe record of the cities each stage completed, left unchanged, failed or deferred.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def mark(self, stage: str, city_code: str, outcome: str) -> None:
+        with self._lock:
+            outcomes = self._stages.setdefault(stage, {name: set() for name in BATCH_OUTCOMES})
+            outcomes[outcome].add(city_code)
+
+    def cities(self, outcome: str) -> dict:
+        """Return stage -> sorted city codes with the given outcome."""
+        with self._lock:
+            return {
+                stage: sorted(outcomes[outcome])
+                for stage, outcomes in self._stages.items()
+                if outcomes[outcome]
+            }
+
+    def counts(self) -> dict:
+        """Return stage -> {outcome: number of cities}."""
+        with self._lock:
+            return {
+                stage: {outcome: len(codes) for outcome, codes in outcomes.items()}
+                for stage, outcomes in self._stages.items()
+            }
+
+    def log_summary(self, run_name: str) -> None:
+        totals = {outcome: 0 for outcome in BATCH_OUTCOMES}
+        for stage, stage_counts in self.counts().items():
+            for outcome, number in stage_counts.items():
+                totals[outcome] += number
+                if number:
+                    count(f"batch_{outcome}.{stage}", number)
+            logging.info(
+                f"📋 {run_name} stage '{stage}': {stage_counts['completed']} completed, "
+                f"{stage_counts['unchanged']} unchanged, {stage_counts['failed']} failed, "
+                f"{stage_counts['deferred']} deferred"
+            )
+        logging.info(
+            f"📋 {run_name} progress: {totals['completed']} completed, {totals['unchanged']} unchanged, "
+            f"{totals['failed']} failed, {totals['deferred']} deferred city stages"
+        )
+
+
+class BatchCheckpoint:
+    """
+    Local JSON checkpoint of the (stage, city) work a run finished or deferred.
+
+    Written after every committed run, atomically like the spool segments. The
+    next tick schedules the deferred cities of each stage ahead of the others,
+    so a run that ran out of budget is resumed instead of deferring the same
+    tail of the city list again.
+    """
+
+    def __init__(self, name: str, directory: str = BATCH_CHECKPOINT_DIR):
+        self.path = os.path.join(directory, f"{name}.json")
+
+    def load(self) -> dict:
+        """
+        Returns:
+            dict: stage -> set of deferred city codes (empty if there is no checkpoint)
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"⚠️ Ignoring unreadable batch checkpoint {self.path}: {str(e)}")
+            return {}
+        deferred = {stage: set(codes) for stage, codes in (checkpoint.get("deferred") or {}).items() if codes}
+        if deferred:
+            logging.info(
+                f"📋 Resuming {sum(len(codes) for codes in deferred.values())} deferred city stages "
+                f"from tick {checkpoint.get('tick')}"
+            )
+        return deferred
+
+    def save(self, tick: datetime.datetime, progress: BatchProgress) -> None:
+        checkpoint = {
+            "tick": tick.strftime(FRAME_TIMESTAMP_FORMAT),
+            "completed": progress.cities("completed"),
+            "deferred": progress.cities("deferred"),
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning(f"⚠️ Could not write batch checkpoint {self.path}: {str(e)}")
+
+
+def stage_priority(stage: str) -> int:
+    """Rank of a stage in BATCH_STAGE_PRIORITY; unknown stages go last."""
+    if stage in BATCH_STAGE_PRIORITY:
+        return BATCH_STAGE_PRIORITY.index(stage)
+    return len(BATCH_STAGE_PRIORITY)
+
+
+def resume_order(cities: list, first_codes) -> list:
+    """Stable reorder that puts the cities a previous run deferred first."""
+    if not first_codes:
+        return list(cities)
+    return sorted(cities, key=lambda city: city['CityCode'] not in first_codes)
+
+
+# =============================================================================
+# CONCURRENT CITY PROCESSING - BOUNDED FAN-OUT ENGINE
+# =============================================================================
+
+# Default number of cities processed in parallel for each provider pipeline.
+# NASA is kept lower because every job also downloads, crops and uploads images.
+DEFAULT_STAGE_CONCURRENCY = {
+    "weather": 8,
+    "air_quality": 8,
+    "nasa": 4,
+}
+
+# Human-readable stage names used in the per-city error messages
+STAGE_LABELS = {
+    "weather": "Weather",
+    "air_quality": "Air quality",
+    "nasa": "NASA",
+}
+
+
+def get_stage_concurrency() -> dict:
+    """
+    Resolve the per-provider concurrency limits for the city fan-out.
+
+    Each limit can be tuned without a redeploy through the WEATHER_CONCURRENCY,
+    AIR_QUALITY_CONCURRENCY and NASA_CONCURRENCY app settings. Invalid or
+    missing values fall back to DEFAULT_STAGE_CONCURRENCY.
+
+    Returns:
+        dict: Mapping of stage name to maximum number of concurrent cities
+    """
+    return {
+        stage: get_env_number(f"{stage.upper()}_CONCURRENCY", default, int, 1)
+        for stage, default in DEFAULT_STAGE_CONCURRENCY.items()
+    }
+
+
+class StageTimings:
+    """
+    Thread-safe wall-clock timing collector for the per-city pipelines.
+
+    For every stage it records how many cities ran, the summed busy time,
+    the slowest single city and the wall-clock span from the first start to
+    the last finish, which is what actually counts against the function timeout.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                stats = self._stages.setdefault(
+                    stage, {"count": 0, "busy": 0.0, "max": 0.0, "first_start": start, "last_end": end}
+                )
+                stats["count"] += 1
+                stats["busy"] += end - start
+                stats["max"] = max(stats["max"], end - start)
+                stats["first_start"] = min(stats["first_start"], start)
+                stats["last_end"] = max(stats["last_end"], end)
+
+    def summary(self) -> dict:
+        """Return a snapshot of the collected timings in seconds per stage."""
+        with self._lock:
+            return {
+                stage: {
+                    "count": stats["count"],
+                    "wall_seconds": round(stats["last_end"] - stats["first_start"], 3),
+                    "busy_seconds": round(stats["busy"], 3),
+                    "max_seconds": round(stats["max"], 3),
+                }
+                for stage, stats in self._stages.items()
+            }
+
+    def log_summary(self, run_name: str) -> None:
+        for stage, stats in self.summary().items():
+            logging.info(
+                f"⏱️ {run_name} stage '{stage}': {stats['count']} cities, "
+                f"wall {stats['wall_seconds']}s, busy {stats['busy_seconds']}s, "
+                f"slowest {stats['max_seconds']}s"
+            )
+
+
+def _run_city_stage(
+    stage: str, handler, city: dict, timings: StageTimings,
+    deadline: BatchDeadline = None, progress: BatchProgress = None
+) -> None:
+    """
+    Execute one stage for one city with the same error isolation as the
+    original sequential loop: failures are logged and never propagate.
+    Jobs that start after the stage's share of the deadline are deferred.
+    A handler may return one of BATCH_OUTCOMES (e.g. "unchanged"), otherwise
+    the city counts as completed.
+    """
+    if deadline is not None and not deadline.allows(stage):
+        outcome = "deferred"
+    else:
+        outcome = "completed"
+        try:
+            with timings.measure(stage):
+                result = handler(city)
+            if result in BATCH_OUTCOMES:
+                outcome = result
+        except Exception as e:
+            outcome = "failed"
+            logging.error(f"{STAGE_LABELS.get(stage, stage)} processing failed for {city.get('CityCode')}: {str(e)}")
+    if progress is not None:
+        progress.mark(stage, city.get('CityCode'), outcome)
+
+
+def run_city_fanout(
+    cities: list, stage_handlers: dict, limits: dict, timings: StageTimings,
+    deadline: BatchDeadline = None, progress: BatchProgress = None, resume: dict = None
+) -> None:
+    """
+    Run every stage handler for every city with bounded concurrency per stage.
+
+    Each stage gets its own thread pool sized from its provider limit, so a slow
+    provider (typically NASA) only queues its own work and never starves the
+    weather or air quality calls. Stages are queued in BATCH_STAGE_PRIORITY
+    order and, within a stage, the cities a previous run deferred go first.
+    The call returns once every job has finished or been deferred.
+
+    Args:
+        cities (list): Validated city dictionaries
+        stage_handlers (dict): Mapping of stage name to callable(city)
+        limits (dict): Mapping of stage name to maximum concurrent cities
+        timings (StageTimings): Collector for per-stage wall-clock timings
+        deadline (BatchDeadline): Time budget; None runs every job
+        progress (BatchProgress): Collector for per-city stage outcomes
+        resume (dict): Stage -> city codes deferred by the previous run
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait
+
+    executors = {
+        stage: ThreadPoolExecutor(max_workers=limits.get(stage, 1), thread_name_prefix=f"{stage}-worker")
+        for stage in stage_handlers
+    }
+    try:
+        stage_order = sorted(stage_handlers, key=stage_priority)
+        futures = [
+            submit_in_context(
+                executors[stage], _run_city_stage, stage, stage_handlers[stage], city, timings, deadline, progress
+            )
+            for stage in stage_order
+            for city in resume_order(cities, (resume or {}).get(stage))
+        ]
+        wait(futures)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+
+
+# =============================================================================
+# CITY SHARDING - JOBRUNLOCK LEASES ACROSS INSTANCES
+# =============================================================================
+
+# Timer triggers fire on a single instance, so a scale-out does not parallelize
+# run_city_batch by itself. With CITY_SHARD_COUNT > 1 the timer only enqueues
+# one message per shard and the process_city_shard queue workers, spread over
+# every instance, claim a JobRunLock lease for (tick, shard) and run the batch
+# for that shard's cities. 1 (default) keeps the single-instance batch.
+CITY_SHARD_COUNT = get_env_number("CITY_SHARD_COUNT", 1, int, 1)
+CITY_SHARD_QUEUE_NAME = "city-shards"
+
+# A lease covers a whole shard run, so by default it matches functionTimeout in
+# host.json: a live owner never loses its shard, a crashed one frees it after that
+CITY_SHARD_LEASE_SECONDS = get_env_number("CITY_SHARD_LEASE_SECONDS", 600, int, 30)
+
+# Shard messages of older ticks are superseded by the next timer run
+CITY_SHARD_MAX_AGE_SECONDS = get_env_number(
+    "CITY_SHARD_MAX_AGE_SECONDS", 2 * SATELLITE_TICK_MINUTES * 60, int, 60
+)
+
+# Insert the lease row, or take over a Failed/expired one; OUTPUT returns a row
+# only when this owner got the shard. HOLDLOCK keeps two claims from both
+# inserting or both updating.
+CITY_SHARD_CLAIM_QUERY = '''
+    MERGE dbo.JobRunLock WITH (HOLDLOCK) AS target
+    USING (SELECT CAST(? AS DATETIME2) AS RunTimeUtc, CAST(? AS INT) AS ShardIndex) AS source
+        ON target.RunTimeUtc = source.RunTimeUtc AND target.ShardIndex = source.ShardIndex
+    WHEN MATCHED AND target.Status <> 'Completed'
+                 AND (target.Status = 'Failed' OR target.LeaseExpiresAt < SYSUTCDATETIME()) THEN
+        UPDATE SET Owner = ?, Status = 'Running', StartedAt = SYSUTCDATETIME(),
+                   LeaseExpiresAt = DATEADD(SECOND, ?, SYSUTCDATETIME()),
+                   Attempts = target.Attempts + 1
+    WHEN NOT MATCHED THEN
+        INSERT (RunTimeUtc, ShardIndex, ShardCount, Owner, StartedAt, LeaseExpiresAt, Status, Attempts)
+        VALUES (source.RunTimeUtc, source.ShardIndex, ?, ?, SYSUTCDATETIME(),
+                DATEADD(SECOND, ?, SYSUTCDATETIME()), 'Running', 1)
+    OUTPUT $action;
+'''
+
+# Runs in the batch transaction, so the shard is Completed exactly when its rows commit
+CITY_SHARD_COMPLETE_QUERY = '''
+    UPDATE dbo.JobRunLock
+    SET Status = 'Completed', CompletedAt = SYSUTCDATETIME(), CityCount = ?
+    WHERE RunTimeUtc = ? AND ShardIndex = ? AND Owner = ?
+'''
+
+# Failed runs hand the shard back at once instead of waiting for the lease to expire
+CITY_SHARD_RELEASE_QUERY = '''
+    UPDATE dbo.JobRunLock
+    SET Status = 'Failed', LeaseExpiresAt = SYSUTCDATETIME()
+    WHERE RunTimeUtc = ? AND ShardIndex = ? AND Owner = ? AND Status = 'Running'
+'''
+
+
+def city_shard_index(city_code: str, shard_count: int) -> int:
+    """
+    Stable shard of a city: the same on every instance and across restarts
+    (unlike hash(), which is salted per process).
+    """
+    import zlib
+
+    return zlib.crc32(str(city_code).encode("utf-8")) % shard_count
+
+
+def build_city_shard_jobs(tick: datetime.datetime, shard_count: int = CITY_SHARD_COUNT) -> list:
+    """
+    Build one JSON message per shard of the tick.
+
+    Returns:
+        list: Message bodies for the city shard queue
+    """
+    return [
+        json.dumps({"tick": tick.strftime(FRAME_TIMESTAMP_FORMAT), "index": index, "count": shard_count})
+        for index in range(shard_count)
+    ]
+
+
+def parse_city_shard_job(message_body: str, now: datetime.datetime = None):
+    """
+    Decode a shard message and drop it when it is malformed or superseded.
+
+    Returns:
+        dict: {"tick": datetime, "index": int, "count": int}, or None to drop it
+    """
+    try:
+        job = json.loads(message_body)
+        shard = {
+            "tick": datetime.datetime.strptime(job["tick"], FRAME_TIMESTAMP_FORMAT),
+            "index": int(job["index"]),
+            "count": int(job["count"]),
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        logging.error(f"Invalid city shard job {message_body!r}: {e}")
+        return None
+    if not 0 <= shard["index"] < shard["count"]:
+        logging.error(f"Invalid city shard job {message_body!r}: index out of range")
+        return None
+
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    if (now - shard["tick"]).total_seconds() > CITY_SHARD_MAX_AGE_SECONDS:
+        logging.info(f"City shard {shard['index']} of {job['tick']} superseded, dropping")
+        return None
+    return shard
+
+
+def _city_shard_owner() -> str:
+    """Owner tag for one claim: instance, process and a per-claim suffix."""
+    import uuid
+
+    instance = os.environ.get("WEBSITE_INSTANCE_ID") or os.environ.get("COMPUTERNAME") or "local"
+    return f"{instance[:32]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claim_city_shard(connection_string: str, shard: dict):
+    """
+    Try to take the JobRunLock lease for one shard of a tick.
+
+    Args:
+        connection_string (str): SQL connection string
+        shard (dict): Parsed shard job (tick, index, count)
+
+    Returns:
+        dict: The lease (shard plus owner), or None if the shard is completed
+              or still leased by another worker
+    """
+    owner = _city_shard_owner()
+    conn = resources.acquire_sql_connection(connection_string)
+    broken = True
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            CITY_SHARD_CLAIM_QUERY,
+            shard["tick"], shard["index"],
+            owner, CITY_SHARD_LEASE_SECONDS,
+            shard["count"], owner, CITY_SHARD_LEASE_SECONDS,
+        )
+        claimed = cursor.fetchone()
+        conn.commit()
+        cursor.close()
+        broken = False
+    finally:
+        resources.release_sql_connection(connection_string, conn, broken=broken)
+
+    tick_name = shard["tick"].strftime(FRAME_TIMESTAMP_FORMAT)
+    if claimed is None:
+        count("city_shards.skipped")
+        logging.info(f"🧩 Shard {shard['index']}/{shard['count']} of {tick_name} completed or leased elsewhere")
+        return None
+
+    count("city_shards.claimed")
+    if claimed[0] == "UPDATE":
+        count("city_shards.reclaimed")
+    logging.info(f"🧩 Claimed shard {shard['index']}/{shard['count']} of {tick_name} as {owner} ({claimed[0]})")
+    return dict(shard, owner=owner, completed=False)
+
+
+def complete_city_shard(cursor, lease: dict, city_count: int) -> bool:
+    """
+    Mark the shard Completed inside the caller's transaction.
+
+    Returns:
+        bool: False when the lease had been taken over by another worker
+    """
+    cursor.execute(CITY_SHARD_COMPLETE_QUERY, city_count, lease["tick"], lease["index"], lease["owner"])
+    if cursor.rowcount == 0:
+        # Unique (CityCode, Dt) indexes still keep the rows of both runs from duplicating
+        logging.warning(f"⚠️ Lease on shard {lease['index']} was taken over before completion")
+        return False
+    return True
+
+
+def release_city_shard(connection_string: str, lease: dict) -> None:
+    """Hand a failed shard back for the next worker; an expired lease does the same."""
+    conn = None
+    broken = False
+    try:
+        conn = resources.acquire_sql_connection(connection_string)
+        cursor = conn.cursor()
+        cursor.execute(CITY_SHARD_RELEASE_QUERY, lease["tick"], lease["index"], lease["owner"])
+        conn.commit()
+        cursor.close()
+        count("city_shards.released")
+    except Exception as e:
+        broken = True
+        logging.warning(f"⚠️ Could not release shard {lease['index']}, it frees on lease expiry: {str(e)}")
+    finally:
+        if conn is not None:
+            resources.release_sql_connection(connection_string, conn, broken=broken)
+
+
+# =============================================================================
+# MAIN AZURE FUNCTIONS - TIMER TRIGGERED SERVICES
+# =============================================================================
+
+@app.schedule(schedule="0 */20 * * * *", arg_name="timer", run_on_startup=False, use_monitor=False)
+@app.queue_output(arg_name="satellitejobs", queue_name=SATELLITE_QUEUE_NAME, connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="cityshards", queue_name=CITY_SHARD_QUEUE_NAME, connection="AzureWebJobsStorage")
+def run_city_batch(
+    timer: func.TimerRequest, satellitejobs: func.Out[typing.List[str]], cityshards: func.Out[typing.List[str]]
+) -> None:
+    """
+    Main weather data collection function - Executes every 20 minutes.
+
+    This timer-triggered function orchestrates the complete weather data collection
+    process for all configured cities in the Climaguate system.
+
+    Schedule: Every 20 minutes (CRON: "0 */20 * * * *")
+
+    Process Flow:
+    1. Retrieves list of cities from Data API
+    2. Enqueues one satellite job per city for process_satellite_job
+       (SATELLITE_PROCESSING_MODE=queue; "local" drains an in-process queue after
+       the commit, "inline" runs the NASA stage in the fan-out as before)
+    3. Collects current weather with one OpenWeatherMap /group call per 20
+       cities whose OWM id is known (OWM_GROUP_REQUESTS_ENABLED)
+    4. For each city, in parallel across cities (bounded per provider):
+       - Collects current weather by coordinates for cities without an OWM id
+         (the returned id is stored on weather.cities after the commit)
+       - Retrieves air quality information and AQI levels
+    5. Spools the collected rows to local disk (WRITE_SPOOL_DIR)
+    6. Connects to SQL, writes the rows plus any spooled backlog and commits
+       atomically, then truncates the spool
+    7. Recomputes agriculture.CityCropScore for the observed cities
+       (vectorized suitability scoring, SUITABILITY_SCORING_ENABLED)
+    8. Logs wall-clock timings for every stage and one structured metrics
+       record (span histograms, counters, bytes in/out; see INSTRUMENTATION)
+
+    The run works against BATCH_TIME_BUDGET_SECONDS (below functionTimeout):
+    weather and air quality are scheduled before image work, jobs that would
+    start too close to the deadline are deferred, and completed/deferred
+    counts are logged and checkpointed so the next tick runs the deferred
+    cities first (see BATCH DEADLINE).
+
+    With CITY_SHARD_COUNT > 1 the timer only enqueues one message per shard;
+    process_city_shard workers on any instance lease a shard in dbo.JobRunLock
+    and run steps 1-8 for that shard's cities (see CITY SHARDING).
+    
+    Error Handling:
+    - Individual city failures don't stop processing of other cities
+    - Database connection errors are logged and handled gracefully
+    - Rows of a failed commit stay in the write-ahead spool and are replayed
+      idempotently on (CityCode, Dt) by the next tick
+    - API failures are retried automatically by the timer schedule
+    - Blob storage operations have built-in retry mechanisms
+    
+    Authentication:
+    - Uses environment variables for API keys and connection strings
+    - Managed identity for Azure Blob Storage access
+    - No hardcoded secrets or credentials
+    
+    Performance Optimization:
+    - Single database connection, taken from the process-wide registry only
+      after the API calls so the transaction lasts as long as the writes
+    - Credential, blob client and SQL connection reused across warm invocations
+    - Concurrent per-city pipelines with per-provider limits
+      (WEATHER_CONCURRENCY, AIR_QUALITY_CONCURRENCY, NASA_CONCURRENCY)
+    - Rows buffered in memory and written with one fast_executemany per table
+    - Unchanged (CityCode, Dt) observations are skipped before any write
+    - The hourly rollup read by GetWeatherHistory is refreshed for the touched hours
+    - Batch commits for improved throughput
+    - Memory-efficient image processing
+    - Parallel-safe error isolation per city
+    """
+    if timer.past_due:
+        logging.info('The timer is past due!')
+
+    if CITY_SHARD_COUNT > 1:
+        shard_jobs = build_city_shard_jobs(satellite_tick())
+        cityshards.set(shard_jobs)
+        logging.info(f"🧩 Enqueued {len(shard_jobs)} city shards for process_city_shard")
+        return
+
+    collect_city_batch(satellitejobs)
+
+
+@app.queue_trigger(arg_name="shard", queue_name=CITY_SHARD_QUEUE_NAME, connection="AzureWebJobsStorage")
+@app.queue_output(arg_name="satellitejobs", queue_name=SATELLITE_QUEUE_NAME, connection="AzureWebJobsStorage")
+def process_city_shard(shard: func.QueueMessage, satellitejobs: func.Out[typing.List[str]]) -> None:
+    """
+    Queue-triggered shard worker for the sharded city batch.
+
+    Each message names one shard of one tick. The worker that claims the
+    shard's JobRunLock lease collects and writes only that shard's cities;
+    a message for a completed or live-leased shard is dropped, and a
+    redelivered message takes over a Failed or expired lease.
+    """
+    job = parse_city_shard_job(shard.get_body().decode("utf-8"))
+    if job is None:
+        return
+    collect_city_batch(satellitejobs, run_name="process_city_shard", shard=job)
+
+
+def collect_city_batch(satellitejobs, run_name: str = "run_city_batch", shard: dict = None) -> None:
+    """
+    Collect and store one tick for every city, or for one leased shard.
+
+    Args:
+        satellitejobs: Output binding (or InProcessQueue) for the satellite jobs
+        run_name (str): Name used for logs and the metrics record
+        shard (dict): Parsed shard job (tick, index, count), None for all cities
+    """
+    # Import problematic modules inside the function to avoid registration issues
+    import pyodbc
+
+    conn = None
+    cursor = None
+    spooled = False
+    spool_segments = []
+    connection_broken = False
+    connection_string = None
+    lease = None
+    run_metrics = start_run(run_name)
+    deadline = BatchDeadline()
+    try:
+        logging.info('Starting the process to retrieve configuration from environment variables.')
+
+        # Retrieve configuration from environment variables (Azure Functions auto-maps Key Vault to env vars)
+        connection_string = os.environ.get("connstr")
+        apikey = os.environ.get("apikey")
+        
+        if not connection_string or not apikey:
+            raise ValueError("Missing required environment variables: connstr and/or apikey")
+
+        # Sharded tick: stop here unless this worker holds the shard's lease
+        if shard is not None:
+            lease = claim_city_shard(connection_string, shard)
+            if lease is None:
+                return
+
+        # Fetch cities from Data API instead of direct database query for flexibility
+        logging.info('Fetching city details from Data API.')
+        cities_data = get_cities_from_api()
+        
+        if not cities_data:
+            logging.error('❌ Failed to fetch cities from API - aborting batch processing')
+            return
+            
+        logging.info(f'Successfully fetched {len(cities_data)} cities from API.')
+
+        # Validate cities up front so the workers only receive complete records
+        cities_to_process = []
+        for city in cities_data:
+            city_code = city.get('CityCode')
+            city_name = city.get('CityName')
+            latitude = city.get('Latitude')
+            longitude = city.get('Longitude')
+
+            # Skip cities with missing required data to prevent processing errors
+            if not city_code or not city_name or latitude is None or longitude is None:
+                logging.warning(f"⚠️ Skipping city with missing data: {city}")
+                continue
+
+            logging.info(f"Processing {city_code} - {city_name} ({latitude}, {longitude})")
+            cities_to_process.append(city)
+
+        # The regional raster and satellite tick stay shared by every shard
+        all_cities = cities_to_process
+        tick = shard["tick"] if shard is not None else satellite_tick()
+        if shard is not None:
+            cities_to_process = [
+                c for c in all_cities if city_shard_index(c['CityCode'], shard["count"]) == shard["index"]
+            ]
+            logging.info(
+                f"🧩 Shard {shard['index']}/{shard['count']}: {len(cities_to_process)} of {len(all_cities)} cities"
+            )
+
+        # Work deferred by the previous run of this batch (or shard) is scheduled first
+        checkpoint = BatchCheckpoint(
+            f"shard-{shard['index']}-of-{shard['count']}" if shard is not None else "city-batch"
+        )
+        resume = checkpoint.load()
+        progress = BatchProgress()
+
+        timings = StageTimings()
+        batch_start = time.perf_counter()
+
+        # Satellite work leaves the batch: one job per city for this tick
+        stage_handlers = {}
+        local_queue = None
+        if SATELLITE_PROCESSING_MODE == "inline":
+            container_name = SATELLITE_CONTAINER_NAME
+            icon_url = MARKER_ICON_URL
+            blob_service_client = create_blob_service_client()
+
+            # Optionally fetch one regional satellite image and crop every city from it
+            regional_image = None
+            if NASA_SHARED_FETCH:
+                with timings.measure("nasa_regional"):
+                    regional_image = fetch_regional_satellite_image(*regional_center(all_cities))
+
+            if regional_image is RESPONSE_UNCHANGED:
+                # Every city is cropped from the same raster, so no frame would change
+                logging.info("Regional NASA image unchanged since last run, skipping satellite frames")
+            else:
+                def collect_nasa(c):
+                    outcome = process_city_nasa(
+                        blob_service_client, container_name, icon_url, c['CityCode'], c['Latitude'], c['Longitude'],
+                        regional_image
+                    )
+                    return "completed" if outcome == "published" else outcome
+
+                stage_handlers["nasa"] = collect_nasa
+        else:
+            satellite_jobs = build_satellite_jobs(
+                resume_order(cities_to_process, resume.get("satellite")), tick, center=regional_center(all_cities) if NASA_SHARED_FETCH else None
+            )
+            if SATELLITE_PROCESSING_MODE == "local":
+                local_queue = InProcessQueue()
+                local_queue.set(satellite_jobs)
+            else:
+                satellitejobs.set(satellite_jobs)
+            logging.info(f"🛰️ Enqueued {len(satellite_jobs)} satellite jobs ({SATELLITE_PROCESSING_MODE})")
+
+        # Workers only return parameter tuples; the cursor stays on this thread
+        new_observations = []
+
+        def collect_observation(table, row):
+            # Unchanged observations skip the DB write and any downstream work
+            if row is not None and _observation_cache.is_new(table, row):
+                new_observations.append((table, row))
+
+        # OpenWeatherMap: one /group call per OWM_GROUP_SIZE mapped cities; only the
+        # remaining cities go through the per-coordinate request in the fan-out
+        weather_by_coordinates = None
+        if OWM_GROUP_REQUESTS_ENABLED:
+            with timings.measure("weather_groups"):
+                group_rows, fallback_cities = fetch_weather_groups(
+                    apikey, cities_to_process, get_stage_concurrency()["weather"]
+                )
+            for row in group_rows:
+                collect_observation("WeatherData", row)
+            weather_by_coordinates = {c['CityCode'] for c in fallback_cities}
+
+        # City ids returned by coordinate requests, persisted after the commit
+        resolved_owm_ids = {}
+
+        def collect_weather(c):
+            if weather_by_coordinates is not None and c['CityCode'] not in weather_by_coordinates:
+                return
+            row = process_city_weather(apikey, c['CityCode'], c['CityName'], c['Latitude'], c['Longitude'])
+            if row is not None and remember_owm_city_id(c, row[WEATHER_OWM_ID_POSITION]):
+                resolved_owm_ids[c['CityCode']] = row[WEATHER_OWM_ID_POSITION]
+            collect_observation("WeatherData", row)
+
+        def collect_air_quality(c):
+            collect_observation(
+                "AirQuality",
+                process_city_air_quality(apikey, c['CityCode'], c['CityName'], c['Latitude'], c['Longitude'])
+            )
 
-        # Retrieve configuration from environment variables (Azure Functions auto-maps Key Vault to env vars)
-        connection_string = os.environ.get("connstr")
-        apikey = os.environ.get("apikey")
-        
-        if not connection_string or not apikey:
-            raise ValueError("Missing required environment variables: connstr and/or apikey")
+        stage_handlers["weather"] = collect_weather
+        stage_handlers["air_quality"] = collect_air_quality
+
+        # Fan out the pipelines across cities with per-provider limits
+        run_city_fanout(
+            cities_to_process, stage_handlers, get_stage_concurrency(), timings,
+            deadline=deadline, progress=progress, resume=resume
+        )
 
-        # Establish SQL database connection
+        # Spool the tick to local disk before any DB write, then add the backlog
+        # left by earlier ticks whose commit failed
+        spool_owner = _write_spool.new_owner()
+        current_segment = _write_spool.append(new_observations, spool_owner)
+        if current_segment:
+            spool_segments.append(current_segment)
+        spooled = True
+        claimed_segments = _write_spool.claim(spool_owner)
+        spool_segments.extend(claimed_segments)
+        backlog_segments, backlog_rows = _write_spool.load(claimed_segments)
+
+        # Connect only now, so the connection and transaction cover just the writes.
+        # An outage raises here and leaves the rows in the spool for the next tick.
         logging.info('Connecting to the SQL database.')
-        conn = pyodbc.connect(connection_string)
+        conn = resources.acquire_sql_connection(connection_string)
         cursor = conn.cursor()
         logging.info('Successfully connected to the SQL database.')
 
-        # Initialize Azure Blob Storage client with managed identity
-        storage_account_name = "imagefilesclimaguate"
-        container_name = "mapimages"
-        icon_url = "https://climaguate.com/images/icons/marker.png"
-        
-        # Use managed identity for secure authentication to blob storage
-        from azure.identity import DefaultAzureCredential
-        credential = DefaultAzureCredential()
-        blob_service_client = BlobServiceClient(
-            account_url=f"https://{storage_account_name}.blob.core.windows.net",
-            credential=credential
-        )
+        # Warm the per-city last-seen observation cache once per worker process;
+        # the cold tick's rows are filtered here instead of during collection
+        if not _observation_cache.warmed:
+            try:
+                _observation_cache.warm(cursor)
+                conn.commit()
+                new_observations = [
+                    (table, row) for table, row in new_observations if _observation_cache.is_new(table, row)
+                ]
+            except pyodbc.Error as e:
+                conn.rollback()
+                logging.warning(f"⚠️ Could not warm observation cache, relying on unique indexes: {str(e)}")
 
-        # Fetch cities from Data API instead of direct database query for flexibility
-        logging.info('Fetching city details from Data API.')
-        cities_data = get_cities_from_api()
-        
-        if not cities_data:
-            logging.error('❌ Failed to fetch cities from API - aborting batch processing')
-            return
-            
-        logging.info(f'Successfully fetched {len(cities_data)} cities from API.')
+        batch_rows = dedupe_observations(new_observations + backlog_rows)
+        if backlog_rows:
+            logging.info(
+                f"📼 Replaying {len(batch_rows) - len(dedupe_observations(new_observations))} spooled rows "
+                f"from {len(backlog_segments)} earlier ticks"
+            )
 
-        # Process each city individually with error isolation
-        for city in cities_data:
-            city_code = city.get('CityCode')
-            city_name = city.get('CityName')
-            latitude = city.get('Latitude')
-            longitude = city.get('Longitude')
-            
-            # Skip cities with missing required data to prevent processing errors
-            if not city_code or not city_name or latitude is None or longitude is None:
-                logging.warning(f"⚠️ Skipping city with missing data: {city}")
-                continue
+        writer = BatchWriter()
+        for table, row in batch_rows:
+            writer.add(table, row)
 
-            logging.info(f"Processing {city_code} - {city_name} ({latitude}, {longitude})")
+        # Write each table in one round trip, then commit atomically
+        with timings.measure("db_write"):
+            writer.flush(cursor)
+            if lease is not None:
+                complete_city_shard(cursor, lease, len(cities_to_process))
+            conn.commit()
+            if lease is not None:
+                lease["completed"] = True
 
-            # Process weather data collection with individual error handling
-            try:
-                process_city_weather(cursor, apikey, city_code, city_name, latitude, longitude)
-            except Exception as e:
-                logging.error(f"Weather processing failed for {city_code}: {str(e)}")
+        # Committed: truncate the spool and advance the dedup cache
+        _write_spool.remove(spool_segments)
+        spool_segments = []
+        _observation_cache.remember(batch_rows)
+        logging.info(f"Skipped unchanged observations: {_observation_cache.skipped}")
+        logging.info(f"📼 {run_name} spool backlog: {_write_spool.stats()}")
+        log_response_cache_stats(run_name)
 
-            # Process air quality data collection with individual error handling
-            try:
-                process_city_air_quality(cursor, apikey, city_code, city_name, latitude, longitude)
-            except Exception as e:
-                logging.error(f"Air quality processing failed for {city_code}: {str(e)}")
+        # Keep the hourly history rollup in step with the committed raw rows
+        with timings.measure("rollup_refresh"):
+            rollup = refresh_weather_rollup(cursor, batch_rows)
+        if rollup["failed"]:
+            logging.warning(f"⚠️ {run_name} rollup: {rollup}")
 
-            # Process NASA satellite imagery with individual error handling
-            try:
-                process_city_nasa(blob_service_client, container_name, icon_url, city_code, latitude, longitude)
-            except Exception as e:
-                logging.error(f"NASA processing failed for {city_code}: {str(e)}")
+        if resolved_owm_ids:
+            persist_owm_city_ids(cursor, resolved_owm_ids)
 
-        # Commit all database writes atomically after successful processing
-        conn.commit()
+        # Materialize the city x crop suitability scores from this tick's observations
+        if SUITABILITY_SCORING_ENABLED:
+            with timings.measure("crop_scores"):
+                refresh_city_crop_scores(cursor, batch_rows)
+
+        # Local mode: run the satellite jobs now that the transaction is closed,
+        # deferring the ones that would start past the image budget
+        if local_queue is not None:
+            def run_satellite_job(message):
+                city_code = json.loads(message).get("city_code")
+                if not deadline.allows("satellite"):
+                    progress.mark("satellite", city_code, "deferred")
+                    return "deferred"
+                try:
+                    outcome = handle_satellite_job(message)
+                except Exception:
+                    progress.mark("satellite", city_code, "failed")
+                    raise
+                if outcome in ("invalid", "failed"):
+                    progress.mark("satellite", city_code, "failed")
+                else:
+                    progress.mark("satellite", city_code, "unchanged" if outcome == "unchanged" else "completed")
+                return outcome
+
+            with timings.measure("satellite_jobs"):
+                outcomes = local_queue.drain(handler=run_satellite_job, max_workers=get_stage_concurrency()["nasa"])
+            logging.info(f"🛰️ Local satellite jobs: {outcomes}")
+
+        progress.log_summary(run_name)
+        checkpoint.save(tick, progress)
+        timings.log_summary(run_name)
+        logging.info(
+            f"⏱️ {run_name} processed {len(cities_to_process)} cities in "
+            f"{time.perf_counter() - batch_start:.2f}s ({writer.failed_rows} failed writes, "
+            f"{deadline.remaining():.0f}s of {deadline.budget_seconds:.0f}s budget left)"
+        )
+        log_http_stats(run_name)
+        log_scheduler_stats(run_name)
+        log_circuit_stats(run_name)
+        logging.info(f"🗂️ {run_name} city cache: {get_city_cache_stats()}")
+        log_resource_report(run_name)
 
     except pyodbc.Error as e:
+        connection_broken = True
+        # Spooled rows are replayed next tick; otherwise the payloads must not count as seen
+        if not spooled:
+            _response_cache.clear()
         logging.error(f"Database connection or query error: {str(e)}")
+        logging.error(f"📼 {run_name} spool backlog: {_write_spool.stats()}")
+        if shard is not None:
+            # Let the queue redeliver the shard; the released lease is reclaimed
+            raise
     except Exception as e:
-        logging.error(f"An error occurred in run_city_batch: {str(e)}")
+        if not spooled:
+            _response_cache.clear()
+        logging.error(f"An error occurred in {run_name}: {str(e)}")
+        if shard is not None:
+            raise
     finally:
         if conn is not None:
             try:
                 if cursor is not None:
                     cursor.close()
+            except pyodbc.Error:
+                connection_broken = True
             finally:
-                conn.close()
+                # Keep the connection for the next tick unless it failed
+                resources.release_sql_connection(connection_string, conn, broken=connection_broken)
+        if lease is not None and not lease["completed"]:
+            release_city_shard(connection_string, lease)
+        # Not committed: hand this run's segments back for a later tick to replay
+        _write_spool.release(spool_segments)
+        finish_run(run_metrics)
 
 
 # =============================================================================
 # IMAGE PROCESSING HELPER FUNCTIONS
 # =============================================================================
 
+# How long a cached marker icon is trusted before it is revalidated (ETag / Last-Modified)
+MARKER_ICON_TTL_SECONDS = get_env_number("MARKER_ICON_TTL_SECONDS", 6 * 3600, int, 0)
+
+# Copy of the marker shipped with the app, used when the website is unreachable
+MARKER_ICON_FALLBACK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "marker.png")
+
+# Process-level cache: icon URL -> decoded RGBA icon, alpha mask and validators
+_marker_icon_cache = {}
+_marker_icon_lock = threading.Lock()
+
+
+def _decode_marker_icon(icon_bytes: bytes):
+    from PIL import Image
+    from io import BytesIO
+
+    icon_image = Image.open(BytesIO(icon_bytes)).convert("RGBA")
+    return icon_image, icon_image.getchannel("A")
+
+
+def get_marker_icon(icon_url: str):
+    """
+    Return the decoded marker icon and its alpha mask from the process cache.
+
+    Warm instances download and decode the icon once; after the TTL expires it
+    is revalidated with If-None-Match / If-Modified-Since, so an unchanged icon
+    costs a 304 and no decode. If the website cannot be reached the previously
+    cached copy (or the copy packaged in assets/marker.png) is used instead.
+
+    Args:
+        icon_url (str): URL to the location marker icon
+
+    Returns:
+        tuple: (RGBA PIL Image, alpha mask) or None if no icon is available
+    """
+    now = time.monotonic()
+    entry = _marker_icon_cache.get(icon_url)
+    if entry and now < entry["expires"]:
+        return entry["image"], entry["mask"]
+
+    # Only one worker thread refreshes the icon; the others wait and reuse it
+    with _marker_icon_lock:
+        entry = _marker_icon_cache.get(icon_url)
+        if entry and now < entry["expires"]:
+            return entry["image"], entry["mask"]
+
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            icon_response = http_get(icon_url, headers=headers)
+            if icon_response.status_code == 304 and entry:
+                entry["expires"] = now + MARKER_ICON_TTL_SECONDS
+                return entry["image"], entry["mask"]
+            if icon_response.status_code == 200:
+                icon_image, icon_mask = _decode_marker_icon(icon_response.content)
+                _marker_icon_cache[icon_url] = {
+                    "image": icon_image,
+                    "mask": icon_mask,
+                    "etag": icon_response.headers.get("ETag"),
+                    "last_modified": icon_response.headers.get("Last-Modified"),
+                    "expires": now + MARKER_ICON_TTL_SECONDS,
+                }
+                logging.info(f"Marker icon loaded from {icon_url} ({icon_image.size[0]}x{icon_image.size[1]})")
+                return icon_image, icon_mask
+            logging.warning(f"Marker icon download returned HTTP {icon_response.status_code}")
+        except Exception as e:
+            logging.warning(f"Marker icon download failed: {e}")
+
+        # Keep serving the stale copy rather than dropping the marker
+        if entry:
+            entry["expires"] = now + MARKER_ICON_TTL_SECONDS
+            return entry["image"], entry["mask"]
+
+        try:
+            with open(MARKER_ICON_FALLBACK_PATH, "rb") as icon_file:
+                icon_image, icon_mask = _decode_marker_icon(icon_file.read())
+        except Exception as e:
+            logging.error(f"Packaged marker icon unavailable: {e}")
+            return None
+
+        # Short-lived entry so the real icon is retried on a later run
+        _marker_icon_cache[icon_url] = {
+            "image": icon_image,
+            "mask": icon_mask,
+            "etag": None,
+            "last_modified": None,
+            "expires": now + min(MARKER_ICON_TTL_SECONDS, 300),
+        }
+        logging.info("Using packaged marker icon fallback")
+        return icon_image, icon_mask
+
+
+@instrumented()
 def add_icon_to_image(main_image, icon_url):
     """
     Add a location marker icon overlay to a satellite image.
     
-    This function downloads a location marker icon and overlays it on the center
+    This function overlays the cached location marker icon on the center
     of a satellite image to provide geographic reference for users.
     
     Args:
@@ -632,47 +4672,38 @@ def add_icon_to_image(main_image, icon_url):
         bytes: JPEG-encoded image data with icon overlay
         
     Processing Details:
-        - Downloads icon from provided URL
-        - Calculates center position for icon placement
+        - Icon comes from the process-level cache (see get_marker_icon)
+        - Places the icon tip on the image center using the icon's real size
         - Uses PNG transparency for proper overlay
         - Returns original image if icon processing fails
         - Memory-efficient conversion to bytes format
         
     Error Handling:
-        - Network failures during icon download
+        - Network failures fall back to the cached or packaged icon
         - Image format incompatibilities
         - Memory allocation issues
         - Graceful fallback to original image
     """
-    import requests  # Import inside function
-    from PIL import Image
     from io import BytesIO
     
     try:
         # main_image is already a PIL Image object from previous processing
-        
-        # Download the location marker icon
-        icon_response = requests.get(icon_url)
-        if icon_response.status_code == 200:
-            icon_image = Image.open(BytesIO(icon_response.content))
+        marker = get_marker_icon(icon_url)
+        if marker is not None:
+            icon_image, icon_mask = marker
             
-            # Calculate the position to center the icon on the main image
-            # Offset slightly above center for better visual positioning
+            # Center the icon horizontally with its tip on the image center
             main_width, main_height = main_image.size
-            icon_position = ((main_width - 19) // 2, (main_height // 2)-26)
+            icon_width, icon_height = icon_image.size
+            icon_position = ((main_width - icon_width) // 2, (main_height // 2) - icon_height)
             
             # Paste the icon onto the main image using transparency
-            main_image.paste(icon_image, icon_position, icon_image)
+            main_image.paste(icon_image, icon_position, icon_mask)
             
-            # Convert processed image back to bytes for storage
-            output = BytesIO()
-            main_image.save(output, format='JPEG')
-            return output.getvalue()
-        else:
-            # Return original image as bytes if icon download failed
-            output = BytesIO()
-            main_image.save(output, format='JPEG')
-            return output.getvalue()
+        # Convert processed image back to bytes for storage
+        output = BytesIO()
+        main_image.save(output, format='JPEG')
+        return output.getvalue()
     except Exception as e:
         logging.error(f"Error adding icon to image: {str(e)}")
         # Return original image as bytes if any error occurs
@@ -682,9 +4713,223 @@ def add_icon_to_image(main_image, icon_url):
 
 
 
-def generate_animation_for_city(city_code: str, blob_service_client, container_name: str) -> bool:
+# Number of most recent satellite frames that make up each city animation
+ANIMATION_FRAME_COUNT = 10
+
+# Local cache of already encoded PNG animation frames, one folder per city.
+# It survives between invocations on a warm instance; a cold instance rebuilds
+# it from the JPEG blobs the first time a city is animated.
+ANIMATION_FRAME_CACHE_DIR = os.environ.get(
+    "ANIMATION_FRAME_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "climaguate_frames"),
+)
+
+
+def encode_animation_frame(image_bytes: bytes) -> bytes:
+    """
+    Decode a satellite JPEG and re-encode it as a PNG animation frame.
+
+    Args:
+        image_bytes (bytes): JPEG image data as uploaded to blob storage
+
+    Returns:
+        bytes: PNG-encoded frame, resized to fit within 600x600
+    """
+    from PIL import Image
+    from io import BytesIO
+
+    img = Image.open(BytesIO(image_bytes))
+
+    # Resize to reasonable size for web performance (optional optimization)
+    if img.size[0] > 600 or img.size[1] > 600:
+        img.thumbnail((600, 600), Image.Resampling.LANCZOS)
+
+    # Convert to PNG format for animation compatibility
+    png_bytes = BytesIO()
+    img.save(png_bytes, format='PNG')
+    return png_bytes.getvalue()
+
+
+def _frame_cache_path(city_code: str, blob_name: str) -> str:
+    frame_id = os.path.splitext(os.path.basename(blob_name))[0]
+    return os.path.join(ANIMATION_FRAME_CACHE_DIR, city_code, f"{frame_id}.png")
+
+
+def _read_cached_frame(city_code: str, blob_name: str):
+    try:
+        with open(_frame_cache_path(city_code, blob_name), "rb") as cached:
+            return cached.read()
+    except OSError:
+        return None
+
+
+def _write_cached_frame(city_code: str, blob_name: str, png_bytes: bytes) -> None:
+    path = _frame_cache_path(city_code, blob_name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a truncated frame
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as cached:
+            cached.write(png_bytes)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not cache animation frame {blob_name}: {e}")
+
+
+def _evict_cached_frames(city_code: str, keep_blob_names: list) -> None:
+    """Drop cached frames that slid out of the animation window."""
+    city_dir = os.path.join(ANIMATION_FRAME_CACHE_DIR, city_code)
+    keep = {os.path.basename(_frame_cache_path(city_code, name)) for name in keep_blob_names}
+    try:
+        for file_name in os.listdir(city_dir):
+            if file_name not in keep:
+                os.remove(os.path.join(city_dir, file_name))
+    except OSError:
+        pass
+
+
+# =============================================================================
+# SATELLITE FRAME INDEX - PER-CITY MANIFEST BLOB
+# =============================================================================
+
+def _frame_manifest_blob_name(city_code: str) -> str:
+    return f"{city_code}/index.json"
+
+
+def rebuild_frame_manifest(city_code: str, blob_service_client, container_name: str) -> list:
+    """
+    Build the frame list from a prefix listing (bootstrap only).
+
+    Blob listings come back in lexical name order and the timestamped names
+    (%Y%m%d%H%M%S.jpg) sort chronologically, so the newest frames are simply
+    the last ones returned and no sorting is required.
+
+    Returns:
+        list: Up to ANIMATION_FRAME_COUNT most recent frame blob names, oldest first
+    """
+    from collections import deque
+
+    recent = deque(maxlen=ANIMATION_FRAME_COUNT)
+    for blob in blob_service_client.get_container_client(container_name).list_blobs(name_starts_with=f"{city_code}/"):
+        if blob.name.endswith('.jpg'):
+            recent.append(blob.name)
+    logging.info(f"Rebuilt frame index for {city_code} from blob listing ({len(recent)} frames)")
+    return list(recent)
+
+
+# Attempts of the index.json read-modify-write before the job gives up (and is retried)
+FRAME_MANIFEST_MAX_ATTEMPTS = 5
+
+
+def _read_frame_manifest(city_code: str, blob_service_client, container_name: str) -> tuple:
+    """
+    Returns:
+        tuple: (frame names or None, ETag of the index blob or None if it does not exist)
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+
+    blob_client = blob_service_client.get_blob_client(
+        container=container_name, blob=_frame_manifest_blob_name(city_code)
+    )
+    try:
+        download = blob_client.download_blob()
+    except ResourceNotFoundError:
+        return None, None
+    etag = download.properties.etag
+    try:
+        manifest = json.loads(download.readall())
+    except ValueError as e:
+        logging.warning(f"Frame index for {city_code} is corrupted, rebuilding: {e}")
+        return None, etag
+    return list(manifest.get("frames", [])), etag
+
+
+def load_frame_manifest(city_code: str, blob_service_client, container_name: str):
+    """
+    Read the per-city frame index stored next to animation.png.
+
+    Returns:
+        list: Frame blob names oldest first, or None if the index does not exist
+    """
+    return _read_frame_manifest(city_code, blob_service_client, container_name)[0]
+
+
+def save_frame_manifest(
+    city_code: str, blob_service_client, container_name: str, frame_names: list, etag: str = None
+) -> None:
+    """
+    Write the city's index.json, only over the version that was read.
+
+    Raises:
+        ResourceModifiedError: The index changed since it was read (etag given)
+        ResourceExistsError: The index was created meanwhile (no etag)
+    """
+    from azure.core import MatchConditions
+
+    manifest = {
+        "city_code": city_code,
+        "updated_utc": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "frames": frame_names,
+    }
+    blob_client = blob_service_client.get_blob_client(
+        container=container_name, blob=_frame_manifest_blob_name(city_code)
+    )
+    if etag is None:
+        blob_client.upload_blob(json.dumps(manifest), blob_type="BlockBlob", overwrite=False)
+    else:
+        blob_client.upload_blob(
+            json.dumps(manifest), blob_type="BlockBlob", overwrite=True,
+            etag=etag, match_condition=MatchConditions.IfNotModified
+        )
+
+
+def update_frame_manifest(city_code: str, blob_service_client, container_name: str, new_frame_name: str) -> list:
+    """
+    Record a newly uploaded frame in the city's index and trim it to the window.
+
+    The index is only rebuilt from a listing when it does not exist yet, so the
+    cost per run stays constant no matter how many frames the container holds.
+    Concurrent queue workers may update the same index: the write is
+    conditional on the ETag that was read, and a conflict re-reads and retries
+    so neither worker's frame is lost.
+
+    Returns:
+        list: Updated frame blob names, oldest first
+    """
+    import random
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+
+    for attempt in range(FRAME_MANIFEST_MAX_ATTEMPTS):
+        frame_names, etag = _read_frame_manifest(city_code, blob_service_client, container_name)
+        if frame_names is None:
+            frame_names = rebuild_frame_manifest(city_code, blob_service_client, container_name)
+
+        if new_frame_name not in frame_names:
+            frame_names.append(new_frame_name)
+        frame_names = sorted(frame_names)[-ANIMATION_FRAME_COUNT:]
+
+        try:
+            save_frame_manifest(city_code, blob_service_client, container_name, frame_names, etag=etag)
+            return frame_names
+        except (ResourceModifiedError, ResourceExistsError):
+            if attempt == FRAME_MANIFEST_MAX_ATTEMPTS - 1:
+                raise
+            count("frame_manifest_conflicts")
+            logging.info(f"Frame index for {city_code} changed concurrently, retrying")
+            time.sleep(random.uniform(0.05, 0.2) * (attempt + 1))
+
+
+@instrumented()
+def generate_animation_for_city(
+    city_code: str,
+    blob_service_client,
+    container_name: str,
+    new_frame_name: str = None,
+    new_frame_bytes: bytes = None,
+    frame_names: list = None,
+) -> bool:
     """
-    Generate animated PNG from recent satellite images for a city with memory optimization.
+    Generate animated PNG from recent satellite images for a city with a sliding frame window.
     
     This function creates an animated timeline showing cloud movement and weather patterns
     by combining the most recent satellite images into a smooth animation.
@@ -693,22 +4938,26 @@ def generate_animation_for_city(city_code: str, blob_service_client, container_n
         city_code (str): Unique city identifier for image organization
         blob_service_client: Azure Blob Storage service client
         container_name (str): Blob storage container name
+        new_frame_name (str): Blob name of the frame that was just uploaded (optional)
+        new_frame_bytes (bytes): JPEG data of that frame, so it is not downloaded again
+        frame_names (list): Current frame index; read from index.json when omitted
         
     Returns:
         bool: True if animation was successfully created, False otherwise
         
     Animation Process:
-        - Retrieves up to 10 most recent satellite images for the city
-        - Sorts images by timestamp in chronological order
-        - Resizes images for web optimization (max 600x600)
+        - Selects up to 10 most recent satellite images from the city's index.json
+          (the container prefix is never listed once the index exists)
+        - Orders frames chronologically by their timestamped names
+        - Reuses PNG frames already encoded by previous runs (local frame cache)
+        - Encodes only the new frame, drops the one that left the window
         - Creates APNG animation with 500ms frame delays
         - Uploads final animation to replace previous version
         
     Memory Optimization:
-        - Processes images one at a time to minimize memory usage
+        - Steady state decodes/encodes 1 frame and downloads 0 frames per run
+        - Frames missing from the cache (cold instance) are downloaded once
         - Uses thumbnail resizing for efficient scaling
-        - Streams image data directly to avoid large memory allocations
-        - Garbage collection friendly image handling
         
     Error Handling:
         - Graceful handling of corrupted or missing images
@@ -716,56 +4965,55 @@ def generate_animation_for_city(city_code: str, blob_service_client, container_n
         - Validates minimum frame count for meaningful animation
         - Comprehensive logging for debugging
     """
-    from PIL import Image
     from io import BytesIO
     from apng import APNG, PNG
     
     try:
-        # List all satellite images for this city, sorted by modification date
-        blobs = []
-        for blob in blob_service_client.get_container_client(container_name).list_blobs(name_starts_with=f"{city_code}/"):
-            if blob.name.endswith('.jpg'):
-                blobs.append(blob)
-        
-        # Sort by last modified descending (newest first) for chronological processing
-        blobs.sort(key=lambda x: x.last_modified, reverse=True)
+        # Frame names come from the per-city index instead of a prefix listing
+        if frame_names is None:
+            frame_names = load_frame_manifest(city_code, blob_service_client, container_name)
+            if frame_names is None:
+                frame_names = rebuild_frame_manifest(city_code, blob_service_client, container_name)
+
+        # Timestamped names (%Y%m%d%H%M%S.jpg) sort chronologically
+        blob_names = list(frame_names)
+        if new_frame_name and new_frame_name not in blob_names:
+            blob_names.append(new_frame_name)
+        blob_names.sort()
         
-        if len(blobs) < 2:
-            logging.info(f"Not enough images for animation for city {city_code} (found {len(blobs)})")
+        if len(blob_names) < 2:
+            logging.info(f"Not enough images for animation for city {city_code} (found {len(blob_names)})")
             return False
 
-        # Use up to the latest 10 images for optimal animation performance
-        blobs_to_use = blobs[:10]
+        # Use up to the latest 10 images, oldest to newest
+        window = blob_names[-ANIMATION_FRAME_COUNT:]
 
-        # Reverse the order to show chronological progression (oldest to newest)
-        blobs_to_use.reverse()
-
-        # Create APNG animation from processed images
         files = []
-        for i, blob in enumerate(blobs_to_use):
+        encoded = downloaded = 0
+        for blob_name in window:
             try:
-                # Download satellite image blob
-                blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob.name)
-                blob_data = blob_client.download_blob().readall()
-                
-                # Load as PIL Image and optimize for web display
-                img = Image.open(BytesIO(blob_data))
-                
-                # Resize to reasonable size for web performance (optional optimization)
-                if img.size[0] > 600 or img.size[1] > 600:
-                    img.thumbnail((600, 600), Image.Resampling.LANCZOS)
-                
-                # Convert to PNG format for animation compatibility
-                png_bytes = BytesIO()
-                img.save(png_bytes, format='PNG')
-                png_bytes.seek(0)
+                png_data = _read_cached_frame(city_code, blob_name)
+                if png_data is None:
+                    if blob_name == new_frame_name and new_frame_bytes is not None:
+                        image_bytes = new_frame_bytes
+                    else:
+                        # Cold cache: download the JPEG once and keep its PNG for later runs
+                        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+                        image_bytes = blob_client.download_blob().readall()
+                        record_bytes("in", "blob", len(image_bytes))
+                        downloaded += 1
+                    png_data = encode_animation_frame(image_bytes)
+                    encoded += 1
+                    _write_cached_frame(city_code, blob_name, png_data)
                 
-                # Add frame to animation with timing control (500ms per frame)
-                files.append(PNG.from_bytes(png_bytes.getvalue()))
+                files.append(PNG.from_bytes(png_data))
                 
             except Exception as e:
-                logging.warning(f"Failed to process blob {blob.name} for animation: {e}")
+                logging.warning(f"Failed to process blob {blob_name} for animation: {e}")
                 continue
+
+        # Frames that left the window are no longer needed on disk
+        _evict_cached_frames(city_code, window)
         
         if len(files) < 2:
             logging.warning(f"Not enough valid images processed for city {city_code} animation.")
@@ -789,7 +5037,11 @@ def generate_animation_for_city(city_code: str, blob_service_client, container_n
         animation_blob_name = f"{city_code}/animation.png"
         blob_client = blob_service_client.get_blob_client(container=container_name, blob=animation_blob_name)
         blob_client.upload_blob(animation_bytes, blob_type="BlockBlob", overwrite=True)
-        logging.info(f"Animation uploaded to {container_name}/{animation_blob_name}")
+        record_bytes("out", "blob", len(animation_bytes))
+        logging.info(
+            f"Animation uploaded to {container_name}/{animation_blob_name} "
+            f"({len(files)} frames, {encoded} encoded, {downloaded} downloaded)"
+        )
         
         return True
         
@@ -818,7 +5070,7 @@ def get_hourly_forecast(hourlyTimer: func.TimerRequest) -> None:
     3. For each city:
        - Calls Azure Maps Weather API for hourly forecasts (12 hours ahead)
        - Extracts comprehensive forecast data (temperature, humidity, wind, precipitation)
-       - Stores forecast records in WeatherForecast table
+       - Stores forecast records in WeatherForecastCurrent (MERGE) or WeatherForecast (append)
     4. Commits all forecast data atomically
     
     Forecast Data Collected:
@@ -837,12 +5089,14 @@ def get_hourly_forecast(hourlyTimer: func.TimerRequest) -> None:
     - Comprehensive error handling for API failures
     
     Database Operations:
-    - Stores forecasts in WeatherForecast table
+    - FORECAST_WRITE_MODE=merge (default) MERGEs on (CityCode, EffectiveDate) into
+      WeatherForecastCurrent and appends superseded versions to WeatherForecast;
+      merge_only drops them, append keeps the legacy insert of every run
     - Quarter field set to NULL since hourly doesn't use quarters
     - Uses dateTime instead of effectiveDate for hourly precision
     - Timezone-aware timestamp handling
     - Nested JSON data extraction and flattening
-    - Batch commits for performance optimization
+    - All rows written with a single fast_executemany call and one commit
     """
     # Import problematic modules inside the function
     import pyodbc
@@ -852,6 +5106,9 @@ def get_hourly_forecast(hourlyTimer: func.TimerRequest) -> None:
         logging.info('The timer is past due!')
 
     conn = None
+    connection_broken = False
+    connection_string = None
+    run_metrics = start_run("get_hourly_forecast")
     try:
         logging.info('Starting forecast process with environment variables.')
         
@@ -862,9 +5119,11 @@ def get_hourly_forecast(hourlyTimer: func.TimerRequest) -> None:
         if not connection_string or not apikey:
             raise ValueError("Missing required environment variables: connstr and/or azuremapskey")
 
-        conn = pyodbc.connect(connection_string)
+        conn = resources.acquire_sql_connection(connection_string)
         cursor = conn.cursor()
 
+        writer = BatchWriter()
+
         # Fetch cities from Data API for consistent city management
         logging.info('Fetching cities for forecast processing from Data API.')
         cities_data = get_cities_from_api()
@@ -873,87 +5132,282 @@ def get_hourly_forecast(hourlyTimer: func.TimerRequest) -> None:
             logging.error('❌ Failed to fetch cities from API for forecast processing')
             return
 
-        for city in cities_data:
-            city_code = city.get('CityCode')
-            city_name = city.get('CityName') 
-            lat = city.get('Latitude')
-            lon = city.get('Longitude')
+        # Fetch and buffer every city's hourly rows under one span
+        with span("forecast_insert_loop", cities=len(cities_data)):
+            for city in cities_data:
+                city_code = city.get('CityCode')
+                city_name = city.get('CityName') 
+                lat = city.get('Latitude')
+                lon = city.get('Longitude')
             
-            # Skip cities with missing required coordinate data
-            if not city_code or not city_name or lat is None or lon is None:
-                logging.warning(f"⚠️ Skipping forecast for city with missing data: {city}")
-                continue
+                # Skip cities with missing required coordinate data
+                if not city_code or not city_name or lat is None or lon is None:
+                    logging.warning(f"⚠️ Skipping forecast for city with missing data: {city}")
+                    continue
 
-            # Construct Azure Maps Weather API URL with Spanish localization (Hourly Forecast)
-            api_url = (
-                f"https://atlas.microsoft.com/weather/forecast/hourly/json"
-                f"?api-version=1.1&query={lat},{lon}&duration=24&subscription-key={apikey}&language=es-419"
-            )
+                # Construct Azure Maps Weather API URL with Spanish localization (Hourly Forecast)
+                api_url = (
+                    f"{AZURE_MAPS_BASE_URL}/weather/forecast/hourly/json"
+                    f"?api-version=1.1&query={lat},{lon}&duration=24&subscription-key={apikey}&language=es-419"
+                )
 
-            try:
-                response = requests.get(api_url)
-                response.raise_for_status()
-                forecast_data = response.json()
-
-                forecasts = forecast_data.get("forecasts", [])
-
-                for forecast in forecasts:
-                    # Insert comprehensive hourly forecast data into database
-                    insert_query = '''
-                    INSERT INTO weather.WeatherForecast (
-                        CityCode, ForecastDate, EffectiveDate, Quarter,
-                        IconPhrase, Phrase,
-                        Temperature, RealFeelTemperature,
-                        DewPoint, RelativeHumidity,
-                        WindDirectionDegrees, WindDirectionDescription, WindSpeed,
-                        WindGustSpeed,
-                        Visibility, CloudCover,
-                        HasPrecipitation, PrecipitationType, PrecipitationIntensity,
-                        PrecipitationProbability,
-                        TotalLiquid, Rain
-                    ) VALUES (
-                        ?, 
-                        SYSDATETIMEOFFSET() AT TIME ZONE 'UTC' AT TIME ZONE 'Central America Standard Time',  
-                        ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
-                    )
-                    '''
-                    # Execute hourly forecast data insertion with simplified parameter mapping
-                    cursor.execute(insert_query, (
-                        city_code,
-                        forecast.get("date"),  # Fixed: API returns "date" not "dateTime"
-                        None,  # Quarter field set to None since hourly doesn't have quarters
-                        forecast.get("iconPhrase"),
-                        forecast.get("iconPhrase"),  # Fixed: API doesn't have "shortPhrase", using iconPhrase
-                        forecast.get("temperature", {}).get("value"),  # Single temperature value from hourly API
-                        forecast.get("realFeelTemperature", {}).get("value"),  # Single real feel value from hourly API
-                        forecast.get("dewPoint", {}).get("value"),
-                        forecast.get("relativeHumidity"),
-                        forecast.get("wind", {}).get("direction", {}).get("degrees"),
-                        forecast.get("wind", {}).get("direction", {}).get("localizedDescription"),
-                        forecast.get("wind", {}).get("speed", {}).get("value"),
-                        forecast.get("windGust", {}).get("speed", {}).get("value"),
-                        forecast.get("visibility", {}).get("value"),
-                        forecast.get("cloudCover"),
-                        forecast.get("hasPrecipitation"),
-                        forecast.get("precipitationType"),
-                        forecast.get("precipitationIntensity"),
-                        forecast.get("precipitationProbability"),
-                        forecast.get("totalLiquid", {}).get("value"),
-                        forecast.get("rain", {}).get("value")
-                    ))
-
-            except requests.exceptions.RequestException as e:
-                logging.error(f"API error for {city_code}: {e}")
-
-        # Commit all forecast data atomically
-        conn.commit()
+                try:
+                    response, changed = _response_cache.get(api_url, "azure_maps_forecast")
+                    response.raise_for_status()
+                    if not changed:
+                        logging.info(f"Forecast for {city_code} unchanged since last run, skipping")
+                        continue
+                    forecast_data = response.json()
 
-        # Optional: Mark forecast collection as completed for monitoring
-        # cursor.execute("UPDATE JobRunLock SET Status = ? WHERE RunTimeUtc = ?", ('Completed', run_time))
-        # conn.commit()
+                    forecasts = forecast_data.get("forecasts", [])
+
+                    for forecast in forecasts:
+                        # Buffer hourly forecast row; all cities are written in one call below
+                        writer.add("WeatherForecast", (
+                            city_code,
+                            forecast.get("date"),  # Fixed: API returns "date" not "dateTime"
+                            None,  # Quarter field set to None since hourly doesn't have quarters
+                            forecast.get("iconPhrase"),
+                            forecast.get("iconPhrase"),  # Fixed: API doesn't have "shortPhrase", using iconPhrase
+                            forecast.get("temperature", {}).get("value"),  # Single temperature value from hourly API
+                            forecast.get("realFeelTemperature", {}).get("value"),  # Single real feel value from hourly API
+                            forecast.get("dewPoint", {}).get("value"),
+                            forecast.get("relativeHumidity"),
+                            forecast.get("wind", {}).get("direction", {}).get("degrees"),
+                            forecast.get("wind", {}).get("direction", {}).get("localizedDescription"),
+                            forecast.get("wind", {}).get("speed", {}).get("value"),
+                            forecast.get("windGust", {}).get("speed", {}).get("value"),
+                            forecast.get("visibility", {}).get("value"),
+                            forecast.get("cloudCover"),
+                            forecast.get("hasPrecipitation"),
+                            forecast.get("precipitationType"),
+                            forecast.get("precipitationIntensity"),
+                            forecast.get("precipitationProbability"),
+                            forecast.get("totalLiquid", {}).get("value"),
+                            forecast.get("rain", {}).get("value")
+                        ))
+
+                except requests.exceptions.RequestException as e:
+                    logging.error(f"API error for {city_code}: {e}")
+
+        # Upsert the hot table (or append in legacy mode) and commit atomically
+        with span("forecast_write", mode=FORECAST_WRITE_MODE):
+            if FORECAST_WRITE_MODE == "append":
+                writer.flush(cursor)
+            else:
+                merge_forecast_rows(
+                    cursor, writer.take("WeatherForecast"), keep_history=(FORECAST_WRITE_MODE == "merge")
+                )
+            conn.commit()
+        log_http_stats("get_hourly_forecast")
+        log_scheduler_stats("get_hourly_forecast")
+        log_circuit_stats("get_hourly_forecast")
+        log_response_cache_stats("get_hourly_forecast")
+        logging.info(f"🗂️ get_hourly_forecast city cache: {get_city_cache_stats()}")
+        log_resource_report("get_hourly_forecast")
 
     except Exception as e:
+        connection_broken = isinstance(e, pyodbc.Error)
+        _response_cache.clear()
         logging.error(f"An error occurred in get_hourly_forecast: {str(e)}")
     finally:
-        if conn is not None:
-            conn.close()
+        # Keep the connection for the next run unless it failed
+        resources.release_sql_connection(connection_string, conn, broken=connection_broken)
+        finish_run(run_metrics)
+
+
+# =============================================================================
+# SATELLITE IMAGE RETENTION FUNCTION
+# =============================================================================
+
+# Days of satellite frames kept per city (mirrors weather.Delete_weather)
+SATELLITE_RETENTION_DAYS = get_env_number("SATELLITE_RETENTION_DAYS", 5, int, 1)
+
+# Blob batch API accepts at most 256 sub-requests per call
+BLOB_DELETE_BATCH_SIZE = 256
+
+# Timestamp format of the frame blob names ({city_code}/%Y%m%d%H%M%S.jpg)
+FRAME_TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+
+def _archive_frames(container_client, city_code: str, day: str, frame_names: list) -> int:
+    """
+    Roll one day of frames into {city_code}/archive/{day}.zip.
+
+    JPEG data is already compressed, so frames are stored without deflate.
+    An archive left by an earlier partial run is extended, not replaced.
+
+    Returns:
+        int: Size in bytes of the archive blob that was written
+    """
+    import zipfile
+    from io import BytesIO
+    from azure.core.exceptions import ResourceNotFoundError
+
+    archive_name = f"{city_code}/archive/{day}.zip"
+    archive_client = container_client.get_blob_client(archive_name)
+
+    buffer = BytesIO()
+    try:
+        buffer.write(archive_client.download_blob().readall())
+        mode = "a"
+    except ResourceNotFoundError:
+        mode = "w"
+
+    buffer.seek(0)
+    with zipfile.ZipFile(buffer, mode, compression=zipfile.ZIP_STORED) as archive:
+        existing = set(archive.namelist())
+        for frame_name in frame_names:
+            entry_name = os.path.basename(frame_name)
+            if entry_name in existing:
+                continue
+            frame_bytes = container_client.get_blob_client(frame_name).download_blob().readall()
+            archive.writestr(entry_name, frame_bytes)
+
+    archive_bytes = buffer.getvalue()
+    archive_client.upload_blob(archive_bytes, blob_type="BlockBlob", overwrite=True)
+    return len(archive_bytes)
+
+
+def prune_city_frames(container_client, city_code: str, cutoff: datetime.datetime, archive: bool = False) -> dict:
+    """
+    Delete (and optionally archive) satellite frames older than the cutoff for one city.
+
+    Only needs a container client (list_blobs, get_blob_client, delete_blobs),
+    so it can run against any local stand-in with the same methods.
+
+    Args:
+        container_client: Azure ContainerClient (or compatible stand-in)
+        city_code (str): City prefix to prune
+        cutoff (datetime): Frames stamped before this moment are removed
+        archive (bool): Roll pruned frames into daily zip archives first
+
+    Returns:
+        dict: deleted_objects, deleted_bytes, archived_objects, archive_bytes
+
+    Processing Details:
+        - Listing is in lexical order, which is chronological for frame names,
+          so it stops at the first frame newer than the cutoff
+        - Frames still referenced by the city's index.json are never deleted
+        - Deletes are sent in batches of up to 256 blobs
+    """
+    stats = {"deleted_objects": 0, "deleted_bytes": 0, "archived_objects": 0, "archive_bytes": 0}
+    cutoff_name = f"{city_code}/{cutoff.strftime(FRAME_TIMESTAMP_FORMAT)}.jpg"
+
+    # Frames in the animation window stay, whatever their age
+    protected = set()
+    try:
+        manifest = json.loads(container_client.get_blob_client(_frame_manifest_blob_name(city_code)).download_blob().readall())
+        protected = set(manifest.get("frames", []))
+    except Exception:
+        pass
+
+    expired = []
+    for blob in container_client.list_blobs(name_starts_with=f"{city_code}/"):
+        if not blob.name.endswith('.jpg') or "/archive/" in blob.name:
+            continue
+        if blob.name >= cutoff_name:
+            break
+        if blob.name not in protected:
+            expired.append((blob.name, blob.size or 0))
+
+    if not expired:
+        return stats
+
+    if archive:
+        frames_by_day = {}
+        for name, _ in expired:
+            day = os.path.basename(name)[:8]
+            frames_by_day.setdefault(day, []).append(name)
+        for day, names in frames_by_day.items():
+            stats["archive_bytes"] += _archive_frames(container_client, city_code, day, names)
+            stats["archived_objects"] += len(names)
+
+    for start in range(0, len(expired), BLOB_DELETE_BATCH_SIZE):
+        batch = expired[start:start + BLOB_DELETE_BATCH_SIZE]
+        try:
+            container_client.delete_blobs(*[name for name, _ in batch])
+            stats["deleted_objects"] += len(batch)
+            stats["deleted_bytes"] += sum(size for _, size in batch)
+        except Exception as e:
+            logging.error(f"Batch delete failed for {city_code} ({len(batch)} frames): {str(e)}")
+
+    return stats
+
+
+def prune_satellite_container(container_client, retention_days: int, archive: bool = False, now: datetime.datetime = None) -> dict:
+    """
+    Apply the retention window to every city folder in the container.
+
+    Args:
+        now (datetime): Naive UTC time, the clock of the frame names (see satellite_tick)
+
+    Returns:
+        dict: Totals of deleted_objects, deleted_bytes, archived_objects and archive_bytes
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    cutoff = now - datetime.timedelta(days=retention_days)
+
+    totals = {"deleted_objects": 0, "deleted_bytes": 0, "archived_objects": 0, "archive_bytes": 0}
+    for prefix in container_client.walk_blobs(delimiter="/"):
+        city_code = prefix.name.rstrip("/")
+        if not prefix.name.endswith("/"):
+            continue  # Loose blob at container root, not a city folder
+        try:
+            stats = prune_city_frames(container_client, city_code, cutoff, archive)
+        except Exception as e:
+            logging.error(f"Retention failed for {city_code}: {str(e)}")
+            continue
+        if stats["deleted_objects"]:
+            logging.info(
+                f"🧹 {city_code}: removed {stats['deleted_objects']} frames "
+                f"({stats['deleted_bytes'] / 1024 / 1024:.1f} MB), archived {stats['archived_objects']}"
+            )
+        for key, value in stats.items():
+            totals[key] += value
+    return totals
+
+
+@app.schedule(schedule="0 30 3 * * *", arg_name="retentionTimer", run_on_startup=False, use_monitor=False)
+def prune_satellite_frames(retentionTimer: func.TimerRequest) -> None:
+    """
+    Satellite image retention function - Executes daily at 03:30.
+
+    This timer-triggered function is the blob storage counterpart of the
+    weather.Delete_weather stored procedure: it removes satellite frames that
+    are older than the retention window so the mapimages container stops
+    growing forever.
+
+    Schedule: Daily (CRON: "0 30 3 * * *")
+
+    Configuration:
+    - SATELLITE_RETENTION_DAYS: days of frames kept per city (default 5)
+    - SATELLITE_ARCHIVE_ENABLED: "true" to roll pruned frames into
+      {city_code}/archive/{YYYYMMDD}.zip before deleting them
+
+    Reporting:
+    - Logs deleted objects and reclaimed bytes per city and in total
+    """
+    if retentionTimer.past_due:
+        logging.info('The timer is past due!')
+
+    try:
+        archive = os.environ.get("SATELLITE_ARCHIVE_ENABLED", "false").lower() == "true"
+        container_client = create_blob_service_client().get_container_client(SATELLITE_CONTAINER_NAME)
+
+        totals = prune_satellite_container(container_client, SATELLITE_RETENTION_DAYS, archive)
+        logging.info(
+            f"✅ Satellite retention finished: {totals['deleted_objects']} frames deleted, "
+            f"{totals['deleted_bytes'] / 1024 / 1024:.1f} MB reclaimed, "
+            f"{totals['archived_objects']} frames archived ({totals['archive_bytes'] / 1024 / 1024:.1f} MB)"
+        )
+    except Exception as e:
+        logging.error(f"An error occurred in prune_satellite_frames: {str(e)}")
+
+
+# Time spent importing this module and registering the functions
+_MODULE_IMPORT_SECONDS = round(time.perf_counter() - _MODULE_IMPORT_START, 3)
+
+# Warm the heavy imports off the invocation path while the host finishes starting
+if COLD_START_PRELOAD == "background":
+    threading.Thread(target=resources.warm_imports, name="import-preload", daemon=True).start()
@@ -0,0 +1,127 @@
+"""
+Shared stand-ins for the backend tests.
+
+The Azure SDK clients are replaced by an in-memory blob store exposing the
+subset of BlobServiceClient / ContainerClient / BlobClient that
+function_app.py uses, including ETags and conditional uploads.
+"""
+
+import itertools
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class MemoryDownload:
+    def __init__(self, data: bytes, etag: str):
+        self._data = data
+        self.properties = types.SimpleNamespace(etag=etag)
+
+    def readall(self) -> bytes:
+        return self._data
+
+
+class MemoryBlobClient:
+    def __init__(self, store, container: str, name: str):
+        self._store, self._container, self._name = store, container, name
+
+    def upload_blob(self, data, blob_type=None, overwrite=False, etag=None, match_condition=None, **kwargs):
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+
+        if hasattr(data, "getvalue"):
+            data = data.getvalue()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        key = (self._container, self._name)
+        with self._store.lock:
+            current = self._store.blobs.get(key)
+            if match_condition == MatchConditions.IfNotModified and (current is None or current[1] != etag):
+                raise ResourceModifiedError(f"{self._name} was modified")
+            if current is not None and not overwrite and match_condition is None:
+                raise ResourceExistsError(f"{self._name} already exists")
+            self._store.blobs[key] = (bytes(data), f'"{next(self._store.etags)}"')
+            self._store.uploads.append(self._name)
+
+    def download_blob(self, **kwargs):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        with self._store.lock:
+            current = self._store.blobs.get((self._container, self._name))
+        if current is None:
+            raise ResourceNotFoundError(f"{self._name} not found")
+        return MemoryDownload(*current)
+
+
+class MemoryContainerClient:
+    def __init__(self, store, container: str):
+        self._store, self._container = store, container
+        self.listed = []
+        self.delete_calls = []
+
+    def get_blob_client(self, blob: str):
+        return MemoryBlobClient(self._store, self._container, blob)
+
+    def list_blobs(self, name_starts_with: str = ""):
+        with self._store.lock:
+            items = sorted(
+                (name, len(data)) for (container, name), (data, _) in self._store.blobs.items()
+                if container == self._container and name.startswith(name_starts_with)
+            )
+        # Lazy like the SDK pager, so tests can see where the caller stopped
+        for name, size in items:
+            self.listed.append(name)
+            yield types.SimpleNamespace(name=name, size=size)
+
+    def walk_blobs(self, delimiter: str = "/"):
+        with self._store.lock:
+            names = [name for container, name in self._store.blobs if container == self._container]
+        prefixes = sorted({name.split(delimiter)[0] + delimiter for name in names if delimiter in name})
+        return [types.SimpleNamespace(name=prefix) for prefix in prefixes]
+
+    def delete_blobs(self, *names):
+        self.delete_calls.append(len(names))
+        with self._store.lock:
+            for name in names:
+                self._store.blobs.pop((self._container, name), None)
+
+    def put(self, name: str, data: bytes) -> None:
+        self.get_blob_client(name).upload_blob(data, overwrite=True)
+
+    def names(self) -> list:
+        with self._store.lock:
+            return sorted(name for container, name in self._store.blobs if container == self._container)
+
+
+class MemoryBlobStore:
+    """Stand-in for BlobServiceClient."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.blobs = {}
+        self.etags = itertools.count(1)
+        self.uploads = []
+        self._containers = {}
+
+    def get_blob_client(self, container: str, blob: str):
+        return MemoryBlobClient(self, container, blob)
+
+    def get_container_client(self, container: str):
+        return self._containers.setdefault(container, MemoryContainerClient(self, container))
+
+
+@pytest.fixture
+def blob_store():
+    return MemoryBlobStore()
+
+
+@pytest.fixture
+def fa():
+    import function_app
+
+    return function_app
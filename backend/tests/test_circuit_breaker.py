@@ -0,0 +1,64 @@
+"""Circuit breaker outcomes as seen through http_get and the request scheduler."""
+
+import types
+
+import pytest
+
+
+class FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return types.SimpleNamespace(
+            status_code=self.statuses.pop(0), headers={"Retry-After": "0"}, content=b"", close=lambda: None
+        )
+
+
+@pytest.fixture
+def half_open(fa, monkeypatch):
+    """A fresh nasa breaker, forced half-open with one probe slot."""
+    monkeypatch.setattr(fa, "circuit_breakers", fa.CircuitBreakerRegistry())
+    monkeypatch.setattr(fa, "request_scheduler", fa.RequestScheduler())
+    monkeypatch.setattr(fa, "CIRCUIT_HALF_OPEN_PROBES", 1)
+    monkeypatch.setattr(fa, "REQUEST_MAX_REQUEUES", 2)
+    breaker = fa.circuit_breakers.for_provider("nasa_image")
+    with breaker._lock:
+        breaker._transition("half_open")
+    return breaker
+
+
+def use_session(fa, monkeypatch, statuses):
+    session = FakeSession(statuses)
+    monkeypatch.setattr(fa, "get_http_session", lambda url: session)
+    return session
+
+
+def test_requeued_probe_is_recorded_once(fa, monkeypatch, half_open):
+    session = use_session(fa, monkeypatch, [429, 429, 200])
+
+    assert fa.http_get("https://nasa.example/frame.jpg", provider="nasa_image").status_code == 200
+    assert session.calls == 3
+    assert half_open.stats["calls"] == 1
+    assert half_open.state == "closed"
+
+
+def test_throttled_probe_does_not_close_the_breaker(fa, monkeypatch, half_open):
+    use_session(fa, monkeypatch, [429, 429, 429])
+
+    assert fa.http_get("https://nasa.example/frame.jpg", provider="nasa_image").status_code == 429
+    assert half_open.stats["calls"] == 0
+    assert half_open.state == "half_open"
+    # The probe slot was given back for the next call
+    half_open.acquire()
+
+
+def test_failed_probe_reopens_the_breaker(fa, monkeypatch, half_open):
+    use_session(fa, monkeypatch, [429, 503])
+
+    fa.http_get("https://nasa.example/frame.jpg", provider="nasa_image")
+
+    assert half_open.stats["calls"] == 1
+    assert half_open.state == "open"
@@ -0,0 +1,49 @@
+"""City catalogue cache: stale-while-revalidate in get_cities_from_api."""
+
+import threading
+import time
+
+import pytest
+
+STALE = [{"CityCode": "GUA"}]
+FRESH = [{"CityCode": "GUA"}, {"CityCode": "XEL"}]
+
+
+@pytest.fixture
+def cache(fa, monkeypatch, tmp_path):
+    """A stale cached list and a Data API call that blocks until released."""
+    monkeypatch.setattr(fa, "CITY_CACHE_SNAPSHOT_PATH", str(tmp_path / "cities.json"))
+    monkeypatch.setattr(fa, "_city_cache", {
+        "cities": list(STALE), "etag": '"1"', "last_modified": None,
+        "fetched_at": time.time() - fa.CITY_CACHE_TTL_SECONDS - 1,
+    })
+    monkeypatch.setattr(fa, "_city_cache_stats", dict.fromkeys(fa._city_cache_stats, 0))
+    api = threading.Event()
+    fetches = []
+
+    def slow_fetch(etag=None, last_modified=None):
+        fetches.append(etag)
+        api.wait(5)
+        return 200, list(FRESH), {"ETag": '"2"'}
+
+    monkeypatch.setattr(fa, "_fetch_cities", slow_fetch)
+    return api, fetches
+
+
+def test_stale_list_is_served_while_one_caller_revalidates(fa, cache):
+    api, fetches = cache
+    revalidated = []
+    revalidator = threading.Thread(target=lambda: revalidated.append(fa.get_cities_from_api()))
+    revalidator.start()
+    while not fetches:
+        time.sleep(0.01)
+
+    # Neither blocks behind the request in flight
+    assert fa.get_cities_from_api() == STALE
+    assert fa.get_city_cache_stats()["stale_served"] == 1
+
+    api.set()
+    revalidator.join()
+    assert revalidated == [FRESH]
+    assert fetches == ['"1"']
+    assert fa.get_cities_from_api() == FRESH
@@ -0,0 +1,46 @@
+"""Per-city index.json updates from concurrent satellite workers."""
+
+import json
+import threading
+
+CONTAINER = "mapimages"
+
+
+def manifest_frames(blob_store, city_code):
+    data = blob_store.get_blob_client(CONTAINER, f"{city_code}/index.json").download_blob().readall()
+    return json.loads(data)["frames"]
+
+
+def test_conflicting_write_is_retried_without_losing_frames(fa, blob_store, monkeypatch):
+    fa.update_frame_manifest("GUA", blob_store, CONTAINER, "GUA/20260310100000.jpg")
+    read = fa._read_frame_manifest
+    raced = []
+
+    def read_then_race(*args):
+        result = read(*args)
+        if not raced:
+            # Another worker commits its frame between this read and the write
+            raced.append(True)
+            fa.update_frame_manifest("GUA", blob_store, CONTAINER, "GUA/20260310102000.jpg")
+        return result
+
+    monkeypatch.setattr(fa, "_read_frame_manifest", read_then_race)
+    frames = fa.update_frame_manifest("GUA", blob_store, CONTAINER, "GUA/20260310104000.jpg")
+
+    expected = ["GUA/20260310100000.jpg", "GUA/20260310102000.jpg", "GUA/20260310104000.jpg"]
+    assert frames == expected
+    assert manifest_frames(blob_store, "GUA") == expected
+
+
+def test_concurrent_workers_keep_every_frame(fa, blob_store):
+    names = [f"GUA/2026031010{minute:02d}00.jpg" for minute in range(0, 60, 15)]
+    threads = [
+        threading.Thread(target=fa.update_frame_manifest, args=("GUA", blob_store, CONTAINER, name))
+        for name in names
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert manifest_frames(blob_store, "GUA") == sorted(names)[-fa.ANIMATION_FRAME_COUNT:]
@@ -0,0 +1,98 @@
+"""Satellite frame retention (prune_city_frames / prune_satellite_container)."""
+
+import datetime
+import io
+import json
+import zipfile
+
+NOW = datetime.datetime(2026, 3, 10, 12, 0)
+CUTOFF = NOW - datetime.timedelta(days=5)
+
+
+def frame_name(city_code, moment):
+    return f"{city_code}/{moment.strftime('%Y%m%d%H%M%S')}.jpg"
+
+
+def add_frames(container, city_code, start, count, step=datetime.timedelta(minutes=20), size=10):
+    names = [frame_name(city_code, start + i * step) for i in range(count)]
+    for name in names:
+        container.put(name, b"x" * size)
+    return names
+
+
+def archive_entries(container, name):
+    data = container.get_blob_client(name).download_blob().readall()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        return sorted(archive.namelist())
+
+
+def test_manifest_frames_are_never_deleted(fa, blob_store):
+    container = blob_store.get_container_client("mapimages")
+    old = add_frames(container, "GUA", CUTOFF - datetime.timedelta(days=1), 6)
+    container.put("GUA/index.json", json.dumps({"frames": old[-2:]}).encode())
+
+    stats = fa.prune_city_frames(container, "GUA", CUTOFF)
+
+    assert stats["deleted_objects"] == 4
+    assert set(old[-2:]) <= set(container.names())
+    assert not set(old[:4]) & set(container.names())
+
+
+def test_listing_stops_at_the_cutoff(fa, blob_store):
+    container = blob_store.get_container_client("mapimages")
+    old = add_frames(container, "GUA", CUTOFF - datetime.timedelta(hours=2), 3)
+    new = add_frames(container, "GUA", CUTOFF + datetime.timedelta(minutes=1), 5)
+
+    fa.prune_city_frames(container, "GUA", CUTOFF)
+
+    # The first frame past the cutoff ends the listing, the rest is never read
+    frames_listed = [name for name in container.listed if name.endswith(".jpg")]
+    assert frames_listed == old + new[:1]
+    assert container.names() == sorted(new)
+
+
+def test_deletes_are_chunked_at_256(fa, blob_store):
+    container = blob_store.get_container_client("mapimages")
+    add_frames(container, "GUA", CUTOFF - datetime.timedelta(days=3), 600, step=datetime.timedelta(minutes=5))
+
+    stats = fa.prune_city_frames(container, "GUA", CUTOFF)
+
+    assert container.delete_calls == [256, 256, 88]
+    assert stats["deleted_objects"] == 600
+    assert container.names() == []
+
+
+def test_existing_archive_is_extended_not_replaced(fa, blob_store):
+    container = blob_store.get_container_client("mapimages")
+    day_start = datetime.datetime(2026, 3, 1, 6, 0)
+    earlier = io.BytesIO()
+    with zipfile.ZipFile(earlier, "w") as archive:
+        archive.writestr("20260301000000.jpg", b"earlier run")
+    container.put("GUA/archive/20260301.zip", earlier.getvalue())
+    pruned = add_frames(container, "GUA", day_start, 3)
+
+    stats = fa.prune_city_frames(container, "GUA", CUTOFF, archive=True)
+
+    assert stats["archived_objects"] == 3
+    assert archive_entries(container, "GUA/archive/20260301.zip") == sorted(
+        ["20260301000000.jpg"] + [name.split("/")[1] for name in pruned]
+    )
+    assert "GUA/archive/20260301.zip" in container.names()
+
+
+def test_container_totals(fa, blob_store):
+    container = blob_store.get_container_client("mapimages")
+    add_frames(container, "GUA", CUTOFF - datetime.timedelta(days=2), 4, size=100)
+    add_frames(container, "XEL", CUTOFF - datetime.timedelta(days=2), 3, size=50)
+    kept = add_frames(container, "XEL", NOW - datetime.timedelta(hours=1), 2, size=50)
+
+    totals = fa.prune_satellite_container(container, 5, archive=True, now=NOW)
+
+    assert totals["deleted_objects"] == 7
+    assert totals["deleted_bytes"] == 4 * 100 + 3 * 50
+    assert totals["archived_objects"] == 7
+    archives = [name for name in container.names() if "/archive/" in name]
+    assert totals["archive_bytes"] == sum(
+        len(container.get_blob_client(name).download_blob().readall()) for name in archives
+    )
+    assert [name for name in container.names() if name.endswith(".jpg")] == kept
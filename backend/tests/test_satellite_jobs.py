@@ -0,0 +1,151 @@
+"""Satellite job queue: build_satellite_jobs, InProcessQueue and handle_satellite_job."""
+
+import datetime
+import io
+import json
+import types
+
+import azure.functions as func
+import pytest
+
+TICK = datetime.datetime(2026, 3, 10, 12, 20)
+NOW = TICK + datetime.timedelta(minutes=3)
+
+CITIES = [
+    {"CityCode": "GUA", "Latitude": 14.6, "Longitude": -90.5},
+    {"CityCode": "XEL", "Latitude": 14.8, "Longitude": -91.5},
+    {"CityCode": "GUA", "Latitude": 14.6, "Longitude": -90.5},
+]
+
+
+@pytest.fixture
+def nasa(fa, monkeypatch):
+    """Replace the NASA fetch with a publish of a dummy frame; set nasa.published = False to fail it."""
+    nasa = types.SimpleNamespace(calls=[], published=True)
+
+    def fake_process_city_nasa(blob_service_client, container_name, icon_url, city_code, latitude, longitude,
+                               regional_image=None, frame_time=None):
+        nasa.calls.append((city_code, frame_time))
+        if not nasa.published:
+            return "failed"
+        frame_name = f"{city_code}/{frame_time.strftime(fa.FRAME_TIMESTAMP_FORMAT)}.jpg"
+        blob_service_client.get_blob_client(container=container_name, blob=frame_name).upload_blob(
+            b"frame", overwrite=True
+        )
+        fa.update_frame_manifest(city_code, blob_service_client, container_name, frame_name)
+        return "published"
+
+    monkeypatch.setattr(fa, "process_city_nasa", fake_process_city_nasa)
+    return nasa
+
+
+def drain(fa, jobs, blob_store, now=NOW):
+    queue = fa.InProcessQueue()
+    queue.set(jobs)
+    return queue.drain(blob_service_client=blob_store, now=now, max_workers=2)
+
+
+def test_jobs_are_deduplicated_per_city_and_tick(fa, blob_store, nasa):
+    jobs = fa.build_satellite_jobs(CITIES, TICK, shared_fetch=False)
+
+    assert sorted(json.loads(job)["city_code"] for job in jobs) == ["GUA", "XEL"]
+    assert {json.loads(job)["tick"] for job in jobs} == {"20260310122000"}
+    assert drain(fa, jobs, blob_store) == {"processed": 2}
+    assert sorted(city for city, _ in nasa.calls) == ["GUA", "XEL"]
+    assert fa.load_frame_manifest("GUA", blob_store, fa.SATELLITE_CONTAINER_NAME) == ["GUA/20260310122000.jpg"]
+
+
+def test_redelivered_job_is_a_duplicate(fa, blob_store, nasa):
+    jobs = fa.build_satellite_jobs(CITIES, TICK, shared_fetch=False)
+    drain(fa, jobs, blob_store)
+
+    assert drain(fa, jobs, blob_store) == {"duplicate": 2}
+    assert len(nasa.calls) == 2
+
+
+def test_job_of_an_old_tick_expires(fa, blob_store, nasa):
+    jobs = fa.build_satellite_jobs(CITIES[:1], TICK, shared_fetch=False)
+    later = TICK + datetime.timedelta(seconds=fa.SATELLITE_JOB_MAX_AGE_SECONDS + 1)
+
+    assert drain(fa, jobs, blob_store, now=later) == {"expired": 1}
+    assert nasa.calls == []
+
+
+@pytest.mark.parametrize("body", [
+    "not json",
+    json.dumps({"city_code": "GUA", "latitude": 14.6, "longitude": -90.5}),
+    json.dumps({"city_code": "GUA", "latitude": 14.6, "longitude": -90.5, "tick": "yesterday"}),
+    json.dumps({"city_code": "GUA", "latitude": "north", "longitude": -90.5, "tick": "20260310122000"}),
+])
+def test_malformed_job_is_invalid(fa, blob_store, nasa, body):
+    assert fa.handle_satellite_job(body, blob_service_client=blob_store, now=NOW) == "invalid"
+    assert nasa.calls == []
+
+
+def test_failed_fetch_is_left_to_the_queue_retry(fa, blob_store, nasa, monkeypatch):
+    nasa.published = False
+    monkeypatch.setattr(fa, "create_blob_service_client", lambda: blob_store)
+    job = fa.build_satellite_jobs(CITIES[:1], fa.satellite_tick(), shared_fetch=False)[0]
+
+    assert drain(fa, [job], blob_store, now=None) == {"failed": 1}
+    with pytest.raises(RuntimeError):
+        fa.process_satellite_job(func.QueueMessage(id="1", body=job.encode("utf-8")))
+
+
+def nasa_response(body: bytes, url: str = ""):
+    return types.SimpleNamespace(
+        status_code=200, headers={}, url=url, content=body,
+        iter_content=lambda chunk_size: iter([body]), close=lambda: None,
+    )
+
+
+@pytest.fixture
+def goes(fa, monkeypatch):
+    """The real satellite pipeline against a get-abi stand-in that always serves the same image."""
+    from PIL import Image
+
+    image = io.BytesIO()
+    Image.new("RGB", (800, 800), "gray").save(image, "JPEG")
+
+    def fake_http_get(url, provider=None, **kwargs):
+        if provider == "nasa_abi":
+            return nasa_response(b'<html><img src="/tmp/goes.jpg"></html>')
+        return nasa_response(image.getvalue(), url)
+
+    monkeypatch.setattr(fa, "_response_cache", fa.ResponseCache())
+    monkeypatch.setattr(fa, "http_get", fake_http_get)
+    monkeypatch.setattr(fa, "add_icon_to_image", lambda image_data, icon_url: b"frame")
+    monkeypatch.setattr(fa, "generate_animation_for_city", lambda *args, **kwargs: None)
+
+
+def test_frame_that_failed_to_publish_is_published_on_retry(fa, blob_store, goes, monkeypatch):
+    from azure.core.exceptions import ResourceModifiedError
+
+    update = fa.update_frame_manifest
+    conflicts = []
+
+    def conflict_once(*args):
+        if not conflicts:
+            conflicts.append(True)
+            raise ResourceModifiedError("index.json kept changing")
+        return update(*args)
+
+    monkeypatch.setattr(fa, "update_frame_manifest", conflict_once)
+    job = fa.build_satellite_jobs(CITIES[:1], TICK, shared_fetch=False)[0]
+
+    with pytest.raises(ResourceModifiedError):
+        fa.handle_satellite_job(job, blob_service_client=blob_store, now=NOW)
+
+    # The queue redelivers the same job; NASA still serves the same image
+    assert fa.handle_satellite_job(job, blob_service_client=blob_store, now=NOW) == "processed"
+    assert fa.load_frame_manifest("GUA", blob_store, fa.SATELLITE_CONTAINER_NAME) == ["GUA/20260310122000.jpg"]
+
+
+def test_unchanged_image_is_not_reported_processed(fa, blob_store, goes):
+    next_tick = TICK + datetime.timedelta(minutes=fa.SATELLITE_TICK_MINUTES)
+    first = fa.build_satellite_jobs(CITIES[:1], TICK, shared_fetch=False)
+    second = fa.build_satellite_jobs(CITIES[:1], next_tick, shared_fetch=False)
+
+    assert drain(fa, first, blob_store) == {"processed": 1}
+    assert drain(fa, second, blob_store, now=next_tick) == {"unchanged": 1}
+    assert fa.load_frame_manifest("GUA", blob_store, fa.SATELLITE_CONTAINER_NAME) == ["GUA/20260310122000.jpg"]
@@ -0,0 +1,80 @@
+"""Vectorized score_suitability against the row-by-row UDF reference."""
+
+import math
+from decimal import Decimal, ROUND_DOWN
+
+import pytest
+
+from benchmarks.suitability_benchmark import (
+    as_columns, as_scores, boundary_pairs, random_pairs, reference_results,
+)
+
+# (observed temp, observed humidity, optimal temp min/max, optimal humidity min/max,
+#  stress temp min/max, local temp adjustment, local humidity adjustment)
+PROFILE = (18.0, 24.0, 60, 80, 10.0, 30.0)
+
+EDGE_CASES = {
+    "optimal": (21.0, 70) + PROFILE + (0.0, 0),
+    "null temperature": (None, 70) + PROFILE + (0.0, 0),
+    "null humidity": (21.0, None) + PROFILE + (0.0, 0),
+    "null temperature adjustment": (21.0, 70) + PROFILE + (None, 0),
+    "null humidity adjustment": (21.0, 70) + PROFILE + (0.0, None),
+    "adjusted humidity below 0": (21.0, 10) + PROFILE + (0.0, -30),
+    "adjusted humidity above 100": (21.0, 90) + PROFILE + (0.0, 30),
+    "zero denominator below": (21.0, 10, 18.0, 24.0, 0, 80, 10.0, 30.0, 0.0, -20),
+    "zero denominator above": (21.0, 90, 18.0, 24.0, 60, 100, 10.0, 30.0, 0.0, 20),
+    "negative combined score": (5.0, 10, 18.0, 24.0, 60, 80, 10.0, 30.0, 0.0, -50),
+    "negative combined rounding to 0": (5.0, 99, 18.0, 24.0, 100, 100, 10.0, 30.0, 0.0, -100),
+    "negative combined rounding half away": (5.0, 80, 18.0, 24.0, 80, 90, 10.0, 30.0, 0.0, -81),
+}
+
+
+def vectorized(fa, rows):
+    return as_scores(fa.score_suitability(*as_columns(rows))["score"])
+
+
+def assert_parity(rows, expected, actual):
+    for row, want, got in zip(rows, expected, actual):
+        # The vectorized NaN stands for both a NULL result and a statement the UDF would abort
+        assert got == (None if want == "error" else want), row
+
+
+@pytest.mark.parametrize("row", EDGE_CASES.values(), ids=EDGE_CASES.keys())
+def test_edge_cases_match_the_reference(fa, row):
+    assert_parity([row], reference_results([row]), vectorized(fa, [row]))
+
+
+def test_edge_cases_cover_nulls_and_udf_errors():
+    expected = reference_results(list(EDGE_CASES.values()))
+    outcomes = dict(zip(EDGE_CASES, expected))
+
+    assert outcomes["optimal"] == 100
+    assert outcomes["null humidity"] is None
+    assert outcomes["zero denominator below"] == "error"
+    assert outcomes["zero denominator above"] == "error"
+    assert outcomes["negative combined score"] == "error"
+    assert outcomes["negative combined rounding to 0"] == 0
+    assert outcomes["negative combined rounding half away"] == "error"
+
+
+def test_boundary_grid_matches_the_reference(fa):
+    rows = boundary_pairs()
+    assert_parity(rows, reference_results(rows), vectorized(fa, rows))
+
+
+def test_random_pairs_match_the_reference(fa):
+    rows = random_pairs(5000, seed=7)
+    assert_parity(rows, reference_results(rows), vectorized(fa, rows))
+
+
+@pytest.mark.parametrize("numerator,denominator", [
+    (1, 3), (-1, 3), (2, 3), (-30, 60), (7, 100), (-50, 1), (99, 70), (0, 20),
+])
+def test_humidity_ratio_truncates_like_sql_decimal(fa, numerator, denominator):
+    # DECIMAL(26,12): exact to 12 places, truncated toward zero
+    quotient = (Decimal("100.0") * numerator / denominator).quantize(Decimal("1E-12"), rounding=ROUND_DOWN)
+    assert fa._sql_humidity_ratio(numerator, denominator) == float(quotient)
+
+
+def test_humidity_ratio_zero_denominator_is_nan(fa):
+    assert math.isnan(fa._sql_humidity_ratio(10, 0))
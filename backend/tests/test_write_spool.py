@@ -0,0 +1,52 @@
+"""Write-ahead spool shared by concurrent shard runs in one worker."""
+
+import os
+import time
+
+import pytest
+
+ROW = ("WeatherData", tuple(range(30)))
+
+
+@pytest.fixture
+def spool(fa, tmp_path):
+    return fa.WriteSpool(directory=str(tmp_path), claim_timeout_seconds=60)
+
+
+def test_in_flight_segment_of_another_run_is_not_replayed(fa, spool):
+    shard_a, shard_b = spool.new_owner(), spool.new_owner()
+    segment_a = spool.append([ROW], shard_a)
+    segment_b = spool.append([ROW], shard_b)
+
+    # Shard B commits while shard A is still writing
+    assert spool.claim(shard_b) == []
+    spool.remove([segment_b])
+
+    assert os.path.exists(segment_a)
+    assert spool.stats()["claimed_segments"] == 1
+
+
+def test_released_segment_is_replayed_by_one_later_run(fa, spool):
+    failed = spool.new_owner()
+    spool.release([spool.append([ROW], failed)])
+    assert spool.stats()["segments"] == 1
+
+    later, concurrent = spool.new_owner(), spool.new_owner()
+    claimed = spool.claim(later)
+
+    assert len(claimed) == 1 and claimed[0].endswith(later)
+    assert spool.claim(concurrent) == []
+    assert spool.load(claimed)[1] == [ROW]
+
+
+def test_abandoned_claim_is_taken_over(fa, spool):
+    crashed = spool.append([ROW], spool.new_owner())
+    stale = time.time() - 120
+    os.utime(crashed, (stale, stale))
+
+    claimed = spool.claim(spool.new_owner())
+
+    assert len(claimed) == 1
+    assert not os.path.exists(crashed)
+    # The takeover refreshed the claim, so a third run leaves it alone
+    assert spool.claim(spool.new_owner()) == []
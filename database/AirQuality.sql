@@ -30,3 +30,9 @@ GO
 CREATE NONCLUSTERED INDEX [IX_AirQuality_Date] 
 ON [weather].[AirQuality] ([Date_gt] DESC);
 GO
+
+-- One row per city and API timestamp; duplicates are discarded on insert
+CREATE UNIQUE NONCLUSTERED INDEX [UX_AirQuality_CityCode_Timestamp] 
+ON [weather].[AirQuality] ([CityCode] ASC, [Timestamp] ASC)
+WITH (IGNORE_DUP_KEY = ON);
+GO
@@ -0,0 +1,27 @@
+-- Materialized current suitability for every city x crop pair.
+-- run_city_batch recomputes the scores for the cities observed in each tick
+-- (vectorized, same arithmetic as agriculture.CalculateSuitabilityScore) and
+-- MERGEs them here, so GetCropsByCity reads a column instead of calling the
+-- scalar UDF per row, which kept its plan serial.
+CREATE TABLE agriculture.CityCropScore (
+    CityCode CHAR(3) NOT NULL,
+    CropID INT NOT NULL,
+
+    -- Observation the score was computed from (weather.WeatherData)
+    ObservedDt BIGINT NULL,               -- WeatherData.Dt, unix UTC
+    ObservedTempC FLOAT NULL,
+    ObservedHumidityPct INT NULL,
+
+    -- Subscores (0-100) and the combined score; NULL when the observation had
+    -- no temperature/humidity or the UDF would have raised for these inputs
+    TempScore FLOAT NULL,
+    HumidityScore FLOAT NULL,
+    SuitabilityScore TINYINT NULL,
+
+    UpdatedAt DATETIME2(0) NOT NULL CONSTRAINT DF_CityCropScore_UpdatedAt DEFAULT SYSUTCDATETIME(),
+
+    CONSTRAINT PK_CityCropScore PRIMARY KEY CLUSTERED (CityCode, CropID),
+    CONSTRAINT FK_CityCropScore_CityCrops FOREIGN KEY (CityCode, CropID)
+        REFERENCES agriculture.CityCrops (CityCode, CropID) ON DELETE CASCADE
+);
+GO
@@ -0,0 +1,21 @@
+-- Shard leases for run_city_batch (CITY_SHARD_COUNT > 1).
+-- The timer enqueues one message per shard for its tick; whichever
+-- process_city_shard worker inserts the row first owns the shard until
+-- LeaseExpiresAt. Completed rows are never claimed again, so a redelivered
+-- message does not insert the shard twice; a Failed or expired Running row is
+-- taken over by the next worker (Attempts counts the claims).
+CREATE TABLE dbo.JobRunLock (
+    RunTimeUtc DATETIME2 NOT NULL,            -- batch tick (naive UTC, 20-minute floor)
+    ShardIndex INT NOT NULL CONSTRAINT DF_JobRunLock_ShardIndex DEFAULT 0,
+    ShardCount INT NOT NULL CONSTRAINT DF_JobRunLock_ShardCount DEFAULT 1,
+    Owner NVARCHAR(100) NULL,                 -- instance:pid:claim of the current holder
+    StartedAt DATETIME2 NULL,
+    LeaseExpiresAt DATETIME2 NULL,
+    Status NVARCHAR(50) NULL,                 -- Running, Completed, Failed
+    Attempts INT NOT NULL CONSTRAINT DF_JobRunLock_Attempts DEFAULT 0,
+    CityCount INT NULL,
+    CompletedAt DATETIME2 NULL,
+
+    CONSTRAINT PK_JobRunLock PRIMARY KEY CLUSTERED (RunTimeUtc, ShardIndex)
+);
+GO
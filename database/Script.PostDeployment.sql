@@ -50,7 +50,12 @@ WHEN MATCHED THEN
         Longitude = source.Longitude,
         ElevationMeters = source.ElevationMeters,
         SoilType = source.SoilType,
-        ClimateZone = source.ClimateZone
+        ClimateZone = source.ClimateZone,
+        -- Moved cities are resolved again from their new coordinates
+        OwmCityId = CASE
+            WHEN target.Latitude <> source.Latitude OR target.Longitude <> source.Longitude THEN NULL
+            ELSE target.OwmCityId
+        END
 WHEN NOT MATCHED THEN
     INSERT (CityCode, CityName, Latitude, Longitude, ElevationMeters, SoilType, ClimateZone)
     VALUES (source.CityCode, source.CityName, source.Latitude, source.Longitude, source.ElevationMeters, source.SoilType, source.ClimateZone);
@@ -901,6 +906,54 @@ WHEN NOT MATCHED THEN
     VALUES (source.CityCode, (SELECT CropID FROM agriculture.Crops WHERE CropCode = source.CropCode), source.SuitabilityScore, source.IsPrimary, source.LocalTempAdjustment, source.LocalHumidityAdjustment, source.Notes);
 GO
 
+-- Seed the hot forecast table once from the latest appended forecasts
+IF NOT EXISTS (SELECT 1 FROM weather.WeatherForecastCurrent)
+BEGIN
+    WITH RankedForecasts AS (
+        SELECT *,
+               ROW_NUMBER() OVER (
+                   PARTITION BY CityCode, EffectiveDate
+                   ORDER BY ForecastDate DESC
+               ) AS rn
+        FROM weather.WeatherForecast
+        WHERE EffectiveDate IS NOT NULL
+    )
+    INSERT INTO weather.WeatherForecastCurrent (
+    CityCode, ForecastDate, EffectiveDate, Quarter, IconPhrase, Phrase,
+    Temperature, RealFeelTemperature, DewPoint, RelativeHumidity,
+    WindDirectionDegrees, WindDirectionDescription, WindSpeed, WindGustSpeed,
+    Visibility, CloudCover, HasPrecipitation, PrecipitationType, PrecipitationIntensity,
+    PrecipitationProbability, TotalLiquid, Rain
+    )
+    SELECT
+    CityCode, ForecastDate, EffectiveDate, Quarter, IconPhrase, Phrase,
+    Temperature, RealFeelTemperature, DewPoint, RelativeHumidity,
+    WindDirectionDegrees, WindDirectionDescription, WindSpeed, WindGustSpeed,
+    Visibility, CloudCover, HasPrecipitation, PrecipitationType, PrecipitationIntensity,
+    PrecipitationProbability, TotalLiquid, Rain
+    FROM RankedForecasts
+    WHERE rn = 1;
+END
+GO
+
+-- Resolve OpenWeatherMap city ids from the ids already stored with the observations
+UPDATE c
+SET OwmCityId = latest.Id
+FROM weather.cities c
+CROSS APPLY (
+    SELECT TOP (1) w.Id
+    FROM weather.WeatherData w
+    WHERE w.CityCode = c.CityCode AND w.Id <> 0
+    ORDER BY w.Dt DESC
+) latest
+WHERE c.OwmCityId IS NULL;
+GO
+
+-- Build the hourly weather rollup from the raw observations on first deploy
+IF NOT EXISTS (SELECT 1 FROM weather.WeatherHourlyRollup)
+    EXEC weather.BackfillWeatherHourlyRollup;
+GO
+
 PRINT 'Post-deployment script completed successfully.';
 PRINT 'Note: Run agriculture_migration.sql manually to normalize crop seasons data.';
 GO
@@ -0,0 +1,23 @@
+-- Remove repeated observations before the unique (CityCode, Dt) indexes are built.
+-- Keeps the earliest inserted row for each city and observation timestamp.
+IF OBJECT_ID('weather.WeatherData', 'U') IS NOT NULL
+BEGIN
+    WITH Ranked AS (
+        SELECT ROW_NUMBER() OVER (PARTITION BY CityCode, Dt ORDER BY Date_gt) AS rn
+        FROM weather.WeatherData
+    )
+    DELETE FROM Ranked WHERE rn > 1;
+    PRINT 'Removed duplicate WeatherData observations: ' + CAST(@@ROWCOUNT AS VARCHAR(20));
+END
+GO
+
+IF OBJECT_ID('weather.AirQuality', 'U') IS NOT NULL
+BEGIN
+    WITH Ranked AS (
+        SELECT ROW_NUMBER() OVER (PARTITION BY CityCode, [Timestamp] ORDER BY Id) AS rn
+        FROM weather.AirQuality
+    )
+    DELETE FROM Ranked WHERE rn > 1;
+    PRINT 'Removed duplicate AirQuality observations: ' + CAST(@@ROWCOUNT AS VARCHAR(20));
+END
+GO
@@ -38,3 +38,9 @@ GO
 
 create index IX_CityCode_Date_gt on weather.WeatherData (CityCode, Date_gt);
 GO
+
+-- One row per city and OpenWeatherMap observation time; repeated observations
+-- inserted by the collector are discarded instead of failing the batch
+create unique index UX_WeatherData_CityCode_Dt on weather.WeatherData (CityCode, Dt)
+with (IGNORE_DUP_KEY = ON);
+GO
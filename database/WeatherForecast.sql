@@ -1,3 +1,6 @@
+-- Forecast log. In the default merge mode get_hourly_forecast keeps the latest
+-- forecast in weather.WeatherForecastCurrent and only superseded versions land
+-- here; in append mode every run is written here.
 CREATE TABLE weather.WeatherForecast (
     CityCode CHAR(3) NOT NULL,
     ForecastDate DATETIMEOFFSET,
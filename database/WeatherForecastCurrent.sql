@@ -0,0 +1,40 @@
+-- Hot forecast table: only the latest forecast for each city and hour.
+-- get_hourly_forecast MERGEs on (CityCode, EffectiveDate), so the table size is
+-- bounded by cities x forecast horizon instead of growing with every run.
+-- Superseded versions are appended to weather.WeatherForecast (history).
+CREATE TABLE weather.WeatherForecastCurrent (
+    CityCode CHAR(3) NOT NULL,
+    ForecastDate DATETIMEOFFSET,
+    EffectiveDate DATETIMEOFFSET NOT NULL,
+    Quarter INT NULL,
+    IconPhrase NVARCHAR(100),
+    Phrase NVARCHAR(100),
+    
+    Temperature FLOAT,
+    RealFeelTemperature FLOAT,
+    
+    DewPoint FLOAT,
+    RelativeHumidity INT,
+    
+    WindDirectionDegrees FLOAT,
+    WindDirectionDescription NVARCHAR(10),
+    WindSpeed FLOAT,
+    
+    WindGustSpeed FLOAT,
+    
+    Visibility FLOAT,
+    CloudCover INT,
+    
+    HasPrecipitation BIT,
+    PrecipitationType NVARCHAR(20),
+    PrecipitationIntensity NVARCHAR(20),
+    
+    PrecipitationProbability INT,
+    
+    TotalLiquid FLOAT,
+    Rain FLOAT,
+
+    -- Clustered on the read path: GetWeatherForecast is a range seek on this key
+    CONSTRAINT PK_WeatherForecastCurrent PRIMARY KEY CLUSTERED (CityCode, EffectiveDate)
+);
+GO
@@ -0,0 +1,133 @@
+-- Hourly rollup of weather.WeatherData used by weather.GetWeatherHistory.
+-- Keeps running sums and counts (not averages) so an hour can be refreshed as
+-- new observations arrive; the averages are computed on read.
+CREATE TABLE weather.WeatherHourlyRollup (
+    CityCode CHAR(3) NOT NULL,
+    HourStart DATETIME NOT NULL, -- Start of the hour, Central America time (same bucket as Date_gt)
+    TempSum FLOAT NULL,
+    TempCount INT NOT NULL,
+    HumiditySum FLOAT NULL,
+    HumidityCount INT NOT NULL,
+    PressureSum FLOAT NULL,
+    PressureCount INT NOT NULL,
+    Rain1hSum FLOAT NOT NULL, -- Missing rain counts as 0, like the raw history query
+    Rain3hSum FLOAT NOT NULL,
+    SampleCount INT NOT NULL, -- Observations in the hour
+    UpdatedAt DATETIME2 NOT NULL CONSTRAINT DF_WeatherHourlyRollup_UpdatedAt DEFAULT SYSUTCDATETIME(),
+    CONSTRAINT PK_WeatherHourlyRollup PRIMARY KEY CLUSTERED (CityCode, HourStart)
+);
+GO
+
+/*
+Description: Recomputes the hourly rollup for every hour from @FromDate onwards.
+
+Procedure: weather.RefreshWeatherHourlyRollup
+Parameters:
+    @FromDate - First observation time to include (truncated to the hour)
+    @ToDate   - Optional exclusive upper bound (truncated to the hour)
+    @CityCode - Optional single city
+
+Usage:
+EXEC weather.RefreshWeatherHourlyRollup @FromDate = '2025-01-01';
+
+Notes:
+    - Called by run_city_batch after each batch commit, once per city for the hours
+      of its new observations, each in its own transaction.
+    - Each touched hour is rebuilt from the raw rows, so re-running is idempotent
+      and duplicate or late observations never double count.
+    - Only refresh ranges that still exist in weather.WeatherData.
+*/
+CREATE PROCEDURE weather.RefreshWeatherHourlyRollup
+    @FromDate SMALLDATETIME,
+    @ToDate SMALLDATETIME = NULL,
+    @CityCode CHAR(3) = NULL
+AS
+BEGIN
+    SET NOCOUNT ON;
+
+    DECLARE @FromHour DATETIME = DATEADD(hour, DATEDIFF(hour, 0, @FromDate), 0);
+    DECLARE @ToHour DATETIME = DATEADD(hour, DATEDIFF(hour, 0, @ToDate), 0);
+
+    MERGE weather.WeatherHourlyRollup WITH (HOLDLOCK) AS target
+    USING (
+        SELECT
+            CityCode,
+            DATEADD(hour, DATEDIFF(hour, 0, Date_gt), 0) AS HourStart,
+            SUM(Main_Temp) AS TempSum,
+            COUNT(Main_Temp) AS TempCount,
+            SUM(CAST(Main_Humidity AS FLOAT)) AS HumiditySum,
+            COUNT(Main_Humidity) AS HumidityCount,
+            SUM(CAST(Main_Pressure AS FLOAT)) AS PressureSum,
+            COUNT(Main_Pressure) AS PressureCount,
+            SUM(ISNULL(Rain_1h, 0)) AS Rain1hSum,
+            SUM(ISNULL(Rain_3h, 0)) AS Rain3hSum,
+            COUNT(*) AS SampleCount
+        FROM weather.WeatherData
+        WHERE Date_gt >= @FromHour
+          AND (@ToHour IS NULL OR Date_gt < @ToHour)
+          AND (@CityCode IS NULL OR CityCode = @CityCode)
+        GROUP BY CityCode, DATEADD(hour, DATEDIFF(hour, 0, Date_gt), 0)
+    ) AS source
+    ON target.CityCode = source.CityCode AND target.HourStart = source.HourStart
+    WHEN MATCHED THEN
+        UPDATE SET
+            TempSum = source.TempSum,
+            TempCount = source.TempCount,
+            HumiditySum = source.HumiditySum,
+            HumidityCount = source.HumidityCount,
+            PressureSum = source.PressureSum,
+            PressureCount = source.PressureCount,
+            Rain1hSum = source.Rain1hSum,
+            Rain3hSum = source.Rain3hSum,
+            SampleCount = source.SampleCount,
+            UpdatedAt = SYSUTCDATETIME()
+    WHEN NOT MATCHED BY TARGET THEN
+        INSERT (CityCode, HourStart, TempSum, TempCount, HumiditySum, HumidityCount,
+                PressureSum, PressureCount, Rain1hSum, Rain3hSum, SampleCount)
+        VALUES (source.CityCode, source.HourStart, source.TempSum, source.TempCount, source.HumiditySum,
+                source.HumidityCount, source.PressureSum, source.PressureCount, source.Rain1hSum,
+                source.Rain3hSum, source.SampleCount);
+END;
+GO
+
+/*
+Description: Builds the hourly rollup from the existing raw weather data.
+
+Procedure: weather.BackfillWeatherHourlyRollup
+Parameters:
+    @Days - How many days back to rebuild (NULL = everything in weather.WeatherData)
+
+Usage:
+EXEC weather.BackfillWeatherHourlyRollup;
+EXEC weather.BackfillWeatherHourlyRollup @Days = 5;
+
+Notes:
+    - Works one day per transaction to keep locks and log growth small.
+*/
+CREATE PROCEDURE weather.BackfillWeatherHourlyRollup
+    @Days INT = NULL
+AS
+BEGIN
+    SET NOCOUNT ON;
+
+    DECLARE @Start SMALLDATETIME;
+    IF @Days IS NULL
+        SELECT @Start = MIN(Date_gt) FROM weather.WeatherData;
+    ELSE
+        SET @Start = DATEADD(day, -@Days, GETDATE());
+
+    IF @Start IS NULL
+        RETURN;
+
+    DECLARE @DayStart SMALLDATETIME = CAST(CAST(@Start AS DATE) AS SMALLDATETIME);
+    DECLARE @DayEnd SMALLDATETIME;
+
+    WHILE @DayStart <= GETDATE()
+    BEGIN
+        SET @DayEnd = DATEADD(day, 1, @DayStart);
+        EXEC weather.RefreshWeatherHourlyRollup @FromDate = @DayStart, @ToDate = @DayEnd;
+        PRINT 'Rolled up ' + CONVERT(VARCHAR(10), @DayStart, 120);
+        SET @DayStart = @DayEnd;
+    END;
+END;
+GO
@@ -5,6 +5,7 @@ CREATE TABLE weather.cities (
     Longitude FLOAT NOT NULL,
     ElevationMeters INT NULL,
     SoilType NVARCHAR(30) NULL,
-    ClimateZone NVARCHAR(30) NULL
+    ClimateZone NVARCHAR(30) NULL,
+    OwmCityId INT NULL -- OpenWeatherMap city id, resolved once by run_city_batch for /group requests
 );
 GO
\ No newline at end of file
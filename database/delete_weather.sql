@@ -1,33 +1,52 @@
-
 /*
-Description: This stored procedure deletes weather data that is older than 5 days from the weather.WeatherData table.
+Description: This stored procedure deletes weather data that is older than the retention windows.
 
 Procedure: weather.Delete_weather
-Parameters: None
+Parameters:
+    @RawDays    - Days of raw observations kept in weather.WeatherData (default 2)
+    @RollupDays - Days of hourly history kept in weather.WeatherHourlyRollup (default 60)
 Returns: None
 
 Usage:
 EXEC weather.Delete_weather;
 
 Notes:
-    - The procedure uses the DATEADD function to calculate the date 5 days before the current date.
+    - The procedure uses the DATEADD function to calculate the retention cutoffs.
+    - Charts read weather.WeatherHourlyRollup, so raw rows can be dropped sooner
+      than the history the frontend shows (up to 60 days).
     - The SET NOCOUNT ON statement is used to prevent the message indicating 
       the number of rows affected by a T-SQL statement from being returned.
 */
 
 CREATE PROCEDURE weather.Delete_weather
+    @RawDays INT = 2,
+    @RollupDays INT = 60
 AS
 BEGIN
     SET NOCOUNT ON;
     
+    -- Make sure every hour about to be deleted is in the rollup
+    DECLARE @RawCutoff SMALLDATETIME = DATEADD(DAY, -@RawDays, GETDATE());
+    DECLARE @OldestRaw SMALLDATETIME = (SELECT MIN(Date_gt) FROM weather.WeatherData);
+    IF @OldestRaw < @RawCutoff
+        EXEC weather.RefreshWeatherHourlyRollup @FromDate = @OldestRaw, @ToDate = @RawCutoff;
+
     -- Delete from WeatherData
     DELETE FROM weather.WeatherData
-    WHERE Date_gt < DATEADD(DAY, -5, GETDATE());
+    WHERE Date_gt < DATEADD(hour, DATEDIFF(hour, 0, @RawCutoff), 0);
+
+    -- Delete from WeatherHourlyRollup
+    DELETE FROM weather.WeatherHourlyRollup
+    WHERE HourStart < DATEADD(DAY, -@RollupDays, GETDATE());
 
     -- Delete from WeatherForecast
     DELETE FROM weather.WeatherForecast
     WHERE ForecastDate < DATEADD(DAY, -5, GETDATE());
 
+    -- Delete past hours from the hot forecast table
+    DELETE FROM weather.WeatherForecastCurrent
+    WHERE EffectiveDate < DATEADD(DAY, -5, GETDATE());
+
     -- Delete from AirQuality
     DELETE FROM weather.AirQuality
     WHERE Date_gt < DATEADD(DAY, -5, GETDATE());
@@ -3,7 +3,7 @@ AS
 BEGIN
     SET NOCOUNT ON;
 
-    SELECT CityCode, CityName, Latitude, Longitude 
+    SELECT CityCode, CityName, Latitude, Longitude, OwmCityId
 FROM weather.cities
 ORDER BY cityName;
 END;
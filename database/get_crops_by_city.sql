@@ -54,58 +54,17 @@ BEGIN
         @CurrentTemp AS CurrentTemp,
         @CurrentHumidity AS CurrentHumidity,
         
-        -- Dynamic suitability calculation
-        CASE 
-            WHEN @CurrentTemp IS NOT NULL AND @CurrentHumidity IS NOT NULL THEN
-                agriculture.CalculateSuitabilityScore(
-                    @CurrentTemp, 
-                    @CurrentHumidity, 
-                    cr.OptimalTempMin, 
-                    cr.OptimalTempMax, 
-                    cr.OptimalHumidityMin, 
-                    cr.OptimalHumidityMax, 
-                    cr.StressTempMin, 
-                    cr.StressTempMax, 
-                    cc.LocalTempAdjustment, 
-                    cc.LocalHumidityAdjustment
-                )
-            ELSE cc.SuitabilityScore
-        END AS CurrentSuitabilityScore,
+        -- Dynamic suitability, materialized per tick in agriculture.CityCropScore
+        -- (falls back to the static regional score without a current observation)
+        score.CurrentSuitabilityScore,
         
         -- Suitability label
         CASE 
-            WHEN @CurrentTemp IS NOT NULL AND @CurrentHumidity IS NOT NULL THEN
-                CASE 
-                    WHEN agriculture.CalculateSuitabilityScore(
-                        @CurrentTemp, @CurrentHumidity, cr.OptimalTempMin, cr.OptimalTempMax, 
-                        cr.OptimalHumidityMin, cr.OptimalHumidityMax, cr.StressTempMin, 
-                        cr.StressTempMax, cc.LocalTempAdjustment, cc.LocalHumidityAdjustment
-                    ) >= 85 THEN 'EXCELLENT'
-                    WHEN agriculture.CalculateSuitabilityScore(
-                        @CurrentTemp, @CurrentHumidity, cr.OptimalTempMin, cr.OptimalTempMax, 
-                        cr.OptimalHumidityMin, cr.OptimalHumidityMax, cr.StressTempMin, 
-                        cr.StressTempMax, cc.LocalTempAdjustment, cc.LocalHumidityAdjustment
-                    ) >= 70 THEN 'VERY_GOOD'
-                    WHEN agriculture.CalculateSuitabilityScore(
-                        @CurrentTemp, @CurrentHumidity, cr.OptimalTempMin, cr.OptimalTempMax, 
-                        cr.OptimalHumidityMin, cr.OptimalHumidityMax, cr.StressTempMin, 
-                        cr.StressTempMax, cc.LocalTempAdjustment, cc.LocalHumidityAdjustment
-                    ) >= 50 THEN 'FAIR'
-                    WHEN agriculture.CalculateSuitabilityScore(
-                        @CurrentTemp, @CurrentHumidity, cr.OptimalTempMin, cr.OptimalTempMax, 
-                        cr.OptimalHumidityMin, cr.OptimalHumidityMax, cr.StressTempMin, 
-                        cr.StressTempMax, cc.LocalTempAdjustment, cc.LocalHumidityAdjustment
-                    ) >= 30 THEN 'POOR'
-                    ELSE 'STRESS'
-                END
-            ELSE 
-                CASE 
-                    WHEN cc.SuitabilityScore >= 85 THEN 'EXCELLENT'
-                    WHEN cc.SuitabilityScore >= 70 THEN 'VERY_GOOD'
-                    WHEN cc.SuitabilityScore >= 50 THEN 'FAIR'
-                    WHEN cc.SuitabilityScore >= 30 THEN 'POOR'
-                    ELSE 'STRESS'
-                END
+            WHEN score.CurrentSuitabilityScore >= 85 THEN 'EXCELLENT'
+            WHEN score.CurrentSuitabilityScore >= 70 THEN 'VERY_GOOD'
+            WHEN score.CurrentSuitabilityScore >= 50 THEN 'FAIR'
+            WHEN score.CurrentSuitabilityScore >= 30 THEN 'POOR'
+            ELSE 'STRESS'
         END AS SuitabilityLabel,
         
         -- Seasonal information
@@ -177,18 +136,18 @@ BEGIN
     FROM weather.cities c
     INNER JOIN agriculture.CityCrops cc ON c.CityCode = cc.CityCode
     INNER JOIN agriculture.Crops cr ON cc.CropID = cr.CropID
+    LEFT JOIN agriculture.CityCropScore ccs ON ccs.CityCode = cc.CityCode AND ccs.CropID = cc.CropID
+    CROSS APPLY (
+        SELECT CASE 
+            WHEN @CurrentTemp IS NOT NULL AND @CurrentHumidity IS NOT NULL THEN
+                COALESCE(ccs.SuitabilityScore, cc.SuitabilityScore)
+            ELSE cc.SuitabilityScore
+        END AS CurrentSuitabilityScore
+    ) score
     WHERE c.CityCode = @CityCode
       AND cr.IsActive = 1
     ORDER BY 
-        CASE 
-            WHEN @CurrentTemp IS NOT NULL AND @CurrentHumidity IS NOT NULL THEN
-                agriculture.CalculateSuitabilityScore(
-                    @CurrentTemp, @CurrentHumidity, cr.OptimalTempMin, cr.OptimalTempMax, 
-                    cr.OptimalHumidityMin, cr.OptimalHumidityMax, cr.StressTempMin, 
-                    cr.StressTempMax, cc.LocalTempAdjustment, cc.LocalHumidityAdjustment
-                )
-            ELSE cc.SuitabilityScore
-        END DESC, 
+        score.CurrentSuitabilityScore DESC, 
         cc.IsPrimary DESC;
 END;
 GO
@@ -5,22 +5,19 @@ AS
 BEGIN
     SET NOCOUNT ON;
     
+    -- Hourly averages come from the rollup maintained by run_city_batch
     SELECT
-        -- Group by hour, create a datetime for the start of each hour
-        DATEADD(hour, DATEDIFF(hour, 0, Date_gt), 0) AS CollectionDate,
+        HourStart AS CollectionDate,
         
-        -- Average all the measures for each hour
-        AVG(CAST(Main_Humidity AS FLOAT)) AS Main_Humidity,
-        isnull(str(AVG(ISNULL(Rain_1h, 0)),12,2),'0') as Rain_1h,
-        isnull(str(AVG(ISNULL(Rain_3h, 0)),12,2),'0') as Rain_3h,
-        AVG(Main_Temp) AS Main_Temp,
-        AVG(CAST(Main_Pressure AS FLOAT)) AS Main_Pressure
-    FROM weather.WeatherData
+        -- Averages of the observations in each hour
+        HumiditySum / NULLIF(HumidityCount, 0) AS Main_Humidity,
+        isnull(str(Rain1hSum / NULLIF(SampleCount, 0),12,2),'0') as Rain_1h,
+        isnull(str(Rain3hSum / NULLIF(SampleCount, 0),12,2),'0') as Rain_3h,
+        TempSum / NULLIF(TempCount, 0) AS Main_Temp,
+        PressureSum / NULLIF(PressureCount, 0) AS Main_Pressure
+    FROM weather.WeatherHourlyRollup
     WHERE CityCode = @CityCode
-      AND Date_gt >= DATEADD(day, -@Days, GETDATE())
-    GROUP BY 
-        -- Group by year, month, day, and hour
-        DATEADD(hour, DATEDIFF(hour, 0, Date_gt), 0)
+      AND HourStart >= DATEADD(hour, DATEDIFF(hour, 0, DATEADD(day, -@Days, GETDATE())), 0)
     ORDER BY CollectionDate DESC;
 END;
 GO
@@ -5,8 +5,33 @@ BEGIN
     SET NOCOUNT ON;
 
     -- Get the next 12 hours of hourly forecast data
-    -- Only the most recent forecast for each effective date
     -- Ordered from soonest to latest (chronological order)
+    IF EXISTS (SELECT 1 FROM weather.WeatherForecastCurrent WHERE CityCode = @CityCode)
+    BEGIN
+        -- Hot table holds only the latest forecast per hour: clustered range seek
+        SELECT TOP (12)
+            CityCode,
+            ForecastDate,
+            EffectiveDate,
+            IconPhrase,
+            Phrase,
+            Temperature,
+            RealFeelTemperature,
+            HasPrecipitation,
+            PrecipitationType,
+            PrecipitationIntensity,
+            PrecipitationProbability,
+            TotalLiquid,
+            Rain
+        FROM weather.WeatherForecastCurrent
+        WHERE CityCode = @CityCode
+          AND EffectiveDate >= GETDATE()  -- Only future forecasts
+        ORDER BY EffectiveDate ASC;
+        RETURN;
+    END;
+
+    -- Fallback while the forecast job still runs in append mode:
+    -- only the most recent forecast for each effective date
     WITH RankedForecasts AS (
         SELECT *,
                ROW_NUMBER() OVER (